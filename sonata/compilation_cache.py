@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+"""
+Content-addressed cache for compilation results (query plans, generated P4 code, compiled P4 json).
+Each entry is a directory named after the hash of everything its content depends on, holding one
+file per artifact. Reading an entry marks it as recently used, the least recently used entries are
+removed once the cache holds more than max_entries.
+"""
+
+CACHE_MAX_ENTRIES = 16
+
+
+def get_cache_key(*parts):
+    key = hashlib.sha1()
+    for part in parts:
+        key.update(str(part))
+        key.update('\0')
+    return key.hexdigest()
+
+
+def get_file_version(path):
+    """
+    Version of a tool or input file for cache keys: its path, size and modification time
+    """
+    try:
+        stat = os.stat(path)
+        return '%s:%i:%i' % (path, stat.st_size, stat.st_mtime)
+    except OSError:
+        return path
+
+
+class CompilationCache(object):
+    def __init__(self, cache_dir, max_entries=CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get(self, key):
+        """
+        Returns the artifacts of the entry as name -> content, None if it is not cached
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return None
+        entry = dict()
+        for name in os.listdir(entry_dir):
+            with open(os.path.join(entry_dir, name), 'rb') as f:
+                entry[name] = f.read()
+        os.utime(entry_dir, None)
+        return entry
+
+    def put(self, key, artifacts):
+        # written to a temporary directory first, so readers never see a partial entry
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        for name, content in artifacts.iteritems():
+            with open(os.path.join(tmp_dir, name), 'wb') as f:
+                f.write(content)
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # stored concurrently by someone else
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if not name.startswith('.tmp_')]
+        entries.sort(key=lambda path: os.stat(path).st_mtime)
+        for entry_dir in entries[:max(0, len(entries) - self.max_entries)]:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def get_compilation_cache(cache_dir, max_entries=CACHE_MAX_ENTRIES):
+    """
+    Returns the cache for the cache_dir of the conf, None if caching is disabled
+    """
+    if not cache_dir:
+        return None
+    return CompilationCache(cache_dir, max_entries)
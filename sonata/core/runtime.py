@@ -5,11 +5,11 @@
 import logging
 import pickle
 import time
-from multiprocessing.connection import Client, Listener
+from Queue import Queue
 from threading import Thread
 
 # from sonata.core.training.hypothesis.hypothesis import Hypothesis
-from sonata.streaming_driver.streaming_driver import StreamingDriver
+from sonata.streaming_driver.native_driver import NativeStreamingDriver
 
 # # from sonata.core.training.weights.training_data import TrainingData
 # from sonata.core.training.utils import get_spark_context_batch, create_spark_context
@@ -20,9 +20,13 @@ from sonata.core.partition import get_dataplane_query, get_streaming_query
 
 from sonata.core.integration import Target
 from sonata.dataplane_driver.dp_driver import DataplaneDriver
+from sonata.dataplane_driver.p4.emitter.emitter_transport import FRAME_SIZE, check_frame_size
 from sonata.sonata_layers import *
 from sonata.streaming_driver.query_object import PacketStream as SP_QO
 from sonata.core.utils import copy_sonata_operators_to_sp_query, flatten_streaming_field_names
+from sonata.message_bus import MessageClient, MessageServer
+from sonata.wire_format import encode_message, decode_message, WIRE_VERSION
+from sonata.compilation_cache import get_compilation_cache, get_cache_key, CACHE_MAX_ENTRIES
 
 
 class Runtime(object):
@@ -35,12 +39,17 @@ class Runtime(object):
     query_out_final = {}
     op_handler_socket = None
     op_handler_listener = None
+    # (out_qid, src_qid) -> keys currently installed in the filter table of out_qid
+    installed_keys = {}
 
     def __init__(self, conf, queries):
+        self.check_transport(conf)
         self.conf = conf
         self.refinement_keys = conf["refinement_keys"]
         self.GRAN_MAX = conf["GRAN_MAX"]
         self.GRAN = conf["GRAN"]
+        # side-file dump of the messages sent to the dataplane driver, for debugging
+        self.dump_messages = conf.get("dump_messages", False)
         self.queries = queries
         self.initialize_logging()
         self.target_id = 1
@@ -48,12 +57,22 @@ class Runtime(object):
 
         self.sonata_fields = self.get_sonata_layers()
 
-        use_pickled_queries = False
-        if use_pickled_queries:
-            with open('pickled_queries.pickle', 'r') as f:
-                pickled_queries = pickle.load(f)
-                self.dp_queries = pickled_queries[0]
-                self.sp_queries = pickled_queries[1]
+        # an unchanged query set and plan are loaded from the compilation cache instead of being refined again
+        self.query_cache = get_compilation_cache(conf.get("cache_dir"), conf.get("cache_max_entries", CACHE_MAX_ENTRIES))
+        plan_key = self.get_plan_key(conf)
+        cached_plan = None
+        if self.query_cache is not None:
+            cached_plan = self.query_cache.get(plan_key)
+
+        if cached_plan is not None:
+            print "Query plan loaded from the cache", plan_key
+            plan = decode_message(cached_plan['plan'])
+            self.dp_queries = plan['dp_queries']
+            self.sp_queries = plan['sp_queries']
+            self.query_in_mappings = plan['query_in_mappings']
+            self.query_out_mappings = plan['query_out_mappings']
+            self.query_out_final = plan['query_out_final']
+            join_queries = plan['join_queries']
         else:
             # Learn the query plan
             for query in self.queries:
@@ -96,20 +115,26 @@ class Runtime(object):
 
                 self.update_query_mappings(refinement_object, final_plan)
 
-            with open('pickled_queries.pickle', 'w') as f:
-                pickle.dump({0: self.dp_queries, 1: self.sp_queries}, f)
+            if has_join:
+                self.sp_queries[query.qid] = sp_join_query
 
+            if self.query_cache is not None:
+                self.query_cache.put(plan_key, {'plan': encode_message({'dp_queries': self.dp_queries,
+                                                                        'sp_queries': self.sp_queries,
+                                                                        'query_in_mappings': self.query_in_mappings,
+                                                                        'query_out_mappings': self.query_out_mappings,
+                                                                        'query_out_final': self.query_out_final,
+                                                                        'join_queries': join_queries})})
 
-
-        if has_join:
-            self.sp_queries[query.qid] = sp_join_query
         print "Dataplane Queries", self.dp_queries
         print "\n\n"
         print "Streaming Queries", self.sp_queries
 
         # time.sleep(10)
+        # persistent connections to the drivers, they are connected once their listeners are up
+        self.dp_client = MessageClient(self.conf['fm_conf']['fm_socket'])
+        self.sm_client = MessageClient(self.conf['sm_conf']['sm_socket'])
         self.initialize_handlers()
-        time.sleep(2)
         self.send_init_to_dp_driver('init', self.sonata_fields, self.dp_queries)
         print "*********************************************************************"
         print "*                   Updating Dataplane Driver                       *"
@@ -124,6 +149,31 @@ class Runtime(object):
         self.streaming_driver_thread.join()
         self.op_handler_thread.join()
 
+    def check_transport(self, conf):
+        """
+        Only the native stream processor decodes the binary frames of the emitter, Spark reads text lines
+        """
+        sp = conf.get('sp', 'spark')
+        for name in ['emitter_conf', 'sm_conf']:
+            transport = conf.get(name, {}).get('transport', 'text')
+            if transport not in ['text', 'binary']:
+                raise ValueError('%s: unknown transport %s' % (name, transport))
+            if transport == 'binary' and sp != 'native':
+                raise ValueError('%s: the binary transport needs the native stream processor, sp is %s' % (name, sp))
+        if conf.get('emitter_conf', {}).get('transport', 'text') != conf.get('sm_conf', {}).get('transport', 'text'):
+            raise ValueError('the emitter and the stream processor have to use the same transport')
+        if conf.get('emitter_conf', {}).get('transport', 'text') == 'binary':
+            check_frame_size(conf['emitter_conf'].get('frame_size', FRAME_SIZE))
+
+    def get_plan_key(self, conf):
+        """
+        Cache key of the query plan: the queries, the final plan, the refinement settings and the fields mapping
+        """
+        with open('sonata/fields_mapping.json') as f:
+            fields_mapping = f.read()
+        return get_cache_key('query_plan', WIRE_VERSION, [(query.qid, repr(query)) for query in self.queries],
+                             conf["final_plan"], self.refinement_keys, self.GRAN_MAX, self.GRAN, fields_mapping)
+
     def query_has_join_in_same_window(self, query, sonata_fields):
         if query.left_child is not None and query.window == 'Same':
             right_query_operator = query.right_child.operators[-1]
@@ -163,20 +213,7 @@ class Runtime(object):
         with open('sonata/fields_mapping.json') as json_data_file:
             data = json.load(json_data_file)
 
-        field_that_determines_child = None
-        if "field_that_determines_child" in data[INITIAL_LAYER][layer_2_target[INITIAL_LAYER]]: field_that_determines_child = data[INITIAL_LAYER][layer_2_target[INITIAL_LAYER]]["field_that_determines_child"]
-        layers = SonataLayer(INITIAL_LAYER,
-                             data,
-                             fields=data[INITIAL_LAYER][layer_2_target[INITIAL_LAYER]]["fields"],
-                             offset=data[INITIAL_LAYER][layer_2_target[INITIAL_LAYER]],
-                             parent_layer=None,
-                             child_layers=data[INITIAL_LAYER][layer_2_target[INITIAL_LAYER]]["child_layers"],
-                             field_that_determines_child=field_that_determines_child,
-                             is_payload=data[INITIAL_LAYER][layer_2_target[INITIAL_LAYER]]["in_payload"],
-                             layer_2_target=layer_2_target
-                             )
-
-        sonataFields = SonataRawFields(layers)
+        sonataFields = get_sonata_raw_fields(data, layer_2_target, INITIAL_LAYER)
 
         return sonataFields
 
@@ -208,19 +245,23 @@ class Runtime(object):
     def start_op_handler(self):
         """
         At the end of each window interval, two things need to happen for each query (in order),
-        (1) registers and filter tables need to be flushed, (2) Filter tables need to get updated.
-        We tried to do (1) and (2) for each query independently, but struggled as there were no
-        easy way to flush specific registers for a query. So what we ended up doing was to wait
-        for o/p from all queries, use the reset command to flush all registers/tables at once,
-        and then update them with the delta commands. I am sure there is a better way of solving
-        this reset and update problem.
+        (1) registers need to be flushed, (2) Filter tables need to get updated. Once the o/p of all
+        queries is received, the delta config (possibly empty) is sent to the dataplane driver, which
+        flips the epoch of the switch so that the next window updates the other bank of registers,
+        applies the filter table updates, and resets the registers of the previous window in the
+        background.
         """
         # Start the output handler
         # It receives output for each query in SP
         # It sends output of the coarser queries to the dataplane driver or
         # SM depending on where filter operation is applied (mostly DP)
         self.op_handler_socket = tuple(self.conf['sm_conf']['op_handler_socket'])
-        self.op_handler_listener = Listener(self.op_handler_socket)
+        # the stream processor keeps its connection open, its messages are handled here in order
+        op_queue = Queue()
+        self.op_handler_listener = MessageServer(self.op_handler_socket, op_queue.put)
+        op_server_thread = Thread(name='op_handler_server', target=self.op_handler_listener.serve_forever)
+        op_server_thread.setDaemon(True)
+        op_server_thread.start()
 
         start = "%.20f" % time.time()
 
@@ -228,9 +269,8 @@ class Runtime(object):
         updateDeltaConfig = False
         while True:
             # print "Ready to receive data from SM ***************************"
-            conn = self.op_handler_listener.accept()
             # Expected (qid,[])
-            op_data = conn.recv_bytes()
+            op_data = op_queue.get()
             op_data = op_data.strip('\n')
             # print "$$$$ OP Handler received:" + str(op_data)
             received_data = op_data.split(",")
@@ -246,19 +286,23 @@ class Runtime(object):
 
             print "Query Out Mappings: ", self.query_out_mappings
             delta_config = {}
+            window_done = updateDeltaConfig
             # print "## Received output for query", src_qid, "at time", time.time() - start
             if updateDeltaConfig:
                 start = "%.20f" % time.time()
                 for src_qid in queries_received:
                     if src_qid in self.query_out_mappings:
-                        table_match_entries = queries_received[src_qid]
-                        if len(table_match_entries) > 0:
-                            out_queries = self.query_out_mappings[src_qid]
-                            for out_qid in out_queries:
-                                # find the queries that take the output of this query as input
-                                # print out_qid, src_qid
-                                delta_config[(out_qid, src_qid)] = table_match_entries
-                                # reset these state variables
+                        table_match_entries = set([entry.strip('\n') for entry in queries_received[src_qid]])
+                        out_queries = self.query_out_mappings[src_qid]
+                        for out_qid in out_queries:
+                            # find the queries that take the output of this query as input
+                            # and only send the keys that were added or removed since the last window
+                            installed = self.installed_keys.get((out_qid, src_qid), set())
+                            additions = sorted(table_match_entries - installed)
+                            removals = sorted(installed - table_match_entries)
+                            if additions or removals:
+                                delta_config[(out_qid, src_qid)] = (additions, removals)
+                            self.installed_keys[(out_qid, src_qid)] = table_match_entries
                 print "delta config: ", delta_config
                 updateDeltaConfig = False
                 if delta_config != {}: self.logger.info(
@@ -266,14 +310,14 @@ class Runtime(object):
                 queries_received = {}
 
             # TODO: Update the send_to_dp_driver function logic
-            # now send this delta config to fabric manager and update the filter tables
-            if delta_config != {}:
-                IP = ""
-                for qid_key in delta_config.keys():
-                    IP = delta_config[qid_key]
+            # now send this delta config to fabric manager and update the filter tables, every window as the
+            # dataplane driver starts the next window when it receives it
+            if window_done:
+                n_additions = sum([len(additions) for (additions, _) in delta_config.values()])
+                n_removals = sum([len(removals) for (_, removals) in delta_config.values()])
 
                 print "*********************************************************************"
-                print "*                   IP " + IP[0] + " satisfies coarser query            *"
+                print "*                   " + str(n_additions) + " keys added, " + str(n_removals) + " keys removed"
                 print "*                   Reconfiguring Data Plane                        *"
                 print "*********************************************************************\n\n"
 
@@ -302,7 +346,9 @@ class Runtime(object):
                 'cli_path': '/sswitch_CLI',
                 'thriftport': 22222,
                 'p4_commands': 'commands.txt',
-                'p4_delta_commands': 'delta_commands.txt'
+                'p4_delta_commands': 'delta_commands.txt',
+                'cache_dir': self.conf.get('cache_dir'),
+                'cache_max_entries': self.conf.get('cache_max_entries', CACHE_MAX_ENTRIES)
             }
         }
         dpd.add_target(p4_type, self.target_id, config)
@@ -317,7 +363,12 @@ class Runtime(object):
     def start_streaming_driver(self):
         # Start streaming managers local to each stream processor
         # self.conf['sm_conf']['sc']=self.sc
-        sm = StreamingDriver(self.conf['sm_conf'])
+        if self.conf.get('sp', 'spark') == 'native':
+            sm = NativeStreamingDriver(self.conf['sm_conf'])
+        else:
+            # only import pyspark when spark is the stream processor
+            from sonata.streaming_driver.streaming_driver import StreamingDriver
+            sm = StreamingDriver(self.conf['sm_conf'])
         sm.start()
         while True:
             time.sleep(5)
@@ -332,29 +383,25 @@ class Runtime(object):
     def send_to_sm(self, join_queries):
         # Send compiled query expression to streaming manager
         start = "%.20f" % time.time()
-        serialized_queries = pickle.dumps({'queries': self.sp_queries, 'join_queries': join_queries})
-        conn = Client(tuple(self.conf['sm_conf']['sm_socket']))
-        conn.send(serialized_queries)
+        # returns once the streaming driver installed the queries
+        self.sm_client.request(encode_message({'queries': self.sp_queries, 'join_queries': join_queries}))
         self.logger.info("runtime,sm_init," + str(start) + "," + str(time.time()))
         print "*********************************************************************"
         print "*                   Updating Streaming Driver                       *"
         print "*********************************************************************\n\n"
-        time.sleep(3)
 
     def send_init_to_dp_driver(self, message_type, sonata_fields, content):
         # Send compiled query expression to fabric manager
         start = "%.20f" % time.time()
 
-        with open('dns_reflection.pickle', 'w') as f:
-            pickle.dump(content, f)
+        if self.dump_messages:
+            with open('dns_reflection.pickle', 'w') as f:
+                pickle.dump(content, f)
 
         message = {message_type: {0: content, 1: self.target_id, 2: sonata_fields}}
-        serialized_queries = pickle.dumps(message)
-        conn = Client(tuple(self.conf['fm_conf']['fm_socket']))
-        conn.send(serialized_queries)
+        # returns once the dataplane driver configured the target
+        self.dp_client.request(encode_message(message))
         self.logger.info("runtime,fm_" + message_type + "," + str(start) + ",%.20f" % time.time())
-        time.sleep(1)
-        conn.close()
         print "*********************************************************************"
         print "*                   Updating Dataplane Driver                       *"
         print "*********************************************************************\n\n"
@@ -364,16 +411,14 @@ class Runtime(object):
         # Send compiled query expression to fabric manager
         start = "%.20f" % time.time()
 
-        with open('dns_reflection.pickle', 'w') as f:
-            pickle.dump(content, f)
+        if self.dump_messages:
+            with open('dns_reflection.pickle', 'w') as f:
+                pickle.dump(content, f)
 
         message = {message_type: {0: content, 1: self.target_id}}
-        serialized_queries = pickle.dumps(message)
-        conn = Client(tuple(self.conf['fm_conf']['fm_socket']))
-        conn.send(serialized_queries)
+        # does not wait for the update to be applied, only blocks while too many updates are in flight
+        self.dp_client.send(encode_message(message))
         self.logger.info("runtime,fm_" + message_type + "," + str(start) + ",%.20f" % time.time())
-        time.sleep(1)
-        conn.close()
         print "*********************************************************************"
         print "*                   Updating Dataplane Driver                       *"
         print "*********************************************************************\n\n"
@@ -386,7 +431,6 @@ class Runtime(object):
         # self.fm_thread.setDaemon(True)
         self.streaming_driver_thread.start()
         self.op_handler_thread.start()
-        time.sleep(1)
 
     def initialize_logging(self):
         # print "######Setup Logger##########",self.conf['log_file']
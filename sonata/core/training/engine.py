@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import numpy as np
+from netaddr import IPNetwork
+
+from sonata.streaming_driver.columnar import ColumnarQuery, ColumnBatch, UnsupportedOperator, \
+    to_column, get_field_kind, KIND_IP, KIND_NUM
+from sonata.streaming_driver.native_driver import WindowRDD
+from training_data import TrainingData, get_training_data_from_records
+
+"""
+Execution engine for the training queries. The training data is one NumPy column per field (see
+training_data.py) and the refined queries run on these columns for many windows at once, ts being
+an implicit key of every operator. Queries that share a prefix of operators (the iterations of a refined
+query, or the same operators at another refinement level) share the result of that prefix, and the
+transit costs are computed from per window group-by results instead of Spark joins.
+"""
+
+TS = 'ts'
+
+
+class WindowedQuery(ColumnarQuery):
+    """
+    Runs the operators of a refined query over the columns of the whole training data. The maps keep
+    ts as a key, so the reductions and distincts are done per window.
+    """
+    def get_map(self, operator):
+        map_step = ColumnarQuery.get_map(self, operator)
+
+        def windowed_map_step(batch):
+            result = map_step(batch)
+            if TS not in result.keys:
+                result.columns[TS] = batch.columns[TS]
+                result.keys = [TS] + result.keys
+            return result
+        return windowed_map_step
+
+
+def get_prefix_mask(ref_level):
+    return np.uint32((0xffffffff << (32 - int(ref_level))) & 0xffffffff)
+
+
+def get_batch_from_records(records, keys, values):
+    """
+    Returns the columns of the records of a query, whose last operator has these keys and values
+    """
+    keys = list(keys)
+    values = list(values)
+    if len(values) > 0:
+        key_rows = [record[0] for record in records]
+        value_rows = [record[1] for record in records]
+    else:
+        key_rows = records
+        value_rows = []
+    if len(keys) == 1:
+        key_rows = [(key,) for key in key_rows]
+    if len(values) == 1:
+        value_rows = [(value,) for value in value_rows]
+
+    columns = {}
+    key_columns = zip(*key_rows) if records else [() for _ in keys]
+    for key, column in zip(keys, key_columns):
+        columns[key] = to_column(list(column), get_field_kind(key))
+    value_columns = zip(*value_rows) if records else [() for _ in values]
+    for value, column in zip(values, value_columns):
+        columns[value] = (np.array(column), KIND_NUM)
+    if TS not in columns:
+        raise UnsupportedOperator('output without ' + TS)
+    return ColumnBatch(columns, keys, values, len(records))
+
+
+def concatenate_batches(batches):
+    batch = batches[0]
+    if len(batches) == 1:
+        return batch
+    columns = dict((fld, (np.concatenate([part.columns[fld][0] for part in batches]), batch.columns[fld][1]))
+                   for fld in batch.keys + batch.values)
+    return ColumnBatch(columns, batch.keys, batch.values, sum(part.size for part in batches))
+
+
+class TrainingEngine(object):
+    """
+    Runs the refined queries of Counts over the training data and computes the per window transit
+    costs from their outputs. The training data is processed in chunks of whole windows, as slices
+    of its columns, and all the queries run on a chunk before the next one is read.
+    """
+    def __init__(self, training_data, fields, refinement_key):
+        if not isinstance(training_data, TrainingData):
+            training_data = get_training_data_from_records(training_data, fields)
+        self.training_data = training_data
+        self.refinement_key = refinement_key
+        self.timestamps = training_data.timestamps
+        self.ts_min = int(self.timestamps[0]) if len(self.timestamps) > 0 else 0
+
+        # ref_level -> (sorted keys, number of records per key) of the output at this level
+        self.level_keys = {}
+
+    def run_queries(self, queries):
+        """
+        Returns the output batch of each query (name -> query) over all the windows of the training data
+        """
+        outputs = dict((name, []) for name in queries)
+        for start, end in self.training_data.iter_chunks():
+            batch = ColumnBatch(self.training_data.get_columns(start, end), self.training_data.fields, [],
+                                end - start)
+            # operator expressions -> batch, for the prefixes of the queries run on this chunk so far
+            prefix_batches = {(): batch}
+            for name, query in queries.iteritems():
+                outputs[name].append(self.run(query, prefix_batches, start, end))
+        for name, query in queries.iteritems():
+            if not outputs[name]:
+                # no training data
+                outputs[name].append(self.run(query, {(): ColumnBatch(self.training_data.get_columns(0, 0),
+                                                                    self.training_data.fields, [], 0)}, 0, 0))
+        return dict((name, concatenate_batches(batches)) for name, batches in outputs.iteritems())
+
+    def run(self, query, prefix_batches, start, end):
+        operators = tuple(operator.compile() for operator in query.operators)
+        if operators in prefix_batches:
+            return prefix_batches[operators]
+
+        try:
+            steps = WindowedQuery(query).steps
+            # continue from the longest prefix that was already computed
+            prefix_length = len(operators)
+            while operators[:prefix_length] not in prefix_batches:
+                prefix_length -= 1
+            batch = prefix_batches[operators[:prefix_length]]
+            for index in range(prefix_length, len(operators)):
+                batch = steps[index](batch)
+                prefix_batches[operators[:index + 1]] = batch
+        except UnsupportedOperator as e:
+            print "Running", query.qid, "on records:", e
+            batch = self.run_records(query, start, end)
+            prefix_batches[operators] = batch
+        return batch
+
+    def run_records(self, query, start, end):
+        training_data = WindowRDD(self.training_data.get_records(start, end))
+        out = eval('training_data.' + query.compile().replace('self.training_data.', 'training_data.')).collect()
+        return get_batch_from_records(out, query.operators[-1].keys, query.operators[-1].values)
+
+    def get_key_codes(self, batch, ref_level):
+        # (ts, refinement key masked to ref_level) in a single int64
+        ts = batch.columns[TS][0].astype(np.int64) - self.ts_min
+        array, kind = batch.columns[self.refinement_key]
+        if kind != KIND_IP:
+            raise UnsupportedOperator('refinement key ' + self.refinement_key)
+        return (ts << 32) | (array & get_prefix_mask(ref_level)).astype(np.int64)
+
+    def set_level_output(self, ref_level, batch):
+        """
+        Sets the output of the final query at ref_level, later levels only keep its keys
+        """
+        codes, counts = np.unique(self.get_key_codes(batch, ref_level), return_counts=True)
+        self.level_keys[ref_level] = (codes, counts)
+
+    def select_level_output(self, batch, ref_level_prev):
+        """
+        Returns the records of the batch whose key is in the output at ref_level_prev, once per match
+        """
+        if batch.size == 0:
+            return batch
+        codes, counts = self.level_keys[ref_level_prev]
+        if len(codes) == 0:
+            return batch.take(np.array([], dtype=np.int64), batch.keys, batch.values)
+        batch_codes = self.get_key_codes(batch, ref_level_prev)
+        positions = np.minimum(np.searchsorted(codes, batch_codes), len(codes) - 1)
+        matches = np.where(codes[positions] == batch_codes, counts[positions], 0)
+        return batch.take(np.repeat(np.arange(batch.size), matches), batch.keys, batch.values)
+
+    def get_transit_cost(self, query, batch):
+        """
+        Returns (windows, values): the window (index in timestamps) of each output record and, if the query
+        ends with a reduction, its value (None otherwise)
+        """
+        windows = np.searchsorted(self.timestamps, batch.columns[TS][0])
+        if len(query.operators) > 0 and query.operators[-1].name == 'Reduce' and batch.values:
+            return windows, batch.columns[batch.values[0]][0]
+        return windows, None
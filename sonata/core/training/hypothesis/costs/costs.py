@@ -1,22 +1,81 @@
 from itertools import repeat
 
+import numpy as np
+
 from sonata.system_config import *
 
 from sonata.core.training.utils import *
+from sonata.core.training.hypothesis.costs.dp_cost import get_data_plane_cost
+from sonata.core.training.hypothesis.costs.sp_cost import get_streaming_cost
 
 
 class Costs(object):
     def __init__(self, counts, P):
         self.counts = counts
         self.partitioning_plans = P
-        self.sc = self.counts.sc
-        self.timestamps = self.counts.timestamps
+        self.timestamps = self.counts.engine.timestamps.tolist()
         # Get this from a config file
         self.delta = DELTA
         self.generate_hypothesis_graph()
 
+    def get_operator_costs(self, queries, query_out, iter_qids):
+        """
+        Returns, for each iter_qid ending with a Distinct or Reduce, the bits it uses in the data plane
+        and the packets sent to the stream processor once it runs in the data plane (None if unchanged),
+        as arrays over the windows. These are shared by all the partitioning plans.
+        """
+        n_windows = len(self.timestamps)
+        bits = {}
+        packets = {}
+        sum_reductions = []
+        for index, iter_qid in enumerate(iter_qids):
+            curr_operator = queries[iter_qid].operators[-1]
+            windows, values = query_out[iter_qid]
+            if curr_operator.name == 'Distinct':
+                bits[iter_qid] = get_data_plane_cost(curr_operator.name, '', windows, values, n_windows,
+                                                     1, self.delta)[0][0]
+                # the cardinality for the bloom_bits of the Distinct, one bit per distinct key
+                print "Distinct", iter_qid, "cardinality=%i" % bits[iter_qid].max(initial=0)
+                packets[iter_qid] = get_streaming_cost(curr_operator.name, windows, n_windows)
+
+            elif curr_operator.name == 'Reduce':
+                thresh = 1
+                packets[iter_qid] = None
+                if index + 1 < len(iter_qids):
+                    next_iter_qid = iter_qids[index + 1]
+                    next_operator = queries[next_iter_qid].operators[-1]
+                    if next_operator.name == 'Filter':
+                        thresh = int(next_operator.func[1])
+                        packets[iter_qid] = get_streaming_cost(next_operator.name, query_out[next_iter_qid][0],
+                                                               n_windows)
+                if curr_operator.func[0] == 'sum':
+                    sum_reductions.append((iter_qid, windows, values, thresh))
+                else:
+                    bits[iter_qid] = get_data_plane_cost(curr_operator.name, curr_operator.func[0], windows, values,
+                                                         n_windows, thresh, self.delta)[0][0]
+
+        if sum_reductions:
+            # the cost of all the reductions in one call
+            batches = np.concatenate([np.repeat(batch, len(windows))
+                                      for batch, (_, windows, _, _) in enumerate(sum_reductions)])
+            n_bits, _, cms_bits, use_cms = get_data_plane_cost('Reduce', 'sum',
+                                                               np.concatenate([x[1] for x in sum_reductions]),
+                                                               np.concatenate([x[2] for x in sum_reductions]),
+                                                               n_windows, [x[3] for x in sum_reductions],
+                                                               self.delta, batches, len(sum_reductions))
+            for batch, (iter_qid, _, _, _) in enumerate(sum_reductions):
+                bits[iter_qid] = n_bits[batch]
+                # the size for the cms_bits of the Reduce, the largest window has to fit
+                if use_cms[batch]:
+                    print "Reduce", iter_qid, "count-min sketch, cms_bits=%i" % cms_bits[batch].max()
+                else:
+                    print "Reduce", iter_qid, "exact table"
+
+        return bits, packets
+
     def generate_hypothesis_graph(self):
         costs = {}
+        n_windows = len(self.timestamps)
         for qid in self.counts.query_out_transit:
             costs[qid] = {}
             query = self.counts.qid_2_query[qid]
@@ -30,30 +89,27 @@ class Costs(object):
             for transit in self.counts.query_out_transit[qid]:
                 costs[qid][transit] = {}
                 (ref_level_prev, ref_level_curr) = transit
-                iter_qids_curr = self.counts.refined_spark_queries[qid][ref_level_curr].keys()
+                query_out = self.counts.query_out_transit[qid][transit]
+                queries = self.counts.refined_spark_queries[qid][ref_level_curr]
+                iter_qids_curr = queries.keys()
                 iter_qids_curr.sort()
-                part_ids = [x%1000 for x in iter_qids_curr]
                 print iter_qids_curr
-                for partition_plan in partition_plans:
+                bits, packets = self.get_operator_costs(queries, query_out, iter_qids_curr[1:])
 
-                    bits_count = self.sc.parallelize([(x,0) for x in self.timestamps])
-                    packet_count = self.sc.parallelize(self.counts.query_out_transit[qid][transit][0])
-                    print "======="
-                    print "W/O Partition"
-                    #print "Bits Count Cost", bits_count.collect()[:2]
-                    #print "Packet Count Cost", packet_count.collect()[:2]
+                for partition_plan in partition_plans:
+                    # W/O Partition
+                    bits_count = np.zeros(n_windows)
+                    packet_count = get_streaming_cost('', query_out[0][0], n_windows)
 
-                    ctr = 0
                     for iter_qid in iter_qids_curr[1:-1]:
-                        print partition_plan, transit, iter_qid
                         if iter_qid%1000 == partition_plan:
                             break
-                        bits_count, packet_count, ctr = update_counts(self.sc, self.counts.refined_spark_queries[qid][ref_level_curr],
-                                                                                   self.counts.query_out_transit[qid][transit],
-                                                                                   iter_qid, self.delta, bits_count, packet_count,
-                                                                                   ctr)
-                    final_weight = bits_count.join(packet_count).map(lambda s: (s[0], (s[1][0], s[1][1]))).collect()
-                    #print final_weight[:2]
+                        if iter_qid in bits:
+                            # After executing the operator in Data Plane
+                            bits_count = bits_count + bits[iter_qid]
+                            if packets[iter_qid] is not None:
+                                packet_count = packets[iter_qid]
+                    final_weight = zip(self.timestamps, zip(bits_count.tolist(), packet_count.tolist()))
                     costs[qid][transit][partition_plan] = (final_weight)
         self.costs = costs
         #print self.weights
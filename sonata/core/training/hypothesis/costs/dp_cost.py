@@ -3,63 +3,97 @@
 #  Arpit Gupta (arpitg@cs.princeton.edu)
 
 import math
+import numpy as np
 
+STRUCTURE_TABLE = 'table'
+STRUCTURE_CMS = 'cms'
+
+
+def get_cms_rows(delta=0.01):
+    return int(math.ceil(math.log(int(1 / delta), 2)))
+
+
+def get_cms_dimensions(n_bits, counter_width, delta=0.01, max_columns=2 ** 16):
+    """
+    Returns (d, w), the rows and the columns per row of a count-min sketch that fits in n_bits bits with
+    counters of counter_width bits. w is a power of two, the registers of a row are indexed by a hash.
+    """
+    d = get_cms_rows(delta)
+    w = max(1, int(n_bits) // (d * counter_width))
+    w = min(2 ** int(math.floor(math.log(w, 2))), max_columns)
+    return d, w
+
+
+def get_bloom_filter_hashes(n_bits, cardinality, max_hashes=8):
+    """
+    Returns the number of hashes that minimizes the false positive rate of a Bloom filter of n_bits bits
+    holding cardinality elements
+    """
+    if cardinality <= 0:
+        return 1
+    return int(min(max(round(float(n_bits) / cardinality * math.log(2)), 1), max_hashes))
+
+
+def get_bloom_filter_fpr(n_elements, n_bits, n_hashes):
+    """
+    False positive rate of a Bloom filter of n_bits bits, split in one partition per hash, once it holds
+    n_elements elements. n_elements can be an array, e.g. the distinct elements of each training window.
+    """
+    n_elements = np.asarray(n_elements, dtype=np.float64)
+    partition_bits = max(float(n_bits) / n_hashes, 1)
+    return (1 - (1 - 1 / partition_bits) ** n_elements) ** n_hashes
+
+
+def get_data_plane_cost(operator_name, transformation_function, windows, values, n_windows, thresh=1, delta=0.01,
+                        batches=None, n_batches=1):
+    """
+    Data plane cost of an operator for every window, in a single vectorized call.
+    windows is the window of each element the operator keeps in the data plane and values its count
+    (for Reduce). With batches (the batch of each element, e.g. the operator of a partition plan) the
+    cost of n_batches operators is computed at once, thresh can then have one value per batch.
+    Returns (n_bits, exact_bits, cms_bits, use_cms): bits of the chosen structure, of an exact table and
+    of a count-min sketch, as arrays of shape (n_batches, n_windows), and whether the count-min sketch
+    is used for each batch. The structure is chosen per batch, for its largest window.
+    """
+    windows = np.asarray(windows, dtype=np.int64)
+    if batches is not None:
+        windows = np.asarray(batches, dtype=np.int64) * n_windows + windows
+    shape = (n_batches, n_windows)
+    n_elements = np.bincount(windows, minlength=n_batches * n_windows).astype(np.float64).reshape(shape)
+    use_cms = np.zeros(n_batches, dtype=bool)
 
-def get_data_plane_cost(sc, operator_name, transformation_function, query_out, thresh=1, delta=0.01):
-    # get data plane cost for given query output and operator name
-    n_bits = 0
     if operator_name == "Distinct":
-        # here query_out query_out = [(ts,#distinct elements), ...]
-        bits_per_element = sc.parallelize(query_out).map(lambda s: (s[0], 1))
-
-        # total number of bits required for this data structure
-        tmp = sc.parallelize(query_out)
-        n_bits = bits_per_element.join(tmp).map(lambda s: (s[0], math.ceil(s[1][0] * s[1][1])))
-
-    elif operator_name == "Reduce":
-        if transformation_function == 'sum':
-            # it can use count-min sketch, here query_out = [(ts,[count1, count2, ...]), ...]
-
-            ## number of bits required w/o using any sketch
-            # number of bits required to maintain the count
-            bits_per_element = sc.parallelize(query_out).map(lambda s: (s[0], math.log(max(s[1]), 2)))
-
-            # total number of bits required for this data structure
-            # print query_out
-            tmp = sc.parallelize(query_out)
-            n_bits_wo_cmsketch = bits_per_element.join(tmp).map(lambda s: (s[0], math.ceil(s[1][0] * (len(s[1][1])))))
-            # print "W/O Sketches", n_bits_wo_cmsketch.collect()
-            n_bits_wo_cmsketch_max = max(n_bits_wo_cmsketch.map(lambda s: s[1]).collect())
-
-            ## number of bits required with count min sketch
-
-            # number of bits required to maintain the count
-            bits_per_element = sc.parallelize(query_out).map(lambda s: (s[0], math.ceil(math.log(max(s[1]), 2))))
-            # print "bits/elem:", bits_per_element.collect()
-
-            d = math.ceil(math.log(int(1 / delta), 2))
-            # print "d:", d
-            # get the probability of threshold value for the given threshold
-            # print thresh
-            f_th = sc.parallelize(query_out).map(lambda s: (s[0], float(s[1].count(thresh)) / len(s[1])))
-            N = sc.parallelize(query_out).map(lambda s: (s[0], float(sum(s[1]))))
-            # print "f_th:", f_th.collect()
-            # print "N:", N.collect()
-            w = f_th.join(N).map(lambda s: (s[0], math.ceil(4 * s[1][1] * s[1][0] / delta)))
-            # print "w:", w.collect()
-
-            n_bits_sketch = w.join(bits_per_element).map(lambda s: (s[0], int(s[1][0] * s[1][1] * d)))
-            # print "With Sketches", n_bits_sketch.collect()
-            n_bits_sketch_max = max(n_bits_sketch.map(lambda s: s[1]).collect())
-            # print "With Sketches", n_bits_sketch_max, "W/o Sketches", n_bits_wo_cmsketch_max
-
-            n_bits_min = min([n_bits_wo_cmsketch_max, n_bits_sketch_max])
-            # print n_bits_min
-            if n_bits_min == n_bits_wo_cmsketch_max:
-                n_bits = n_bits_wo_cmsketch
-            else:
-                n_bits = n_bits_sketch
+        # one bit per distinct element
+        exact_bits = np.ceil(n_elements)
+        return exact_bits, exact_bits, np.zeros(shape), use_cms
+
+    elif operator_name == "Reduce" and transformation_function == 'sum':
+        values = np.asarray(values, dtype=np.float64)
+        max_count = np.zeros(n_batches * n_windows)
+        np.maximum.at(max_count, windows, values)
+        # number of bits required to maintain the count
+        log_max_count = np.log2(np.maximum(max_count, 1)).reshape(shape)
 
+        ## number of bits required w/o using any sketch
+        exact_bits = np.ceil(log_max_count * n_elements)
+
+        ## number of bits required with count min sketch
+        d = get_cms_rows(delta)
+        thresh = np.asarray(thresh, dtype=np.float64)
+        if batches is not None and thresh.ndim > 0:
+            at_thresh = values == thresh[np.asarray(batches, dtype=np.int64)]
         else:
-            print "Currently not supported"
-    return n_bits
+            at_thresh = values == thresh
+        # probability of the threshold value, and total count N
+        f_th = (np.bincount(windows[at_thresh], minlength=n_batches * n_windows).reshape(shape) /
+                np.maximum(n_elements, 1))
+        N = np.bincount(windows, weights=values, minlength=n_batches * n_windows).reshape(shape)
+        w = np.ceil(4 * N * f_th / delta)
+        cms_bits = np.floor(w * np.ceil(log_max_count) * d)
+
+        use_cms = cms_bits.max(axis=1, initial=0) < exact_bits.max(axis=1, initial=0)
+        n_bits = np.where(use_cms[:, np.newaxis], cms_bits, exact_bits)
+        return n_bits, exact_bits, cms_bits, use_cms
+
+    print "Currently not supported"
+    return np.zeros(shape), np.zeros(shape), np.zeros(shape), use_cms
@@ -6,6 +6,7 @@ hypothesis graph
 import numpy as np
 
 from sonata.core.training.utils import *
+from sonata.core.training.engine import TrainingEngine
 from sonata.core.utils import *
 
 
@@ -14,13 +15,13 @@ class Counts(object):
     Compute counts (number of packets, bytes) for each edge in the hypothesis graph.
     1. Computes threshold (moved to refinement class)
     2. Generates refined queries (moved to refinement class)
-    3. Executes generated refined queries (uses Spark batch processing) to compute the
-       counts for each window interval in the data set.
+    3. Executes generated refined queries (on the columns of the training data, see engine.py) to
+       compute the counts for each window interval in the data set.
     """
 
     query_tree = {}
 
-    def __init__(self, query, sc, training_data, timestamps, refinement_object, target):
+    def __init__(self, query, sc, training_data, timestamps, refinement_object, target, run_queries=True):
 
         self.query = query
         self.sc = sc
@@ -45,76 +46,74 @@ class Counts(object):
         # Generate Spark queries for the composed & refined SONATA queries
         self.generate_refined_spark_queries()
 
-        for qid in self.refined_spark_queries:
-            print "Processing Refined Queries for cost...", qid
-            self.query_cost_transit_fname = 'query_cost_transit_'+str(qid)+'.pickle'
-            self.get_transit_query_output(qid)
-            dump_data(self.query_out_transit, self.query_cost_transit_fname)
-            with open(self.query_cost_transit_fname, 'r') as f:
-                self.query_out_transit = pickle.load(f)
+        if hasattr(training_data, 'collect'):
+            training_data = training_data.collect()
+        self.engine = TrainingEngine(training_data, BASIC_HEADERS, self.refinement_key)
 
+        self.query_out_transit = {}
+        if run_queries:
+            # All the refined queries run on the columns of the training data, in a single pass over it
+            refined_queries = {}
+            for qid in self.refined_spark_queries:
+                for ref_level in self.refined_spark_queries[qid]:
+                    for iter_qid in self.refined_spark_queries[qid][ref_level]:
+                        refined_queries[(qid, ref_level, iter_qid)] = self.refined_spark_queries[qid][ref_level][iter_qid]
+            self.query_out = self.engine.run_queries(refined_queries)
+
+            for qid in self.refined_spark_queries:
+                print "Processing Refined Queries for cost...", qid
+                self.get_transit_query_output(qid)
 
     def get_transit_query_output(self, qid):
         """
         Computes per query costs
         :return:
         """
-        out0 = self.training_data.collect()
+        query_out = {}
+        for ref_level in self.refined_spark_queries[qid]:
+            for iter_qid in self.refined_spark_queries[qid][ref_level]:
+                query_out[(ref_level, iter_qid)] = self.query_out[(qid, ref_level, iter_qid)]
+
+        self.query_out_transit[qid] = {}
+        for ref_level_curr in self.ref_levels[1:]:
+            self.query_out_transit[qid].update(self.get_transits(qid, ref_level_curr, query_out))
+
+    def get_level_transits(self, qid, ref_level_curr):
+        """
+        Computes the costs of the transits to ref_level_curr on their own, running only the queries they
+        need: every iteration at ref_level_curr and the final query of each previous level
+        """
+        queries = {}
+        for iter_qid, query in self.refined_spark_queries[qid][ref_level_curr].iteritems():
+            queries[(ref_level_curr, iter_qid)] = query
+        for ref_level_prev in self.ref_levels[1:]:
+            if ref_level_prev < ref_level_curr:
+                final_iter_qid = max(self.refined_spark_queries[qid][ref_level_prev])
+                queries[(ref_level_prev, final_iter_qid)] = self.refined_spark_queries[qid][ref_level_prev][final_iter_qid]
+        return self.get_transits(qid, ref_level_curr, self.engine.run_queries(queries))
+
+    def get_transits(self, qid, ref_level_curr, query_out):
+        """
+        Returns the cost of each transit (ref_level_prev, ref_level_curr), i.e. edge in the refinement graph,
+        from the outputs (ref_level, iter_qid) -> batch of the refined queries
+        """
         query_cost_transit = {}
-        print "Out0", out0[:2]
-        # Iterate over each refined query and collect its output
-        # for qid in self.refined_queries:
-
-        query_cost_transit[qid] = {}
-
-        query = self.qid_2_query[qid]
-        refinement_key = self.refinement_key
-        ref_levels = self.ref_levels
-
-        # Get the query output for each refined intermediate queries
-        query_out_refinement_level = self.get_query_output(qid, out0)
-
-        # Get the query cost for each refinement transit, i.e. edge in the refinement graph
-        # First get the cost for transit (0,ref_level)
-        for ref_level in ref_levels[1:]:
-            transit = (0, ref_level)
-            query_cost_transit[qid][transit] = {}
-            for iter_qid in self.refined_spark_queries[qid][ref_level].keys():
-                spark_query = self.refined_spark_queries[qid][ref_level][iter_qid]
-                out = query_out_refinement_level[qid][ref_level][iter_qid]
-                transit_query_string = 'self.sc.parallelize(out)'
-                transit_query_string = generate_query_to_collect_transit_cost(transit_query_string, spark_query)
-                query_cost_transit[qid][transit][iter_qid] = eval(transit_query_string)
-                #print transit, iter_qid, query_cost_transit[qid][transit][iter_qid][:2]
-                #break
-
-        # Then get the cost for transit (ref_level_prev, ref_level_current)
-        for ref_level_prev in ref_levels[1:]:
-            for ref_level_curr in ref_levels:
-                if ref_level_curr > ref_level_prev:
-                    transit = (ref_level_prev, ref_level_curr)
-                    query_cost_transit[qid][transit] = {}
-                    prev_level_out_mapped_string, prev_level_out = generate_query_string_prev_level_out_mapped(qid,
-                                                                                           ref_level_prev,
-                                                                                           query_out_refinement_level,
-                                                                                           self.refined_spark_queries,
-                                                                                           out0,
-                                                                                           refinement_key)
-                    print prev_level_out_mapped_string
-                    prev_level_out_mapped = eval(prev_level_out_mapped_string)
-                    #print prev_level_out_mapped.collect()[:2]
-                    # For each intermediate query for `ref_level_curr` in transit (ref_level_prev, ref_level_current),
+        ref_levels_prev = [0] + [ref_level for ref_level in self.ref_levels[1:] if ref_level < ref_level_curr]
+        for ref_level_prev in ref_levels_prev:
+            transit = (ref_level_prev, ref_level_curr)
+            query_cost_transit[transit] = {}
+            if ref_level_prev > 0:
+                # the keys of the final output at `ref_level_prev` are shared by all the iterations
+                final_iter_qid = max(self.refined_spark_queries[qid][ref_level_prev])
+                self.engine.set_level_output(ref_level_prev, query_out[(ref_level_prev, final_iter_qid)])
+            for iter_qid_curr in self.refined_spark_queries[qid][ref_level_curr].keys():
+                curr_query = self.refined_spark_queries[qid][ref_level_curr][iter_qid_curr]
+                curr_level_out = query_out[(ref_level_curr, iter_qid_curr)]
+                if ref_level_prev > 0:
                     # we filter out entries that do not satisfy the query at level `ref_level_prev`
-                    for iter_qid_curr in self.refined_spark_queries[qid][ref_level_curr].keys():
-                        #if iter_qid_curr > 0:
-                        curr_level_out = query_out_refinement_level[qid][ref_level_curr][iter_qid_curr]
-                        curr_query = self.refined_spark_queries[qid][ref_level_curr][iter_qid_curr]
-                        transit_query_string = generate_transit_query(curr_query, curr_level_out,
-                                                                      prev_level_out_mapped, ref_level_prev)
-                        query_cost_transit[qid][transit][iter_qid_curr] = eval(transit_query_string)
-                        #print transit, iter_qid_curr, query_cost_transit[qid][transit][iter_qid_curr][:2]
-
-        self.query_out_transit = query_cost_transit
+                    curr_level_out = self.engine.select_level_output(curr_level_out, ref_level_prev)
+                query_cost_transit[transit][iter_qid_curr] = self.engine.get_transit_cost(curr_query, curr_level_out)
+        return query_cost_transit
 
     def generate_refined_spark_queries(self):
         # Compose the updated SONATA queries for different refinement levels
@@ -161,29 +160,3 @@ class Counts(object):
 
         # print refined_spark_queries
         self.refined_spark_queries = refined_spark_queries
-
-    def get_query_output(self, qid, out0):
-        # Get the query output for each refined intermediate queries
-        query_out_refinement_level = {}
-        query_out_refinement_level[qid] = {}
-        for ref_level in self.refined_spark_queries[qid]:
-            query_out_refinement_level[qid][ref_level] = {}
-            for iter_qid in self.refined_spark_queries[qid][ref_level]:
-                if iter_qid > 0:
-                    spark_query = self.refined_spark_queries[qid][ref_level][iter_qid]
-                    if len(spark_query.compile()) > 0:
-                        tmp_compile = spark_query.compile()
-                        query_string = 'self.training_data.' + tmp_compile + '.collect()'
-                        #print("Processing Query", qid, "refinement level", ref_level, "iteration id", iter_qid)
-                        out = eval(query_string)
-                    else:
-                        print "No query to process for", qid, "refinement level", ref_level, "iteration id", iter_qid
-                        out = []
-                    query_out_refinement_level[qid][ref_level][iter_qid] = out
-                    #print len(query_out_refinement_level[qid][ref_level][iter_qid])
-
-            query_out_refinement_level[qid][ref_level][0] = out0
-
-        self.query_out_refinement_level = query_out_refinement_level
-
-        return query_out_refinement_level
\ No newline at end of file
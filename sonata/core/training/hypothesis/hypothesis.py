@@ -7,6 +7,7 @@
 from sonata.core.utils import *
 from counts import *
 from sonata.core.training.hypothesis.costs.costs import Costs
+from sonata.core.training.hypothesis.scheduler import TrainingScheduler
 from sonata.core.partition import Partition
 
 
@@ -17,14 +18,18 @@ class Hypothesis(object):
     E = {}
     G = {}
 
-    def __init__(self, query, sc, training_data, timestamps, refinement_object, target):
+    def __init__(self, query, sc, training_data, timestamps, refinement_object, target, workers=1,
+                 checkpoint_dir=None):
         self.sc = sc
         self.training_data = training_data
         self.timestamps = timestamps
         self.query = query
         self.refinement_object = refinement_object
         self.target = target
-        
+        # training processes, and where to checkpoint their results (see scheduler.py)
+        self.workers = workers
+        self.checkpoint_dir = checkpoint_dir
+
         self.refinement_key = refinement_object.refinement_key
         self.refinement_levels = self.refinement_object.ref_levels
         self.alpha = ALPHA
@@ -73,10 +78,17 @@ class Hypothesis(object):
                 print "Loading costs from pickle..."
                 costs = pickle.load(f)
         else:
-            # Run the query over training data to get various counts
-            counts = Counts(self.query, self.sc, self.training_data, self.timestamps, self.refinement_object, self.target)
-            # Apply the costs model over counts to estimate costs for different edges
-            costs = Costs(counts, self.P).costs
+            if self.workers > 1 or self.checkpoint_dir:
+                # Run the queries and cost models per (qid, refinement level) in parallel
+                counts = Counts(self.query, self.sc, self.training_data, self.timestamps, self.refinement_object,
+                                self.target, run_queries=False)
+                costs = TrainingScheduler(counts, self.P, self.workers, self.checkpoint_dir).run()
+            else:
+                # Run the query over training data to get various counts
+                counts = Counts(self.query, self.sc, self.training_data, self.timestamps, self.refinement_object,
+                                self.target)
+                # Apply the costs model over counts to estimate costs for different edges
+                costs = Costs(counts, self.P).costs
             print costs
             with open('costs.pickle', 'w') as f:
                 print "Dumping costs into pickle..."
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import copy
+import itertools
+import os
+import pickle
+import tempfile
+import time
+from multiprocessing import Pool
+
+from sonata.compilation_cache import get_cache_key
+from sonata.core.training.hypothesis.costs.costs import Costs
+
+"""
+Parallel computation of the hypothesis graph costs. The work is split into one task per (qid, refinement
+level), which runs the refined queries of that level (and the final query of the previous levels) over the
+training data and computes the costs of every transit to that level for all the partitioning plans. Tasks
+run on a pool of forked processes that share the memory-mapped training data, and the costs of each
+finished task are checkpointed, so an interrupted training resumes with the tasks it did not finish.
+"""
+
+# state of the forked workers
+worker_counts = None
+worker_plans = None
+
+
+def run_task(task):
+    qid, ref_level = task
+    start = time.time()
+    task_counts = copy.copy(worker_counts)
+    task_counts.query_out_transit = {qid: worker_counts.get_level_transits(qid, ref_level)}
+    costs = Costs(task_counts, worker_plans).costs[qid]
+    return task, costs, time.time() - start
+
+
+class TrainingScheduler(object):
+    def __init__(self, counts, partition_plans, workers=1, checkpoint_dir=None):
+        self.counts = counts
+        self.partition_plans = partition_plans
+        self.workers = workers
+        self.checkpoint_dir = None
+        if checkpoint_dir:
+            # checkpoints of other queries, plans or training data are never reused
+            training_data = counts.engine.training_data
+            run_key = get_cache_key(sorted((qid, repr(counts.refined_spark_queries[qid]))
+                                           for qid in counts.refined_spark_queries),
+                                    counts.ref_levels, partition_plans, training_data.source,
+                                    training_data.n_rows, training_data.T)
+            self.checkpoint_dir = os.path.join(checkpoint_dir, run_key)
+            if not os.path.isdir(self.checkpoint_dir):
+                os.makedirs(self.checkpoint_dir)
+
+    def get_tasks(self):
+        tasks = [(qid, ref_level) for qid in self.counts.refined_spark_queries
+                 for ref_level in self.counts.ref_levels[1:]]
+        # the finer levels have more previous levels to run, start with them
+        tasks.sort(key=lambda (qid, ref_level): (-ref_level, qid))
+        return tasks
+
+    def get_checkpoint_path(self, task):
+        return os.path.join(self.checkpoint_dir, 'costs_%i_%i.pickle' % task)
+
+    def load_checkpoint(self, task):
+        if self.checkpoint_dir is None or not os.path.exists(self.get_checkpoint_path(task)):
+            return None
+        with open(self.get_checkpoint_path(task), 'rb') as f:
+            return pickle.load(f)
+
+    def save_checkpoint(self, task, costs):
+        if self.checkpoint_dir is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.checkpoint_dir, prefix='.tmp_')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(costs, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.get_checkpoint_path(task))
+
+    def run(self):
+        """
+        Returns the costs of all the tasks, as Costs(...).costs for the whole counts
+        """
+        global worker_counts, worker_plans
+        done = {}
+        pending = []
+        for task in self.get_tasks():
+            checkpoint = self.load_checkpoint(task)
+            if checkpoint is None:
+                pending.append(task)
+            else:
+                done[task] = checkpoint
+        print "Training tasks:", len(done) + len(pending), "from checkpoints:", len(done), "workers:", self.workers
+
+        # the workers are forked after this, they inherit the counts instead of receiving them
+        worker_counts = self.counts
+        worker_plans = self.partition_plans
+        pool = None
+        if self.workers > 1 and len(pending) > 1:
+            pool = Pool(min(self.workers, len(pending)))
+            results = pool.imap_unordered(run_task, pending)
+        else:
+            results = itertools.imap(run_task, pending)
+
+        start = time.time()
+        try:
+            for ctr, (task, costs, duration) in enumerate(results):
+                done[task] = costs
+                self.save_checkpoint(task, costs)
+                elapsed = time.time() - start
+                remaining = elapsed / (ctr + 1) * (len(pending) - ctr - 1)
+                print "Training task %i/%i (qid %i, ref level %i) done in %.1fs, elapsed %.1fs, remaining ~%.1fs" % \
+                      (ctr + 1, len(pending), task[0], task[1], duration, elapsed, remaining)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        costs = {}
+        for (qid, ref_level), task_costs in done.iteritems():
+            if qid not in costs:
+                costs[qid] = {}
+            costs[qid].update(task_costs)
+        return costs
@@ -4,12 +4,12 @@
 
 from sonata.system_config import FOLD_SIZE
 from utils import min_error, partition_data
-from sonata_search import Search, QueryPlan, map_input_graph
+from sonata_search import BatchSearch
 from query_plan import QueryPlan
 import math
 
 
-def get_min_error_path(G, H):
+def get_min_error_path(G, H, search):
     unique_candidates = {}
     for ts in G:
         candidate_hash = H[ts].__repr__()
@@ -23,7 +23,7 @@ def get_min_error_path(G, H):
         path1 = unique_candidates[candidate]
         for ts in G:
             path2 = H[ts]
-            path3 = QueryPlan(map_input_graph(G[ts]), path1.path)
+            path3 = QueryPlan(search.get_graph(ts), path1.path)
             error_candidate += (path2.cost - path3.cost) * (path2.cost - path3.cost)
         error[candidate] = math.sqrt(error_candidate)
     print "Error:", error
@@ -47,22 +47,22 @@ class Learn(object):
         h_T = {}
         e_V = {}
         candidates = {}
-        for ts in self.hypothesis.G:
-            # print "Searching best path for", ts
-            g = self.hypothesis.G[ts]
-            h_s[ts] = Search(g).final_plan
+        # best path of every timestamp, in one batch
+        search = BatchSearch(self.hypothesis.G)
+        for ts in search.timestamps:
+            h_s[ts] = search.final_plans[ts]
             print "Best path for ts", ts, "is", h_s[ts].path, "with cost", h_s[ts].cost
 
         for fold in range(1, 1+self.K):
             (G_t, G_v) = partition_data(self.hypothesis.G, fold, self.K)
-            h_T[fold] = get_min_error_path(G_t, h_s)
+            h_T[fold] = get_min_error_path(G_t, h_s, search)
 
             print "For fold", fold, "best plan", h_T[fold].path
 
             error_fold = 0
             for ts in G_v:
                 path1 = h_s[ts]
-                path2 = QueryPlan(map_input_graph(G_v[ts]), h_T[fold].path)
+                path2 = QueryPlan(search.get_graph(ts), h_T[fold].path)
                 error_fold += (path2.cost-path1.cost)*(path2.cost-path1.cost)
 
             e_V[fold] = math.sqrt(error_fold)
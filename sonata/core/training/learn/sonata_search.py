@@ -1,74 +1,164 @@
 # author: arpitg@cs.princeton.edu
 
-from sonata.core.training.learn.search import *
-from sonata.core.training.learn.utils import *
+import heapq
+import numpy as np
 
-from query_plan import QueryPlan
+from sonata.core.training.learn.search import Node
+from sonata.core.training.learn.utils import infinity
 
+from query_plan import QueryPlan
 
-def DirectedGraph(dict=None):
-    "Build a Hypothesis where every edge (including future ones) goes both ways."
-    return Graph(dict=dict, directed=True)
+INITIAL_NODE = (0, 0, 0)
+
+
+class IndexedGraph(object):
+    """
+    Hypothesis graph with integer vertex ids and CSR adjacency: the edges out of vertex i are
+    edges[offsets[i]:offsets[i + 1]], going to targets[...]. The structure is shared by the graphs of all
+    the timestamps, weights holds the edge weights of one of them.
+    """
+    def __init__(self, V, edges, weights=None):
+        vertices = set(V)
+        for (v1, v2) in edges:
+            vertices.add(v1)
+            vertices.add(v2)
+        self.vertices = sorted(vertices)
+        self.index = dict((v, i) for i, v in enumerate(self.vertices))
+
+        edges = list(edges)
+        sources = np.array([self.index[v1] for (v1, _) in edges], dtype=np.int64)
+        targets = np.array([self.index[v2] for (_, v2) in edges], dtype=np.int64)
+        order = np.lexsort((targets, sources))
+        self.edges = [edges[i] for i in order]
+        self.edge_index = dict((edge, i) for i, edge in enumerate(self.edges))
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.offsets = np.zeros(len(self.vertices) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(self.sources, minlength=len(self.vertices)))
+        self.weights = weights
+
+    def get_weights(self, E):
+        return np.array([E.get(edge, infinity) for edge in self.edges], dtype=np.float64)
+
+    def with_weights(self, weights):
+        graph = object.__new__(IndexedGraph)
+        graph.__dict__.update(self.__dict__)
+        graph.weights = weights
+        return graph
+
+    def get(self, a, b=None):
+        """
+        Same as Graph.get: the weight of the edge (a, b), None if there is none, or {b: weight} without b
+        """
+        if b is None:
+            if a not in self.index:
+                return {}
+            i = self.index[a]
+            return dict((self.edges[e][1], self.weights[e]) for e in xrange(self.offsets[i], self.offsets[i + 1]))
+        e = self.edge_index.get((a, b))
+        if e is None:
+            return None
+        return self.weights[e]
+
+    def get_goal(self):
+        # the target node is (last refinement level, 0, 0)
+        return max(v for v in self.vertices if len(v) == 3 and v[1:] == (0, 0))
+
+    def get_topological_order(self):
+        """
+        Returns the vertex ids in topological order, None if the graph has a cycle
+        """
+        in_degree = np.bincount(self.targets, minlength=len(self.vertices)).tolist()
+        offsets = self.offsets.tolist()
+        targets = self.targets.tolist()
+        ready = [i for i, degree in enumerate(in_degree) if degree == 0]
+        order = []
+        while ready:
+            u = ready.pop()
+            order.append(u)
+            for v in targets[offsets[u]:offsets[u + 1]]:
+                in_degree[v] -= 1
+                if in_degree[v] == 0:
+                    ready.append(v)
+        if len(order) != len(self.vertices):
+            return None
+        return order
+
+    def dijkstra(self, source, goal, weights):
+        """
+        Returns the edge ids of the shortest path from source to goal (vertex ids), None if there is none
+        """
+        offsets = self.offsets.tolist()
+        targets = self.targets.tolist()
+        weights = weights.tolist()
+        dist = [infinity] * len(self.vertices)
+        parent_edge = [-1] * len(self.vertices)
+        done = [False] * len(self.vertices)
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if done[u]:
+                # stale entry of a vertex whose distance decreased since it was pushed
+                continue
+            done[u] = True
+            if u == goal:
+                break
+            for e in xrange(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                if d + weights[e] < dist[v]:
+                    dist[v] = d + weights[e]
+                    parent_edge[v] = e
+                    heapq.heappush(heap, (dist[v], v))
+        return self.get_path_edges(parent_edge, source, goal)
+
+    def get_shortest_paths(self, source, goal, weights):
+        """
+        Shortest paths for the rows of weights (one per timestamp) at once, on a DAG, or with a Dijkstra per
+        row otherwise. Returns the edge ids of each path, None where there is none.
+        """
+        order = self.get_topological_order()
+        if order is None:
+            return [self.dijkstra(source, goal, row) for row in weights]
+
+        n_rows = weights.shape[0]
+        dist = np.full((n_rows, len(self.vertices)), infinity)
+        parent_edge = np.full((n_rows, len(self.vertices)), -1, dtype=np.int64)
+        dist[:, source] = 0
+        targets = self.targets.tolist()
+        for u in order:
+            for e in xrange(self.offsets[u], self.offsets[u + 1]):
+                v = targets[e]
+                candidate = dist[:, u] + weights[:, e]
+                better = candidate < dist[:, v]
+                dist[better, v] = candidate[better]
+                parent_edge[better, v] = e
+        return [self.get_path_edges(row, source, goal) for row in parent_edge.tolist()]
+
+    def get_path_edges(self, parent_edge, source, goal):
+        path = []
+        v = goal
+        while v != source:
+            e = parent_edge[v]
+            if e < 0:
+                return None
+            path.append(e)
+            v = self.sources[e]
+        path.reverse()
+        return path
+
+    def get_path_nodes(self, path_edges, weights):
+        node = Node(self.vertices[self.sources[path_edges[0]]] if path_edges else INITIAL_NODE)
+        for e in path_edges:
+            (_, v2) = self.edges[e]
+            node = Node(v2, node, v2, node.path_cost + weights[e])
+        return node
 
 
 def map_input_graph(G):
     (V, E) = G
-    graph = {}
-    for v in V:
-        for (v1, v2) in E:
-            if v1 == v:
-                if v not in graph:
-                    graph[v] = {}
-                # TODO: make sure that their single weight metric for each edge
-                graph[v1][v2] = E[(v1, v2)]
-    # TODO: take care of the corner cases
-    return DirectedGraph(graph)
-
-
-class GraphProblem(Problem):
-    "The problem of searching a graph from one node to another."
-
-    def __init__(self, initial, goal, graph):
-        Problem.__init__(self, initial, goal)
-        self.graph = graph
-        self.best_node = {}
-
-    def actions(self, a):
-        "The actions at a graph node are just its neighbors."
-        # print "actions for a: ",self.graph
-        # print "a: ",a
-        out = self.graph.get(a).keys()
-        # Sort the neighbor tuples, TODO: make sure we don't need more sophisticated sort operation
-        out.sort()
-        return out
-
-    def result(self, state, action):
-        """The result of going to a neighbor is just that neighbor."""
-        return action
-
-    def path_cost(self, cost_so_far, a, action, b):
-        # print "path_cost:",a, B, cost_so_far
-        return cost_so_far + (self.graph.get(a, b) or infinity)
-
-    def is_qualified(self, a, f):
-        "Check whether the graph node is qualified to be a frontier node"
-        # print a.state
-        if len(a.state) > 1:
-            refinement_level = a.state[1]
-            if refinement_level not in self.best_node:
-                self.best_node[refinement_level] = a
-                return True
-            else:
-                curr_best_node = self.best_node[refinement_level]
-                if f(curr_best_node) > f(a):
-                    # update the best node for this refinement level
-                    self.best_node[refinement_level] = a
-                    return True
-                else:
-                    # print "Not adding node", a, "to frontier"
-                    return False
-        else:
-            return True
+    graph = IndexedGraph(V, E.keys())
+    return graph.with_weights(graph.get_weights(E))
 
 
 class Search(object):
@@ -79,47 +169,48 @@ class Search(object):
     def __init__(self, G):
         self.G = G
         self.graph = map_input_graph(self.G)
-        # print self.graph.dict
-        # (0, '11', 2)
-        # self.problem = GraphProblem('S', 'G', self.graph)
-        # TODO: hardcoding fix required
-        self.problem = GraphProblem((0, 0, 0), (32, 0, 0), self.graph)
-        # No heuristics in f ==> uniform cost search algorithm
-        self.best_first_graph_search(lambda node: node.path_cost)
-        if self.target_node is None:
+        # uniform cost search, Dijkstra over the indexed graph
+        source = self.graph.index[INITIAL_NODE]
+        goal = self.graph.index[self.graph.get_goal()]
+        path_edges = self.graph.dijkstra(source, goal, self.graph.weights)
+        if path_edges is None:
             print "Failed to find the best path :("
         else:
-            # print "Best path is", self.target_node.path()
+            self.target_node = self.graph.get_path_nodes(path_edges, self.graph.weights)
             self.generate_final_plan()
 
     def generate_final_plan(self):
         self.final_plan = QueryPlan(self.graph, self.target_node.path())
 
-    def best_first_graph_search(self, f):
-        problem = self.problem
-        f = memoize(f, 'f')
-        node = Node(problem.initial)
-        # print "Initial Node", node
-        if problem.goal_test(node.state):
-            return node
-        frontier = PriorityQueue(min, f)
-        frontier.append(node)
-        explored = set()
-        while frontier:
-            # print frontier, explored
-            node = frontier.pop()
-            if problem.goal_test(node.state):
-                self.target_node = node
-            explored.add(node.state)
-            for child in node.expand(problem):
-                if child.state not in explored and child not in frontier:
-                    # print "adding child", child, "to frontier."
-                    # if problem.is_qualified(child, f):
-                    frontier.append(child)
-                elif child in frontier:
-                    incumbent = frontier[child]
-                    if f(child) < f(incumbent):
-                        # print "Deleting incumbent", incumbent, "from frontier"
-                        del frontier[incumbent]
-                        # print "adding child", child, "to frontier."
-                        frontier.append(child)
+
+class BatchSearch(object):
+    """
+    Searches the best path of the graphs of all the timestamps at once. They share one indexed structure
+    (the union of their edges) and differ by their row of edge weights.
+    """
+    def __init__(self, G):
+        self.timestamps = sorted(G)
+        V = set()
+        edges = set()
+        for ts in self.timestamps:
+            V.update(G[ts][0])
+            edges.update(G[ts][1].keys())
+        self.graph = IndexedGraph(V, edges)
+        self.weights = np.array([self.graph.get_weights(G[ts][1]) for ts in self.timestamps], dtype=np.float64)
+        self.weights = self.weights.reshape((len(self.timestamps), len(self.graph.edges)))
+        self.ts_index = dict((ts, i) for i, ts in enumerate(self.timestamps))
+
+        self.final_plans = {}
+        source = self.graph.index[INITIAL_NODE]
+        goal = self.graph.index[self.graph.get_goal()]
+        all_path_edges = self.graph.get_shortest_paths(source, goal, self.weights)
+        for ts, path_edges in zip(self.timestamps, all_path_edges):
+            if path_edges is None:
+                print "Failed to find the best path for ts", ts
+                continue
+            weights = self.weights[self.ts_index[ts]]
+            target_node = self.graph.get_path_nodes(path_edges, weights)
+            self.final_plans[ts] = QueryPlan(self.graph.with_weights(weights), target_node.path())
+
+    def get_graph(self, ts):
+        return self.graph.with_weights(self.weights[self.ts_index[ts]])
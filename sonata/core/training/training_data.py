@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import json
+import os
+import socket
+import struct
+import numpy as np
+
+from sonata.streaming_driver.columnar import to_column, get_field_kind, KIND_IP, KIND_INT
+
+"""
+Training data store. A flows file (csv) or a pcap is converted once into one binary file per field
+(ts, IPs as uint32, ports as uint16, proto as uint8, ...), sorted by ts, plus a meta.json. The store
+is memory-mapped, so traces larger than memory can be used, and the windows of T seconds are
+contiguous rows that are handed out as slices of the mapped columns, without copying them.
+"""
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+
+# fields of the flows file, in order, and their type in the store
+TRAINING_FIELDS = [('ts', 'int64'), ('sIP', 'uint32'), ('sPort', 'uint16'), ('dIP', 'uint32'),
+                   ('dPort', 'uint16'), ('nBytes', 'uint32'), ('proto', 'uint8'),
+                   ('sMac', 'uint64'), ('dMac', 'uint64')]
+
+CONVERT_CHUNK_ROWS = 1 << 20
+CHUNK_ROWS = 1 << 22
+
+# pcap file format
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAP_GLOBAL_HEADER_SIZE = 24
+PCAP_RECORD_HEADER = struct.Struct('IIII')
+ETHER_TYPE_IPV4 = 0x0800
+ETHER_TYPE_VLAN = 0x8100
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+PORTS = struct.Struct('!HH')
+
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def mac_to_int(mac):
+    try:
+        return int(mac.replace(':', ''), 16)
+    except ValueError:
+        return 0
+
+
+def int_to_mac(value):
+    mac = '%012x' % value
+    return ':'.join(mac[i:i + 2] for i in range(0, 12, 2))
+
+
+class StoreWriter(object):
+    """
+    Appends rows to the column files of a store, the store is usable once close() wrote its meta.json
+    """
+    def __init__(self, store_path, source, proto):
+        self.store_path = store_path
+        self.source = source
+        self.proto = proto
+        if not os.path.isdir(store_path):
+            os.makedirs(store_path)
+        meta_path = os.path.join(store_path, META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self.files = [open(os.path.join(store_path, fld + '.bin'), 'wb') for fld, _ in TRAINING_FIELDS]
+        self.n_rows = 0
+        self.last_ts = None
+        self.is_sorted = True
+
+    def write(self, rows):
+        rows = [row for row in rows if self.proto is None or row[6] == self.proto]
+        if not rows:
+            return
+        columns = [np.array(column, dtype=dtype) for (_, dtype), column in zip(TRAINING_FIELDS, zip(*rows))]
+        for f, column in zip(self.files, columns):
+            column.tofile(f)
+        ts = columns[0]
+        if (self.last_ts is not None and ts[0] < self.last_ts) or np.any(ts[1:] < ts[:-1]):
+            self.is_sorted = False
+        self.last_ts = ts[-1]
+        self.n_rows += len(rows)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        if not self.is_sorted and self.n_rows > 0:
+            # the windows have to be contiguous, sort the columns by ts one at a time
+            ts = np.memmap(os.path.join(self.store_path, 'ts.bin'), dtype='int64', mode='r', shape=(self.n_rows,))
+            order = np.argsort(ts, kind='mergesort')
+            del ts
+            for fld, dtype in TRAINING_FIELDS:
+                column = np.memmap(os.path.join(self.store_path, fld + '.bin'), dtype=dtype, mode='r+',
+                                   shape=(self.n_rows,))
+                column[:] = column[order]
+                column.flush()
+                del column
+        meta = {'version': STORE_VERSION, 'rows': self.n_rows, 'fields': TRAINING_FIELDS,
+                'source': self.source, 'proto': self.proto}
+        with open(os.path.join(self.store_path, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+
+def parse_flow_line(line):
+    ts, sIP, sPort, dIP, dPort, nBytes, proto, sMac, dMac = line.strip().split(",")[:9]
+    return (int(ts), ip_to_int(sIP), int(sPort), ip_to_int(dIP), int(dPort), int(nBytes), int(proto),
+            mac_to_int(sMac), mac_to_int(dMac))
+
+
+def convert_csv(flows_file, store_path, proto=17):
+    writer = StoreWriter(store_path, flows_file, proto)
+    rows = []
+    with open(flows_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rows.append(parse_flow_line(line))
+            if len(rows) >= CONVERT_CHUNK_ROWS:
+                writer.write(rows)
+                rows = []
+    writer.write(rows)
+    writer.close()
+
+
+def parse_frame(ts, frame):
+    """
+    Returns the row of an ethernet frame, None if it is not IPv4
+    """
+    if len(frame) < 14:
+        return None
+    dMac = int(frame[0:6].encode('hex'), 16)
+    sMac = int(frame[6:12].encode('hex'), 16)
+    ether_type = struct.unpack_from('!H', frame, 12)[0]
+    offset = 14
+    if ether_type == ETHER_TYPE_VLAN and len(frame) >= 18:
+        ether_type = struct.unpack_from('!H', frame, 16)[0]
+        offset = 18
+    if ether_type != ETHER_TYPE_IPV4 or len(frame) < offset + IPV4_HEADER.size:
+        return None
+    version_ihl, _, total_length, _, fragment, _, proto, _, src, dst = IPV4_HEADER.unpack_from(frame, offset)
+    sPort = dPort = 0
+    offset += (version_ihl & 0xf) * 4
+    if proto in (6, 17) and fragment & 0x1fff == 0 and len(frame) >= offset + PORTS.size:
+        sPort, dPort = PORTS.unpack_from(frame, offset)
+    return (ts, struct.unpack('!I', src)[0], sPort, struct.unpack('!I', dst)[0], dPort, total_length, proto,
+            sMac, dMac)
+
+
+def iter_pcap_frames(pcap_file):
+    """
+    Yields (ts in seconds, frame) for the records of a pcap file
+    """
+    with open(pcap_file, 'rb') as f:
+        header = f.read(PCAP_GLOBAL_HEADER_SIZE)
+        magic = struct.unpack_from('<I', header, 0)[0]
+        endian = '<' if magic in (PCAP_MAGIC, PCAP_MAGIC_NS) else '>'
+        record_header = struct.Struct(endian + PCAP_RECORD_HEADER.format)
+        while True:
+            data = f.read(record_header.size)
+            if len(data) < record_header.size:
+                break
+            ts_sec, _, incl_len, _ = record_header.unpack(data)
+            yield ts_sec, f.read(incl_len)
+
+
+def convert_pcap(pcap_file, store_path, proto=17):
+    writer = StoreWriter(store_path, pcap_file, proto)
+    rows = []
+    for ts_sec, frame in iter_pcap_frames(pcap_file):
+        row = parse_frame(ts_sec, frame)
+        if row is not None:
+            rows.append(row)
+        if len(rows) >= CONVERT_CHUNK_ROWS:
+            writer.write(rows)
+            rows = []
+    writer.write(rows)
+    writer.close()
+
+
+class TrainingData(object):
+    """
+    Training data as one column per field, ts being the window (ts / T) of each row. The rows are
+    sorted by ts, so each window is a contiguous slice of the columns.
+    """
+    def __init__(self, columns, T=1, records=None, source=None):
+        # field -> (array, kind), ts before the division by T
+        self.columns = columns
+        self.source = source
+        self.fields = [fld for fld, _ in TRAINING_FIELDS if fld in columns] + \
+                      [fld for fld in columns if fld not in dict(TRAINING_FIELDS)]
+        self.T = int(T)
+        self.records = records
+        self.n_rows = len(columns['ts'][0])
+        self.timestamps = self.get_timestamps()
+
+    def get_timestamps(self):
+        ts = self.columns['ts'][0]
+        timestamps = []
+        for start in xrange(0, self.n_rows, CHUNK_ROWS):
+            timestamps.append(np.unique(ts[start:start + CHUNK_ROWS] // self.T))
+        if not timestamps:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(timestamps))
+
+    def get_window_bounds(self):
+        """
+        Returns the first row of each window, and the number of rows
+        """
+        return np.append(np.searchsorted(self.columns['ts'][0], self.timestamps * self.T), self.n_rows)
+
+    def get_columns(self, start, end):
+        columns = dict((fld, (array[start:end], kind)) for fld, (array, kind) in self.columns.iteritems())
+        if self.T != 1:
+            columns['ts'] = (columns['ts'][0] // self.T, columns['ts'][1])
+        return columns
+
+    def get_records(self, start, end):
+        """
+        Returns the rows as the tuples of the flows file (with ts / T), for the code that needs records
+        """
+        if self.records is not None:
+            return self.records[start:end]
+        fields = []
+        for fld in self.fields:
+            array, kind = self.get_columns(start, end)[fld]
+            if kind == KIND_IP:
+                fields.append([socket.inet_ntoa(struct.pack('!I', value)) for value in array.tolist()])
+            elif fld.endswith('Mac'):
+                fields.append([int_to_mac(value) for value in array.tolist()])
+            elif fld == 'ts':
+                fields.append(array.tolist())
+            else:
+                fields.append([str(value) for value in array.tolist()])
+        return zip(*fields)
+
+    def iter_chunks(self, max_rows=CHUNK_ROWS):
+        """
+        Yields (start, end) row ranges of whole windows, of about max_rows rows
+        """
+        bounds = self.get_window_bounds()
+        start = 0
+        for end in bounds[1:]:
+            if end - start >= max_rows:
+                yield start, int(end)
+                start = int(end)
+        if start < self.n_rows:
+            yield start, self.n_rows
+
+    def iter_windows(self):
+        """
+        Yields (ts, columns) for each window, the columns are slices of the store
+        """
+        bounds = self.get_window_bounds()
+        for index, ts in enumerate(self.timestamps.tolist()):
+            yield ts, self.get_columns(int(bounds[index]), int(bounds[index + 1]))
+
+
+def get_training_data_from_records(records, fields):
+    """
+    Returns the TrainingData of (ts, ...) tuples already in memory, ts being the window
+    """
+    records = sorted(records, key=lambda record: record[0])
+    columns = {}
+    field_values = zip(*records) if records else [() for _ in fields]
+    for fld, values in zip(fields, field_values):
+        columns[fld] = to_column(list(values), get_field_kind(fld))
+    return TrainingData(columns, 1, records)
+
+
+def load_training_data(store_path, T):
+    with open(os.path.join(store_path, META_FILE)) as f:
+        meta = json.load(f)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError('unsupported training data store version %i' % meta['version'])
+    columns = {}
+    for fld, dtype in meta['fields']:
+        fld = str(fld)
+        path = os.path.join(store_path, fld + '.bin')
+        if meta['rows'] > 0:
+            array = np.memmap(path, dtype=str(dtype), mode='r', shape=(meta['rows'],))
+        else:
+            array = np.array([], dtype=str(dtype))
+        columns[fld] = (array, KIND_IP if 'IP' in fld else KIND_INT)
+    return TrainingData(columns, T, source=meta['source'])
+
+
+def get_training_data(trace_file, T, store_path=None, proto=17):
+    """
+    Returns the TrainingData of a flows file (csv) or pcap, converting it into the store the first
+    time, or when the trace changed since
+    """
+    if store_path is None:
+        store_path = trace_file + '.store'
+    meta_path = os.path.join(store_path, META_FILE)
+    is_converted = os.path.exists(meta_path) and os.path.getmtime(meta_path) >= os.path.getmtime(trace_file)
+    if is_converted:
+        with open(meta_path) as f:
+            is_converted = json.load(f).get('proto') == proto
+    if not is_converted:
+        print "Converting the training data", trace_file, "into", store_path, "..."
+        if trace_file.endswith('.pcap'):
+            convert_pcap(trace_file, store_path, proto)
+        else:
+            convert_csv(trace_file, store_path, proto)
+    return load_training_data(store_path, T)
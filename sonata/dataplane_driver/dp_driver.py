@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 
 import logging
-import pickle
 import time
-from multiprocessing.connection import Listener
 
 from query_cleaner import get_clean_application
+from sonata.message_bus import MessageServer
+from sonata.wire_format import is_encoded_message, decode_message
 
 
 class DataplaneDriver(object):
@@ -44,42 +44,43 @@ class DataplaneDriver(object):
 
     def start(self):
         self.logger.debug('starting the event listener')
-        dpd_listener = Listener(tuple(self.dpd_socket))
-        while True:
-            conn = dpd_listener.accept()
-            raw_data = conn.recv()
-            message = pickle.loads(raw_data)
-            for key in message.keys():
-                if key == 'init':
-                    start = "%.20f" % time.time()
-                    self.logger.debug('received "init" message')
-                    application = message[key][0]
-                    target_id = message[key][1]
-                    sonata_fields = message[key][2]
-                    self.configure(application, target_id, sonata_fields)
-                    # self.metrics.info("init" + ","+ str(len(application)) +"," + start +",%.20f" % time.time())
-                elif key == 'delta':
-                    # self.logger.debug('received "delta" message')
-                    start = "%.20f" % time.time()
-                    filter_update = message[key][0]
-                    target_id = message[key][1]
-                    self.update_configuration(filter_update, target_id)
-                    # self.metrics.info("delta" + ","+ str(len(filter_update)) +"," + start +",%.20f" % time.time())
-                elif key == 'is_supported':
-                    self.logger.debug('received "is_supported" message')
-                    application = message[key][0]
-                    target_id = message[key][1]
-                    is_supported = self.is_supportable(application, target_id)
-                    conn.send(is_supported)
-                elif key == 'get_cost':
-                    self.logger.debug('received "get_cost" message')
-                    application = message[key][0]
-                    target_id = message[key][1]
-                    cost = self.get_cost(application, target_id)
-                    conn.send(cost)
-                else:
-                    self.logger.error('Unsupported Key')
-            conn.close()
+        # persistent connections, the runtime gets a reply once each message is handled
+        server = MessageServer(self.dpd_socket, self.handle_message)
+        server.serve_forever()
+
+    def handle_message(self, message):
+        if is_encoded_message(message):
+            message = decode_message(message)
+        reply = None
+        for key in message.keys():
+            if key == 'init':
+                start = "%.20f" % time.time()
+                self.logger.debug('received "init" message')
+                application = message[key][0]
+                target_id = message[key][1]
+                sonata_fields = message[key][2]
+                self.configure(application, target_id, sonata_fields)
+                # self.metrics.info("init" + ","+ str(len(application)) +"," + start +",%.20f" % time.time())
+            elif key == 'delta':
+                # self.logger.debug('received "delta" message')
+                start = "%.20f" % time.time()
+                filter_update = message[key][0]
+                target_id = message[key][1]
+                self.update_configuration(filter_update, target_id)
+                # self.metrics.info("delta" + ","+ str(len(filter_update)) +"," + start +",%.20f" % time.time())
+            elif key == 'is_supported':
+                self.logger.debug('received "is_supported" message')
+                application = message[key][0]
+                target_id = message[key][1]
+                reply = self.is_supportable(application, target_id)
+            elif key == 'get_cost':
+                self.logger.debug('received "get_cost" message')
+                application = message[key][0]
+                target_id = message[key][1]
+                reply = self.get_cost(application, target_id)
+            else:
+                self.logger.error('Unsupported Key')
+        return reply
 
     def add_target(self, target_type, tid, config):
         self.logger.info('adding new target of type %s with id %s' % (type, str(tid)))
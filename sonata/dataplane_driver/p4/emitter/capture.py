@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import mmap
+import select
+import socket
+import struct
+import time
+
+"""
+Raw capture front-ends for the emitter. Both deliver the captured frames in batches, as zero-copy
+buffer views (slicing one returns a string copy, struct.unpack_from reads it in place), without
+building a scapy object per packet.
+"""
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_req3
+TPACKET_REQ3 = struct.Struct('IIIIIII')
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1: block_status, num_pkts,
+# offset_to_first_pkt
+BLOCK_DESC = struct.Struct('IIIII')
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac, tp_net
+TPACKET3_HDR = struct.Struct('IIIIIIHH')
+
+BLOCK_SIZE = 1 << 22
+BLOCK_COUNT = 64
+FRAME_SIZE = 1 << 11
+BLOCK_TIMEOUT_MS = 10
+POLL_TIMEOUT = 1
+
+# pcap file format
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAP_GLOBAL_HEADER = struct.Struct('IHHiIII')
+PCAP_RECORD_HEADER = struct.Struct('IIII')
+PCAP_BATCH_SIZE = 1024
+
+
+class AFPacketCapture(object):
+    """
+    TPACKET_V3 mmap ring on an AF_PACKET socket (Linux only). The kernel fills whole blocks of
+    frames, each block is handed out as one batch and given back to the kernel once the consumer
+    asks for the next one.
+    """
+    def __init__(self, interface, block_size=BLOCK_SIZE, block_count=BLOCK_COUNT, frame_size=FRAME_SIZE):
+        self.interface = interface
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        frame_count = (block_size / frame_size) * block_count
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                             TPACKET_REQ3.pack(block_size, block_count, frame_size, frame_count,
+                                               BLOCK_TIMEOUT_MS, 0, 0))
+        self.sock.bind((interface, ETH_P_ALL))
+        self.ring = mmap.mmap(self.sock.fileno(), block_size * block_count, mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+
+    def iter_batches(self):
+        ring = self.ring
+        block_index = 0
+        while True:
+            block_offset = block_index * self.block_size
+            _, _, block_status, num_pkts, first_pkt = BLOCK_DESC.unpack_from(ring, block_offset)
+            if not block_status & TP_STATUS_USER:
+                self.poller.poll(POLL_TIMEOUT * 1000)
+                continue
+
+            frames = []
+            pkt_offset = block_offset + first_pkt
+            for _ in xrange(num_pkts):
+                next_offset, _, _, snaplen, _, _, mac, _ = TPACKET3_HDR.unpack_from(ring, pkt_offset)
+                frames.append(buffer(ring, pkt_offset + mac, snaplen))
+                pkt_offset += next_offset
+
+            yield frames
+
+            # the consumer is done with this batch, give the block back to the kernel
+            struct.pack_into('I', ring, block_offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+            block_index = (block_index + 1) % self.block_count
+
+    def close(self):
+        self.ring.close()
+        self.sock.close()
+
+
+class PcapCapture(object):
+    """
+    Replays the frames of a pcap file, optionally at the pace of their capture timestamps,
+    to run the emitter and measure it without a switch.
+    """
+    def __init__(self, path, batch_size=PCAP_BATCH_SIZE, realtime=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.realtime = realtime
+
+    def iter_batches(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        magic = struct.unpack_from('<I', data, 0)[0]
+        endian = '<' if magic in (PCAP_MAGIC, PCAP_MAGIC_NS) else '>'
+        ts_scale = 1e-9 if PCAP_MAGIC_NS in (magic, struct.unpack_from('>I', data, 0)[0]) else 1e-6
+        record_header = struct.Struct(endian + PCAP_RECORD_HEADER.format)
+
+        offset = PCAP_GLOBAL_HEADER.size
+        frames = []
+        first_ts = None
+        start = time.time()
+        while offset + record_header.size <= len(data):
+            ts_sec, ts_frac, incl_len, _ = record_header.unpack_from(data, offset)
+            offset += record_header.size
+
+            if self.realtime:
+                ts = ts_sec + ts_frac * ts_scale
+                if first_ts is None:
+                    first_ts = ts
+                delay = (ts - first_ts) - (time.time() - start)
+                if delay > 0:
+                    # hand out what was captured so far before waiting for this frame
+                    if frames:
+                        yield frames
+                        frames = []
+                    time.sleep(delay)
+
+            frames.append(buffer(data, offset, incl_len))
+            offset += incl_len
+            if len(frames) >= self.batch_size:
+                yield frames
+                frames = []
+        if frames:
+            yield frames
+
+    def close(self):
+        pass
+
+
+def get_capture(capture_type, interface, capture_file=None, realtime=False):
+    """
+    Returns the raw capture front-end for the capture type of the emitter conf,
+    None for 'scapy' which keeps scapy's sniff
+    """
+    if capture_type == 'af_packet':
+        return AFPacketCapture(str(interface))
+    elif capture_type == 'pcap':
+        return PcapCapture(capture_file, realtime=realtime)
+    elif capture_type == 'scapy':
+        return None
+    raise ValueError('unknown capture type %s' % capture_type)
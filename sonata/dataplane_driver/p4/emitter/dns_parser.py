@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import socket
+import struct
+
+"""
+Parses the DNS fields in scapy_fields_supported straight from the bytes of the reported packet,
+returning the same strings as the scapy based PayloadField. Anything it does not handle (non IPv4,
+truncated or malformed messages, rdata of other record types) returns None so that the caller falls
+back to scapy.
+"""
+
+DNS_FIELDS = {'dns.ns.type', 'dns.ancount', 'dns.an.rrname', 'dns.an.ttl', 'dns.an.rdata'}
+
+ETHERTYPE_IPV4 = 0x0800
+IP_PROTO_UDP = 17
+DNS_PORT = 53
+
+ETHER_HEADER = struct.Struct('>6s6sH')
+UDP_PORTS = struct.Struct('>HH')
+DNS_HEADER = struct.Struct('>HHHHHH')
+RR_HEADER = struct.Struct('>HHIH')
+QUESTION_TAIL_SIZE = 4
+
+TYPE_A = 1
+TYPE_NS = 2
+TYPE_CNAME = 5
+TYPE_PTR = 12
+TYPE_AAAA = 28
+NAME_TYPES = (TYPE_NS, TYPE_CNAME, TYPE_PTR)
+
+MAX_POINTERS = 32
+
+
+class DNSParseError(Exception):
+    pass
+
+
+def read_name(msg, offset):
+    """
+    Returns the dotted name at offset (with scapy's trailing dot) and the offset right after it
+    """
+    labels = []
+    end = None
+    pointers = 0
+    while True:
+        length = ord(msg[offset])
+        if length == 0:
+            offset += 1
+            break
+        elif length & 0xc0 == 0xc0:
+            if end is None:
+                end = offset + 2
+            pointers += 1
+            if pointers > MAX_POINTERS:
+                raise DNSParseError('compression loop')
+            offset = ((length & 0x3f) << 8) | ord(msg[offset + 1])
+        else:
+            labels.append(msg[offset + 1:offset + 1 + length])
+            offset += 1 + length
+    if end is None:
+        end = offset
+    return '.'.join(labels) + '.', end
+
+
+def skip_name(msg, offset):
+    while True:
+        length = ord(msg[offset])
+        if length == 0:
+            return offset + 1
+        elif length & 0xc0 == 0xc0:
+            return offset + 2
+        offset += 1 + length
+
+
+def read_rr(msg, offset):
+    """
+    Returns (rrname offset, type, ttl, rdata offset, rdata length) and the offset of the next record
+    """
+    name_offset = offset
+    offset = skip_name(msg, offset)
+    rr_type, _, ttl, rdlength = RR_HEADER.unpack_from(msg, offset)
+    offset += RR_HEADER.size
+    if offset + rdlength > len(msg):
+        raise DNSParseError('truncated record')
+    return (name_offset, rr_type, ttl, offset, rdlength), offset + rdlength
+
+
+def get_rdata(msg, rr):
+    _, rr_type, _, offset, rdlength = rr
+    if rr_type == TYPE_A and rdlength == 4:
+        return socket.inet_ntoa(msg[offset:offset + 4])
+    elif rr_type == TYPE_AAAA and rdlength == 16:
+        return socket.inet_ntop(socket.AF_INET6, msg[offset:offset + 16])
+    elif rr_type in NAME_TYPES:
+        return read_name(msg, offset)[0]
+    raise DNSParseError('unsupported rdata type %i' % rr_type)
+
+
+def get_dns_message(frame, offset):
+    """
+    Returns the DNS message of the ethernet frame starting at offset, None if it carries no DNS over UDP
+    """
+    _, _, ether_type = ETHER_HEADER.unpack_from(frame, offset)
+    if ether_type != ETHERTYPE_IPV4:
+        raise DNSParseError('not ipv4')
+    ip_offset = offset + ETHER_HEADER.size
+    ihl = (ord(frame[ip_offset]) & 0x0f) * 4
+    if ord(frame[ip_offset + 9]) != IP_PROTO_UDP:
+        return None
+    udp_offset = ip_offset + ihl
+    sport, dport = UDP_PORTS.unpack_from(frame, udp_offset)
+    if sport != DNS_PORT and dport != DNS_PORT:
+        return None
+    return frame[udp_offset + 8:]
+
+
+def get_dns_fields(frame, offset, fields):
+    """
+    Returns the values of the DNS fields for the ethernet frame starting at offset,
+    or None if scapy has to extract them
+    """
+    try:
+        msg = get_dns_message(frame, offset)
+        if msg is None:
+            return ['' for _ in fields]
+
+        _, _, qdcount, ancount, nscount, _ = DNS_HEADER.unpack_from(msg, 0)
+        offset = DNS_HEADER.size
+        for _ in xrange(qdcount):
+            offset = skip_name(msg, offset) + QUESTION_TAIL_SIZE
+
+        answer = None
+        authority = None
+        if ancount > 0:
+            answer, offset = read_rr(msg, offset)
+            for _ in xrange(ancount - 1):
+                offset = read_rr(msg, offset)[1]
+        if nscount > 0:
+            authority = read_rr(msg, offset)[0]
+
+        values = []
+        for fld in fields:
+            if fld == 'dns.ancount':
+                values.append(str(ancount))
+            elif fld == 'dns.ns.type':
+                values.append(str(authority[1]) if authority is not None else '')
+            elif answer is None:
+                values.append('')
+            elif fld == 'dns.an.rrname':
+                values.append(read_name(msg, answer[0])[0])
+            elif fld == 'dns.an.ttl':
+                values.append(str(answer[2]))
+            elif fld == 'dns.an.rdata':
+                values.append(get_rdata(msg, answer))
+            else:
+                return None
+        return values
+    except (DNSParseError, IndexError, struct.error, socket.error, ValueError):
+        return None
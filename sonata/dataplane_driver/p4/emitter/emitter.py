@@ -2,19 +2,27 @@ from scapy.all import *
 from multiprocessing.connection import Listener
 import time
 import logging
-from emitter_field import Field, IPField, MacField, PayloadField
+from emitter_field import Field, get_payload_fields
+from dns_parser import DNS_FIELDS, get_dns_fields
+from emitter_decoder import get_header_decoders
+from index_store import get_index_store
+from register_client import RegisterClient
+from emitter_transport import FrameEncoder, FRAME_SIZE, FRAME_INTERVAL
+from capture import get_capture
 from scapy.config import conf
-import mysql.connector
-from threading import Thread
+from threading import Thread, Lock
 from sonata.dataplane_driver.utils import get_out
 import re
 
 QID_SIZE = 16
 BYTE_SIZE = 8
 
+# payloads following the out headers are parsed as ethernet frames
+conf.l3types.register_num2layer(3, Ether)
+
 
 class Emitter(object):
-    def __init__(self, conf, queries):
+    def __init__(self, conf, queries, register_qids=None):
         # Interfaces
         print "Emitter Started"
         self.spark_stream_address = conf['spark_stream_address']
@@ -23,7 +31,7 @@ class Emitter(object):
 
         self.listener = Listener((self.spark_stream_address, self.spark_stream_port))
         self.spark_conn = None
-        self.db_conf = conf['db']
+        self.db_conf = conf.get('db')
         # queries has the following format
         # queries = dict with qid as key
         # -> per qid we have again a dict with the following key, values:
@@ -31,10 +39,57 @@ class Emitter(object):
         #       - key: headers, values: list of tuples with (field name, field size)
 
         self.queries = queries
+        # qids whose registers this emitter polls, all of them unless the emitter is one of several workers
+        if register_qids is None:
+            register_qids = self.queries.keys()
+        self.register_qids = register_qids
+        # False for the workers of a ShardedEmitter, they only decode the out headers they own (owns_layer)
+        self.all_layers = True
         self.qid_field = Field(target_name='qid', sonata_name='qid', size=QID_SIZE,
                                format='>H', offset=0)
+        self.qid_struct = self.qid_field.unpack_struct
+
+        # compiled out header decoders, one per qid
+        self.decoders = get_header_decoders(self.queries)
+        # compiled payload field accessors, one list per qid that parses the payload
+        self.payload_fields = get_payload_fields(self.queries)
+        # qids whose payload fields are all read by the byte level DNS parser, scapy is the fallback
+        self.dns_qids = set()
+        if conf.get('fast_dns', True):
+            for qid in self.payload_fields:
+                if set(self.queries[qid]['payload_fields']).issubset(DNS_FIELDS):
+                    self.dns_qids.add(qid)
+
+        # 'binary' sends fixed-width records in frames instead of comma separated lines
+        self.transport = conf.get('transport', 'text')
+        self.frame_size = conf.get('frame_size', FRAME_SIZE)
+        self.frame_interval = conf.get('frame_interval', FRAME_INTERVAL)
+        self.encoder = None
+        # only the queries whose tuples are made of out header fields are sent as binary records
+        self.binary_qids = set()
+        if self.transport == 'binary':
+            for qid in self.decoders:
+                query = self.queries[qid]
+                if not (query['parse_payload'] or query['filter_payload'] or query['reads_register']):
+                    self.binary_qids.add(qid)
+
+        # raw capture front-end: 'scapy' (sniff), 'af_packet' (mmap ring) or 'pcap' (file replay)
+        self.capture_type = conf.get('capture', 'scapy')
+        self.capture_file = conf.get('capture_file')
+        self.capture_realtime = conf.get('capture_realtime', False)
+
+        # index store for the tuples of queries that read registers
+        self.index_store = get_index_store(conf)
+
+        # queries whose out header ends with an overflow flag (HashPipe), the tuples of the keys that found no
+        # register are counted here and sent along with the register values
+        self.overflow_qids = set([qid for qid in self.decoders if self.queries[qid].get('overflow')])
+        self.overflow_counts = {}
+        self.overflow_lock = Lock()
 
-        self.cnx = mysql.connector.connect(**self.db_conf)
+        # epoch of the current window, set by the controller when it flips the register banks. The bank of the
+        # current epoch is still updated and is not read, None reads all of them at every poll.
+        self.epoch = None
 
         self.read_file = conf['read_file']
         self.write_file = conf['write_file']
@@ -43,6 +98,15 @@ class Emitter(object):
         self.thrift_port = conf['thrift_port']
         self.emitter_read_timeout = conf['read_timeout']
 
+        # registers are read over a persistent thrift session, with runtime_CLI when register_access is 'cli' or
+        # when the thrift bindings of bmv2 are missing
+        self.register_client = None
+        if conf.get('register_access', 'thrift') == 'thrift':
+            try:
+                self.register_client = RegisterClient(conf.get('thrift_ip', 'localhost'), self.thrift_port)
+            except ImportError as e:
+                print "%s, falling back to runtime_CLI" % e
+
         print self.queries, self.emitter_read_timeout
 
         self.reader_thread = Thread(name='reader_thread', target=self.start_reader)
@@ -52,7 +116,7 @@ class Emitter(object):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
         # create file handler which logs messages
-        self.fh = logging.FileHandler(conf['log_path'] + "emitter.log")
+        self.fh = logging.FileHandler(conf['log_path'] + conf.get('log_name', "emitter.log"))
         self.fh.setLevel(logging.INFO)
         self.logger.addHandler(self.fh)
 
@@ -60,6 +124,11 @@ class Emitter(object):
         while True:
             print "Waiting for socket"
             self.spark_conn = self.listener.accept()
+            if self.transport == 'binary':
+                binary_decoders = dict((qid, self.decoders[qid]) for qid in self.binary_qids)
+                self.encoder = FrameEncoder(binary_decoders, self.spark_conn.send_bytes,
+                                            self.frame_size, self.frame_interval)
+                self.encoder.send_layouts()
 
             print "*********************************************************************"
             print "*                           System Ready                            *"
@@ -68,32 +137,81 @@ class Emitter(object):
             print "Now start sniffing the packets from switch"
             self.sniff_packets()
 
+    def get_epoch(self):
+        return self.epoch
+
+    def owns_layer(self, qid, p_str, offset):
+        return True
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
     def start_reader(self):
         while True:
-            for qid in self.queries.keys():
+            epoch = self.get_epoch()
+            for qid in self.register_qids:
                 if self.queries[qid]['registers']:
                     for register in self.queries[qid]['registers']:
+                        if epoch is not None and self.queries[qid].get('register_epochs', {}).get(register) == epoch:
+                            continue
                         self.process_register_values(qid, register)
+                if qid in self.overflow_qids:
+                    self.process_overflow_counts(qid)
                 print "woke up", qid
+            if self.encoder is not None:
+                self.encoder.flush()
             time.sleep(self.emitter_read_timeout)
 
     def send_data(self, data):
-        self.spark_conn.send_bytes(data)
+        if self.encoder is not None:
+            self.encoder.add_text(data)
+        else:
+            self.spark_conn.send_bytes(data)
 
     def process_register_values(self, read_qid, register):
-        cnx = mysql.connector.connect(**self.db_conf)
-        cursor = cnx.cursor(buffered=True)
-        query = "SELECT id, qid, tuple, indexLoc FROM indexStore where qid = %d"%(read_qid)
-        cursor.execute(query)
         store = {}
+        for (id, qid, tuple, indexLoc) in self.index_store.scan(read_qid):
+            store[indexLoc] = {'tuple': tuple, 'id': id }
+
+        # the stages of a HashPipe share the index field, the indexes of this register start at offset
+        offset, width = self.queries[read_qid].get('register_offsets', {}).get(register, (0, None))
+        indexes = [indexLoc - offset for indexLoc in store if width is None or offset <= indexLoc < offset + width]
+
+        if self.register_client is not None:
+            output = self.register_client.read_and_reset(register, indexes)
+        else:
+            output = self.read_registers_with_cli(register, indexes)
+        output = dict((indexLoc + offset, value) for indexLoc, value in output.iteritems())
+
+        ids = []
+        for indexLoc, value in output.iteritems():
+            out = store[indexLoc]['tuple'] + "," + str(value) + "\n"
+            # print out
+            self.send_data(out)
+
+            ids.append(store[indexLoc]['id'])
+
+        self.index_store.delete(ids)
+
+        # print ids
+
+    def add_overflow_tuple(self, qid, tuple):
+        with self.overflow_lock:
+            counts = self.overflow_counts.setdefault(qid, {})
+            counts[tuple] = counts.get(tuple, 0) + 1
+
+    def process_overflow_counts(self, qid):
+        with self.overflow_lock:
+            counts = self.overflow_counts.pop(qid, {})
+        for tuple, count in counts.iteritems():
+            self.send_data(tuple + "," + str(count) + "\n")
+
+    def read_registers_with_cli(self, register, indexes):
         with open(self.read_file, 'w') as f:
-            for (id, qid, tuple, indexLoc) in cursor:
-                store[indexLoc] = {'tuple': tuple, 'id': id }
+            for indexLoc in indexes:
                 f.write("register_read "+register+" " + str(indexLoc) + "\n")
             f.flush()
             f.close()
-        cursor.close()
-        cnx.close()
         success, out = get_out(self.bmv2_cli + " --thrift-port " + str(self.thrift_port) + " < " + self.read_file + " | grep -o -e \"$1.*[1-9][0-9]*$\"")
 
         output = {}
@@ -102,34 +220,14 @@ class Emitter(object):
                 for line in out.split('\n'):
                     if line:
                         m = re.search('.*\[(.*)\]\=\s+(.*)', line)
-                        output[m.group(1)] = m.group(2)
+                        output[int(m.group(1))] = int(m.group(2))
                         f.write("register_write "+register+" " + str(m.group(1)) + " 0\n")
                 f.flush()
                 f.close()
 
             success3, out3 = get_out(self.bmv2_cli + " --thrift-port " + str(self.thrift_port) + " < " + self.write_file)
             # print "Write Register: " + str(success3) + " "
-        ids = []
-
-        for indexLoc in store.keys():
-            if str(indexLoc) in output.keys():
-                out = store[indexLoc]['tuple'] + ","+output[str(indexLoc)] + "\n"
-                # print out
-                self.send_data(out)
-
-                ids.append(store[indexLoc]['id'])
-
-        if ids:
-            ids_str = ",".join([str(id) for id in ids])
-            delete_indexes = ("DELETE FROM indexStore WHERE id in ("+ids_str+")")
-            cnx = mysql.connector.connect(**self.db_conf)
-            cursor = cnx.cursor(buffered=True)
-            cursor.execute(delete_indexes)
-            cnx.commit()
-            cursor.close()
-            cnx.close()
-
-        # print ids
+        return output
 
     def store_tuple_to_db(self, tuple):
 
@@ -137,115 +235,103 @@ class Emitter(object):
         index = tuples[-1]
         qid = tuples[1]
 
-        cnx = mysql.connector.connect(**self.db_conf)
-        cursor = cnx.cursor(buffered=True)
-        add_index = ("INSERT INTO indexStore "
-                     "(qid, tuple, indexLoc) "
-                     "VALUES (%s, %s, %s)")
         newTuple = ",".join(tuples[:-1])
-        data_index = (int(qid), newTuple, int(index))
-        # INSERT INTO DB
-        cursor.execute(add_index, data_index)
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        # buffered, the store sends the rows in bulk
+        self.index_store.add(qid, newTuple, index)
         # print "store_tuple_to_db"
 
     def sniff_packets(self):
         print "Interface confirming: ", self.sniff_interface
-        sniff(iface=str(self.sniff_interface), prn=lambda x: self.process_packet(x))
+        capture = get_capture(self.capture_type, self.sniff_interface, self.capture_file, self.capture_realtime)
+        if capture is None:
+            sniff(iface=str(self.sniff_interface), prn=lambda x: self.process_packet(x))
+        else:
+            try:
+                for frames in capture.iter_batches():
+                    for frame in frames:
+                        self.process_frame(frame)
+            finally:
+                capture.close()
 
     def process_packet(self, raw_packet):
         '''
         callback function executed for each capture packet
         '''
-        p_str = str(raw_packet)
+        self.process_frame(str(raw_packet), raw_packet)
+
+    def process_frame(self, p_str, raw_packet=None):
+        '''
+        process one captured frame, the scapy packet is only built for the queries that filter on the payload
+        '''
         # hexdump(raw_packet)
         # if raw_packet.haslayer(Raw):
         #     print str(raw_packet.getlayer(Raw).load)
         offset = 0
         # Read first two bits to extract query id (first field for all out headers is qid)
-        self.qid_field.offset = offset
-        qid = int(self.qid_field.extract_field(p_str))
-        offset = self.qid_field.get_updated_offset()
+        qid = self.qid_struct.unpack_from(p_str, offset)[0]
         ctr = 0
-        ctr += self.qid_field.ctr
 
-        while True:
+        while qid in self.decoders:
             start = "%.20f" % time.time()
-            if int(qid) in [int(x) for x in self.queries.keys()] and int(qid) != 0:
-                query = self.queries[qid]
-                out_headers = query['headers']
-                output_tuple = list()
-                if out_headers is not None:
-                    for fld in out_headers.fields[1:]:
-                        fld_name = fld.target_name
-                        fld_size = fld.size
-                        if 'IP' in fld_name:
-                            fld = IPField(fld_name, fld_name, offset)
-                        elif 'Mac' in fld_name:
-                            fld = MacField(fld_name, fld_name, offset)
-                        else:
-                            format = ''
-                            if fld_size == 8:
-                                format = 'B'
-                            elif fld_size == 16:
-                                format = '>H'
-                            fld = Field(fld_name, fld_name, fld_size, format, offset)
-
-                        offset = fld.get_updated_offset()
-                        ctr += fld.ctr
-                        field_value = fld.extract_field(p_str)
-                        output_tuple.append(field_value)
-
-                payload_fields = query['payload_fields']
-                if query['parse_payload'] and payload_fields != ['payload']:
-                    conf.l3types.register_num2layer(3, Ether)
-                    ctr += 4
-                    new_raw_packet = conf.l3types[3](p_str[ctr:])
-
-                    for fld in payload_fields:
-                        payload_field = PayloadField(fld)
-                        extracted_value = payload_field.extract_field(new_raw_packet)
-                        output_tuple.append(extracted_value)
-
-                output_tuple = ['k'] + [str(qid)] + output_tuple
-                send_tuple = ",".join([str(x) for x in output_tuple])
-
-                if query['filter_payload']:
-                    output_payload = '0'
-                    if raw_packet.haslayer(Raw):
-                        payload = str(raw_packet.getlayer(Raw).load)
-                        if query['filter_payload_str'] in payload:
-                            output_payload = query['filter_payload_str']
-
-                if query['filter_payload']:
-                    send_tuple += "," + output_payload
-                self.logger.debug(send_tuple)
-                if query['reads_register']:
-                    # print "storing" + send_tuple
-                    self.store_tuple_to_db(send_tuple)
-                else:
-                    # if qid == 30032: print send_tuple
-                    # print send_tuple
-                    self.send_data(send_tuple + "\n")
-                self.logger.info("emitter," + str(qid) + "," + str(start) + ",%.20f" % time.time())
-
-                self.qid_field.offset = offset
-                # Read first two bits for the next out header layer
-                next_qid = self.qid_field.extract_field(p_str)
-
-                qid = int(next_qid)
-                if int(qid) in [int(x) for x in self.queries.keys()] and int(qid) != 0:
-                    # we need to parse another layer for this packet
-                    offset = self.qid_field.get_updated_offset()
-                    ctr += self.qid_field.ctr
+            query = self.queries[qid]
+            decoder = self.decoders[qid]
+
+            if not (self.all_layers or self.owns_layer(qid, p_str, offset)):
+                offset = decoder.get_updated_offset(offset)
+                ctr += decoder.size
+                qid = self.qid_struct.unpack_from(p_str, offset)[0]
+                continue
+
+            if qid in self.binary_qids:
+                self.encoder.add_record(qid, p_str, offset)
+                offset = decoder.get_updated_offset(offset)
+                ctr += decoder.size
+                qid = self.qid_struct.unpack_from(p_str, offset)[0]
+                continue
+
+            send_tuple = decoder.decode(p_str, offset)
+            offset = decoder.get_updated_offset(offset)
+            ctr += decoder.size
+
+            if qid in self.overflow_qids:
+                send_tuple, overflow = send_tuple.rsplit(",", 1)
+                if overflow != '0':
+                    # counted here instead of in a register, the index field is not set
+                    self.add_overflow_tuple(qid, send_tuple.rsplit(",", 1)[0])
+                    qid = self.qid_struct.unpack_from(p_str, offset)[0]
                     continue
-                else:
-                    # we have extracted all layers for this packet now
-                    break
+
+            if qid in self.payload_fields:
+                ctr += 4
+                values = None
+                if qid in self.dns_qids:
+                    values = get_dns_fields(p_str, ctr, query['payload_fields'])
+                if values is None:
+                    new_raw_packet = conf.l3types[3](p_str[ctr:])
+                    values = [fld.extract_field(new_raw_packet) for fld in self.payload_fields[qid]]
+                for value in values:
+                    send_tuple += "," + value
+
+            if query['filter_payload']:
+                output_payload = '0'
+                if raw_packet is None:
+                    raw_packet = Ether(str(p_str))
+                if raw_packet.haslayer(Raw):
+                    payload = str(raw_packet.getlayer(Raw).load)
+                    if query['filter_payload_str'] in payload:
+                        output_payload = query['filter_payload_str']
+                send_tuple += "," + output_payload
+
+            self.logger.debug(send_tuple)
+            if query['reads_register']:
+                # print "storing" + send_tuple
+                self.store_tuple_to_db(send_tuple)
             else:
-                break
+                self.send_data(send_tuple + "\n")
+            self.logger.info("emitter," + str(qid) + "," + str(start) + ",%.20f" % time.time())
+
+            # Read first two bits for the next out header layer, we are done once it is not a known query
+            qid = self.qid_struct.unpack_from(p_str, offset)[0]
 
 
 if __name__ == '__main__':
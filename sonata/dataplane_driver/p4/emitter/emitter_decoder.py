@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import struct
+
+# struct codes and tuple templates for the kinds of fixed-size fields of the out headers
+FIELD_KIND_TO_FORMAT = {'B': ('B', '%d'), 'H': ('H', '%d'), 'I': ('I', '%d'),
+                        'ip': ('4B', '%d.%d.%d.%d'), 'mac': ('6B', '%d.%d.%d.%d.%d.%d')}
+FIELD_SIZE_TO_KIND = {8: 'B', 16: 'H', 32: 'I'}
+
+
+def get_field_kind(fld_name, fld_size):
+    if 'IP' in fld_name:
+        return 'ip'
+    elif 'Mac' in fld_name:
+        return 'mac'
+    elif fld_size in FIELD_SIZE_TO_KIND:
+        return FIELD_SIZE_TO_KIND[fld_size]
+    else:
+        raise ValueError('unsupported out header field %s of size %i' % (fld_name, fld_size))
+
+
+class HeaderDecoder(object):
+    """
+    Decoder for the out header of one query. The struct covering the whole out header (qid included)
+    and the template of the emitted tuple are compiled once, so decoding a layer is a single
+    unpack_from and a single string format.
+    """
+    def __init__(self, qid, out_headers):
+        self.qid = qid
+        self.field_names = ['qid']
+        self.field_kinds = ['H']
+
+        struct_format = '>H'
+        tuple_template = 'k,%d'
+        if out_headers is not None:
+            for fld in out_headers.fields[1:]:
+                fld_kind = get_field_kind(fld.target_name, fld.size)
+                fld_format, fld_template = FIELD_KIND_TO_FORMAT[fld_kind]
+                struct_format += fld_format
+                tuple_template += ',' + fld_template
+                self.field_names.append(fld.target_name)
+                self.field_kinds.append(fld_kind)
+
+        self.header_struct = struct.Struct(struct_format)
+        self.tuple_template = tuple_template
+        self.size = self.header_struct.size
+
+    def __repr__(self):
+        return 'HeaderDecoder(qid=' + str(self.qid) + ', fields=' + str(self.field_names) + ')'
+
+    def decode(self, packet_as_string, offset):
+        """
+        Returns the comma separated tuple for the out header starting at offset (the position of its qid field)
+        """
+        return self.tuple_template % self.header_struct.unpack_from(packet_as_string, offset)
+
+    def get_updated_offset(self, offset):
+        return offset + self.size
+
+
+def get_header_decoders(queries):
+    """
+    Build the qid -> decoder dict from the header formats returned by P4Application.get_header_formats
+    """
+    decoders = dict()
+    for qid, query in queries.iteritems():
+        if int(qid) != 0:
+            decoders[int(qid)] = HeaderDecoder(int(qid), query['headers'])
+    return decoders
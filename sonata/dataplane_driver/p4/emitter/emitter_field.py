@@ -22,10 +22,19 @@ scapy_fields_supported = {
 
 
 class PayloadField(object):
+    """
+    Payload field extracted from the scapy packet, the target name is resolved once into the layer
+    class and the attribute chain instead of being evaluated for every packet
+    """
     def __init__(self, sonata_name):
         self.target_name = scapy_fields_supported[sonata_name]
         self.sonata_name = sonata_name
 
+        target_fields = self.target_name.split('.')
+        self.layer = globals()[target_fields[0]]
+        self.intermediate_fields = target_fields[1:-1]
+        self.field = target_fields[-1]
+
     def get_sonata_name(self):
         return self.sonata_name
 
@@ -33,21 +42,25 @@ class PayloadField(object):
         return self.target_name
 
     def extract_field(self, raw_packet):
-        layer = self.target_name.split('.')[0]
-        layer_str = "raw_packet.haslayer(" + layer + ")"
-        extracted_value = ''
-        has_field = True
-        if eval(layer_str):
-            cum_str = 'raw_packet'
-            for intermediate_field in self.target_name.split('.')[1:-1]:
-                cum_str += '.' + intermediate_field
-                if not eval(cum_str):
-                    has_field = False
-                    break
-            if has_field:
-                extracted_value = str(eval(cum_str + "." + self.target_name.split('.')[-1]))
-
-        return extracted_value
+        if not raw_packet.haslayer(self.layer):
+            return ''
+        value = raw_packet
+        for intermediate_field in self.intermediate_fields:
+            value = getattr(value, intermediate_field)
+            if not value:
+                return ''
+        return str(getattr(value, self.field))
+
+
+def get_payload_fields(queries):
+    """
+    Returns qid -> PayloadFields of the queries that parse the payload
+    """
+    payload_fields = dict()
+    for qid, query in queries.iteritems():
+        if query['parse_payload'] and query['payload_fields'] != ['payload']:
+            payload_fields[int(qid)] = [PayloadField(fld) for fld in query['payload_fields']]
+    return payload_fields
 
 
 class Field(object):
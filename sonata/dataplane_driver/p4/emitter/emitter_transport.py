@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import struct
+import time
+from threading import Lock
+
+"""
+Binary framed transport between the emitter and the stream processor. Frames are sent with
+Connection.send_bytes, which length-prefixes them, and start with a (type, qid, count) header:
+    - FRAME_LAYOUT: count field kinds of the out header of qid, comma separated (sent once per connection)
+    - FRAME_RECORDS: count fixed-width records of qid, the raw out header bytes as reported by the switch
+    - FRAME_TEXT: count comma separated tuples, for the queries whose tuples are not fixed-width
+"""
+
+FRAME_LAYOUT = 0
+FRAME_RECORDS = 1
+FRAME_TEXT = 2
+
+FRAME_HEADER = struct.Struct('>BHH')
+FRAME_SIZE = 256
+# the count field of the frame header is 16 bits wide
+MAX_FRAME_SIZE = 0xffff
+FRAME_INTERVAL = 0.05
+
+
+def check_frame_size(frame_size):
+    if not 1 <= frame_size <= MAX_FRAME_SIZE:
+        raise ValueError('frame_size must be between 1 and %i, got %s' % (MAX_FRAME_SIZE, frame_size))
+
+
+class FrameEncoder(object):
+    def __init__(self, decoders, send_bytes, frame_size=FRAME_SIZE, frame_interval=FRAME_INTERVAL):
+        check_frame_size(frame_size)
+        # qid -> HeaderDecoder of the queries sent as binary records
+        self.decoders = decoders
+        self.send_bytes = send_bytes
+        self.frame_size = frame_size
+        self.frame_interval = frame_interval
+
+        self.records = dict((qid, []) for qid in self.decoders)
+        self.lines = []
+        self.last_flush = time.time()
+        # the sniffer and the register reader threads both send tuples
+        self.lock = Lock()
+
+    def send_layouts(self):
+        for qid, decoder in self.decoders.iteritems():
+            self.send_bytes(FRAME_HEADER.pack(FRAME_LAYOUT, qid, len(decoder.field_kinds)) +
+                            ",".join(decoder.field_kinds))
+
+    def add_record(self, qid, packet_as_string, offset):
+        # zero parsing: the record is the slice of the out header in the reported packet
+        with self.lock:
+            records = self.records[qid]
+            records.append(packet_as_string[offset:offset + self.decoders[qid].size])
+            if len(records) >= self.frame_size:
+                self.send_records(qid)
+            elif time.time() - self.last_flush >= self.frame_interval:
+                self._flush()
+
+    def add_text(self, line):
+        with self.lock:
+            self.lines.append(line.rstrip("\n"))
+            if len(self.lines) >= self.frame_size or time.time() - self.last_flush >= self.frame_interval:
+                self._flush()
+
+    def send_records(self, qid):
+        records = self.records[qid]
+        if records:
+            self.send_bytes(FRAME_HEADER.pack(FRAME_RECORDS, qid, len(records)) + "".join(records))
+            self.records[qid] = []
+
+    def send_text(self):
+        if self.lines:
+            self.send_bytes(FRAME_HEADER.pack(FRAME_TEXT, 0, len(self.lines)) + "\n".join(self.lines))
+            self.lines = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        for qid in self.records:
+            self.send_records(qid)
+        self.send_text()
+        self.last_flush = time.time()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import time
+from abc import ABCMeta, abstractmethod
+from threading import Event, Lock, Thread
+
+INSERT_INDEX = ("INSERT INTO indexStore "
+                "(qid, tuple, indexLoc) "
+                "VALUES (%s, %s, %s)")
+SELECT_INDEX = "SELECT id, qid, tuple, indexLoc FROM indexStore where qid = %s"
+DELETE_INDEX = "DELETE FROM indexStore WHERE id in (%s)"
+
+CREATE_INDEX_TABLE = ("CREATE TABLE IF NOT EXISTS indexStore("
+                      "id INTEGER PRIMARY KEY AUTOINCREMENT, qid INT(6), tuple VARCHAR(200), indexLoc INT(6))")
+
+DB_BATCH_SIZE = 1000
+DB_FLUSH_INTERVAL = 0.1
+DB_POOL_SIZE = 2
+
+
+class IndexStore(object):
+    """
+    Abstract store for the (qid, tuple, indexLoc) rows reported by queries that read registers.
+    Rows are kept in a write-behind buffer and sent to the backend in bulk, either once
+    batch_size rows are buffered or once flush_interval seconds elapsed since the last flush.
+    A flush thread sends the buffered rows when no row is added.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.time()
+        # the sniffer and the register reader threads share the store
+        self.lock = Lock()
+
+        self.closed = Event()
+        if self.flush_interval > 0:
+            self.flush_thread = Thread(name='index_store_flush', target=self.flush_periodically)
+            self.flush_thread.setDaemon(True)
+            self.flush_thread.start()
+
+    def add(self, qid, tuple, index):
+        with self.lock:
+            self.buffer.append((int(qid), tuple, int(index)))
+            if len(self.buffer) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.insert_rows(self.buffer)
+            self.buffer = []
+        self.last_flush = time.time()
+
+    def flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                if not self.closed.is_set() and time.time() - self.last_flush >= self.flush_interval:
+                    self._flush()
+
+    def scan(self, qid):
+        """
+        Flushes pending rows and yields the (id, qid, tuple, indexLoc) rows stored for qid
+        """
+        self.flush()
+        with self.lock:
+            rows = self.select_rows(int(qid))
+        return rows
+
+    def delete(self, ids):
+        if ids:
+            with self.lock:
+                self.delete_rows(ids)
+
+    @abstractmethod
+    def insert_rows(self, rows):
+        pass
+
+    @abstractmethod
+    def select_rows(self, qid):
+        pass
+
+    @abstractmethod
+    def delete_rows(self, ids):
+        pass
+
+    def close(self):
+        with self.lock:
+            self.closed.set()
+            self._flush()
+
+
+class MySQLIndexStore(IndexStore):
+    def __init__(self, db_conf, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL, pool_size=DB_POOL_SIZE):
+        super(MySQLIndexStore, self).__init__(batch_size, flush_interval)
+        from mysql.connector import pooling
+        self.pool = pooling.MySQLConnectionPool(pool_name='sonata_emitter', pool_size=pool_size, **db_conf)
+
+    def insert_rows(self, rows):
+        cnx = self.pool.get_connection()
+        try:
+            cursor = cnx.cursor()
+            cursor.executemany(INSERT_INDEX, rows)
+            cnx.commit()
+            cursor.close()
+        finally:
+            cnx.close()
+
+    def select_rows(self, qid):
+        # unbuffered cursor: rows are streamed from the server instead of being fetched at once
+        cnx = self.pool.get_connection()
+        try:
+            cursor = cnx.cursor(buffered=False)
+            cursor.execute(SELECT_INDEX, (qid,))
+            for row in cursor:
+                yield row
+            cursor.close()
+        finally:
+            cnx.close()
+
+    def scan(self, qid):
+        # a generator holds its pooled connection while the caller iterates, so no lock here
+        self.flush()
+        return self.select_rows(int(qid))
+
+    def delete_rows(self, ids):
+        cnx = self.pool.get_connection()
+        try:
+            cursor = cnx.cursor()
+            cursor.execute(DELETE_INDEX % ",".join([str(id) for id in ids]))
+            cnx.commit()
+            cursor.close()
+        finally:
+            cnx.close()
+
+
+class SQLiteIndexStore(IndexStore):
+    def __init__(self, path=':memory:', batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        super(SQLiteIndexStore, self).__init__(batch_size, flush_interval)
+        import sqlite3
+        self.cnx = sqlite3.connect(path, check_same_thread=False)
+        # tuples are sent as they are to the stream processor
+        self.cnx.text_factory = str
+        self.cnx.execute(CREATE_INDEX_TABLE)
+        self.cnx.commit()
+
+    def insert_rows(self, rows):
+        self.cnx.executemany(INSERT_INDEX.replace('%s', '?'), rows)
+        self.cnx.commit()
+
+    def select_rows(self, qid):
+        return self.cnx.execute(SELECT_INDEX.replace('%s', '?'), (qid,)).fetchall()
+
+    def delete_rows(self, ids):
+        self.cnx.execute(DELETE_INDEX % ",".join([str(id) for id in ids]))
+        self.cnx.commit()
+
+    def close(self):
+        super(SQLiteIndexStore, self).close()
+        self.cnx.close()
+
+
+class MemoryIndexStore(IndexStore):
+    def __init__(self, batch_size=DB_BATCH_SIZE, flush_interval=DB_FLUSH_INTERVAL):
+        super(MemoryIndexStore, self).__init__(batch_size, flush_interval)
+        # qid -> {id: (tuple, indexLoc)}
+        self.rows = dict()
+        self.next_id = 1
+
+    def insert_rows(self, rows):
+        for qid, tuple, index in rows:
+            self.rows.setdefault(qid, dict())[self.next_id] = (tuple, index)
+            self.next_id += 1
+
+    def select_rows(self, qid):
+        return [(id, qid, tuple, index) for id, (tuple, index) in sorted(self.rows.get(qid, {}).items())]
+
+    def delete_rows(self, ids):
+        for qid_rows in self.rows.values():
+            for id in ids:
+                qid_rows.pop(id, None)
+
+
+def get_index_store(conf):
+    """
+    Returns the index store configured in the emitter conf with the optional keys:
+        - index_store: 'mysql' (default), 'sqlite' or 'memory'
+        - index_store_path: sqlite database file, defaults to an in-memory database
+        - db_batch_size, db_flush_interval: write-behind triggers
+    """
+    store_type = conf.get('index_store', 'mysql')
+    batch_size = conf.get('db_batch_size', DB_BATCH_SIZE)
+    flush_interval = conf.get('db_flush_interval', DB_FLUSH_INTERVAL)
+
+    if store_type == 'mysql':
+        return MySQLIndexStore(conf['db'], batch_size, flush_interval)
+    elif store_type == 'sqlite':
+        return SQLiteIndexStore(conf.get('index_store_path', ':memory:'), batch_size, flush_interval)
+    elif store_type == 'memory':
+        return MemoryIndexStore(batch_size, flush_interval)
+    else:
+        raise ValueError('unsupported index store: %s' % store_type)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import logging
+
+# bmv2 runtime service the registers are exposed on
+THRIFT_SERVICE = 'standard'
+CONTEXT_ID = 0
+
+
+class RegisterClient(object):
+    """
+    Keeps one Thrift session open with the bmv2 switch to read and reset whole register arrays,
+    instead of spawning runtime_CLI twice per register for every poll. The thrift and bm_runtime
+    modules come with bmv2 (bmv2/tools and the generated thrift bindings have to be in the PYTHONPATH).
+    """
+    def __init__(self, thrift_ip, thrift_port, cxt_id=CONTEXT_ID):
+        # fail here, when the emitter starts, rather than in its reader thread at the first poll
+        try:
+            import thrift
+            import bm_runtime
+        except ImportError as e:
+            raise ImportError('register_access thrift needs the thrift and bm_runtime modules of bmv2 (%s)' % e)
+
+        self.thrift_ip = thrift_ip
+        self.thrift_port = int(thrift_port)
+        self.cxt_id = cxt_id
+
+        self.transport = None
+        self.client = None
+
+        self.logger = logging.getLogger('RegisterClient')
+
+    def connect(self):
+        from thrift.transport import TSocket, TTransport
+        from thrift.protocol import TBinaryProtocol, TMultiplexedProtocol
+        from bm_runtime.standard import Standard
+
+        self.logger.info('connect to %s:%i' % (self.thrift_ip, self.thrift_port))
+        transport = TTransport.TBufferedTransport(TSocket.TSocket(self.thrift_ip, self.thrift_port))
+        protocol = TMultiplexedProtocol.TMultiplexedProtocol(TBinaryProtocol.TBinaryProtocol(transport),
+                                                             THRIFT_SERVICE)
+        self.client = Standard.Client(protocol)
+        transport.open()
+        self.transport = transport
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = None
+        self.client = None
+
+    def call(self, method, *args):
+        # (re)connect lazily, and once more if the switch dropped the session
+        from thrift.transport.TTransport import TTransportException
+        if self.client is None:
+            self.connect()
+        try:
+            return getattr(self.client, method)(self.cxt_id, *args)
+        except TTransportException:
+            self.logger.warning('lost the thrift session, reconnecting')
+            self.close()
+            self.connect()
+            return getattr(self.client, method)(self.cxt_id, *args)
+
+    def read(self, register, index):
+        return self.call('bm_register_read', register, index)
+
+    def read_all(self, register):
+        """
+        Returns the values of the whole register array, indexed by register index
+        """
+        return self.call('bm_register_read_all', register)
+
+    def write(self, register, index, value):
+        self.call('bm_register_write', register, index, value)
+
+    def reset(self, register):
+        self.call('bm_register_reset', register)
+
+    def read_and_reset(self, register, indexes):
+        """
+        Bulk read of the register array, then the given indexes with a non zero value are written back to 0, as the
+        runtime_CLI path of the emitter does. The reset is one write per index and not a reset of the array: the
+        index store buffers its inserts, so a key can already count in the register without being in the store yet,
+        and its index has to keep counting until the next poll reads it. Returns index -> value for the given
+        indexes with a non zero value.
+        """
+        values = self.read_all(register)
+        output = {}
+        for index in indexes:
+            if values[index] != 0:
+                output[index] = values[index]
+                self.write(register, index, 0)
+        return output
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+from multiprocessing import Process, Queue, Array, Value
+from Queue import Full
+from threading import Thread, Lock
+import logging
+import struct
+import time
+
+from scapy.all import sniff
+from emitter import Emitter
+from emitter_decoder import get_header_decoders
+from capture import get_capture
+
+WORKERS = 2
+DISPATCH_BATCH_SIZE = 256
+DISPATCH_INTERVAL = 0.05
+QUEUE_SIZE = 1024
+STATS_INTERVAL = 1
+
+QID_STRUCT = struct.Struct('>H')
+
+
+class LayerSharding(object):
+    """
+    Worker of each out header of a frame: the qid of the out header ('qid'), or a hash of the out header ('key').
+    The out headers of queries that read registers are always sharded on their qid, as a single worker has to
+    own the index store and the register polling of a query.
+    """
+    def __init__(self, queries, decoders, workers, shard_by):
+        self.decoders = decoders
+        self.workers = workers
+        # qid -> worker, round robin over the sorted qids
+        self.qid_to_worker = dict()
+        for ctr, qid in enumerate(sorted(self.decoders.keys())):
+            self.qid_to_worker[qid] = ctr % self.workers
+        # qids sharded on the hash of their out header
+        self.key_sharded_qids = set()
+        if shard_by == 'key':
+            for qid in self.decoders:
+                if not queries[qid]['reads_register']:
+                    self.key_sharded_qids.add(qid)
+
+    def get_qids(self, worker_id):
+        return [qid for qid in self.decoders if self.qid_to_worker[qid] == worker_id]
+
+    def get_layer_worker(self, frame, offset, qid):
+        if qid in self.key_sharded_qids:
+            return hash(frame[offset:offset + self.decoders[qid].size]) % self.workers
+        return self.qid_to_worker[qid]
+
+    def get_workers(self, frame):
+        """
+        Returns the workers of the out headers of the frame, each of them decodes its own out headers
+        """
+        workers = set()
+        offset = 0
+        qid = QID_STRUCT.unpack_from(frame, offset)[0]
+        while qid in self.decoders:
+            workers.add(self.get_layer_worker(frame, offset, qid))
+            offset = self.decoders[qid].get_updated_offset(offset)
+            qid = QID_STRUCT.unpack_from(frame, offset)[0]
+        return workers
+
+
+class EmitterWorker(Emitter):
+    """
+    Emitter running in a worker process: it decodes its out headers of the frames the dispatcher puts in
+    its queue and sends the tuples over its own connection to the stream processor.
+    """
+    def __init__(self, conf, queries, sharding, frame_queue, processed, epoch, worker_id):
+        self.frame_queue = frame_queue
+        self.processed = processed
+        self.shared_epoch = epoch
+        self.worker_id = worker_id
+        self.sharding = sharding
+        Emitter.__init__(self, conf, queries, sharding.get_qids(worker_id))
+        self.all_layers = sharding.workers == 1
+
+    def owns_layer(self, qid, p_str, offset):
+        return self.sharding.get_layer_worker(p_str, offset, qid) == self.worker_id
+
+    def get_epoch(self):
+        # set by the ShardedEmitter in the controller's process, -1 until the first flip
+        if self.shared_epoch.value < 0:
+            return None
+        return self.shared_epoch.value
+
+    def sniff_packets(self):
+        while True:
+            frames = self.frame_queue.get()
+            for frame in frames:
+                self.process_frame(frame)
+            self.processed[self.worker_id] += len(frames)
+
+
+def run_worker(conf, queries, sharding, frame_queue, processed, epoch, worker_id):
+    worker = EmitterWorker(conf, queries, sharding, frame_queue, processed, epoch, worker_id)
+    worker.start()
+
+
+class ShardedEmitter(object):
+    """
+    Captures the report packets in this process and fans them out to a pool of EmitterWorker processes.
+    Each out header of a frame is sharded as by LayerSharding, a frame goes to the workers of its out
+    headers. Worker i listens for the stream processor on spark_stream_port + i.
+    """
+    def __init__(self, conf, queries):
+        print "Sharded Emitter Started"
+        self.sniff_interface = conf['sniff_interface']
+        self.workers = conf.get('workers', WORKERS)
+        self.shard_by = conf.get('shard_by', 'qid')
+        self.batch_size = conf.get('dispatch_batch_size', DISPATCH_BATCH_SIZE)
+        self.dispatch_interval = conf.get('dispatch_interval', DISPATCH_INTERVAL)
+        self.stats_interval = conf.get('stats_interval', STATS_INTERVAL)
+
+        self.capture_type = conf.get('capture', 'scapy')
+        self.capture_file = conf.get('capture_file')
+        self.capture_realtime = conf.get('capture_realtime', False)
+
+        self.queries = queries
+        self.decoders = get_header_decoders(self.queries)
+        self.sharding = LayerSharding(self.queries, self.decoders, self.workers, self.shard_by)
+
+        self.queues = [Queue(conf.get('queue_size', QUEUE_SIZE)) for _ in range(self.workers)]
+        # frames not sent yet, shared by the capture and the flush thread
+        self.pending = [[] for _ in range(self.workers)]
+        self.pending_lock = Lock()
+        self.processed = Array('L', self.workers, lock=False)
+        self.epoch = Value('i', -1, lock=False)
+        self.drops = 0
+
+        self.processes = list()
+        for worker_id in range(self.workers):
+            worker_conf = dict(conf)
+            worker_conf['spark_stream_port'] = conf['spark_stream_port'] + worker_id
+            worker_conf['log_name'] = "emitter_%i.log" % worker_id
+            process = Process(name='emitter_%i' % worker_id, target=run_worker,
+                              args=(worker_conf, queries, self.sharding, self.queues[worker_id],
+                                    self.processed, self.epoch, worker_id))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+        # create a logger for the object
+        self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.INFO)
+        # create file handler which logs messages
+        self.fh = logging.FileHandler(conf['log_path'] + "emitter_stats.log")
+        self.fh.setLevel(logging.INFO)
+        self.logger.addHandler(self.fh)
+
+    def start(self):
+        stats_thread = Thread(name='emitter_stats', target=self.log_stats)
+        stats_thread.setDaemon(True)
+        stats_thread.start()
+
+        # the capture only dispatches when a frame arrives, the pending frames are also flushed on a timer
+        flush_thread = Thread(name='emitter_flush', target=self.flush_pending)
+        flush_thread.setDaemon(True)
+        flush_thread.start()
+
+        print "Now start sniffing the packets from switch"
+        capture = get_capture(self.capture_type, self.sniff_interface, self.capture_file, self.capture_realtime)
+        if capture is None:
+            sniff(iface=str(self.sniff_interface), prn=lambda x: self.dispatch_frame(str(x)))
+        else:
+            try:
+                for frames in capture.iter_batches():
+                    for frame in frames:
+                        # copy out of the capture buffer, the frame is handed to another process
+                        self.dispatch_frame(str(frame))
+                    self.flush()
+            finally:
+                capture.close()
+
+    def set_epoch(self, epoch):
+        self.epoch.value = epoch
+
+    def dispatch_frame(self, frame):
+        with self.pending_lock:
+            for worker_id in self.sharding.get_workers(frame):
+                pending = self.pending[worker_id]
+                pending.append(frame)
+                if len(pending) >= self.batch_size:
+                    self.send_batch(worker_id)
+
+    def send_batch(self, worker_id):
+        frames = self.pending[worker_id]
+        if frames:
+            try:
+                self.queues[worker_id].put_nowait(frames)
+            except Full:
+                # the worker fell behind, drop the batch rather than stalling the capture
+                self.drops += len(frames)
+            self.pending[worker_id] = []
+
+    def flush(self):
+        with self.pending_lock:
+            for worker_id in range(self.workers):
+                self.send_batch(worker_id)
+
+    def flush_pending(self):
+        while True:
+            time.sleep(self.dispatch_interval)
+            self.flush()
+
+    def get_stats(self):
+        return {'drops': self.drops,
+                'queue_depth': sum([queue.qsize() for queue in self.queues]),
+                'processed': sum(self.processed[:])}
+
+    def log_stats(self):
+        while True:
+            time.sleep(self.stats_interval)
+            stats = self.get_stats()
+            self.logger.info("emitter_stats,%.20f,%i,%i,%i" % (time.time(), stats['drops'], stats['queue_depth'],
+                                                                stats['processed']))
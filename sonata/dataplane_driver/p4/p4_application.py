@@ -7,26 +7,30 @@ from p4_primitives import NoOp, CloneIngressPktToEgress, AddHeader, ModifyField
 from p4_query import P4Query
 from p4_layer import P4Layer, OutHeaders, get_p4_layer#, P4RawFields, Ethernet
 from p4_field import P4Field
+from p4_operators import INDEX_SIZE, REGISTER_BANKS, REGISTER_INSTANCE_COUNT
 from sonata.dataplane_driver.utils import get_logger
 import logging
 
 import json
 
-with open('/home/vagrant/dev/sonata/config.json') as json_data_file:
-    data = json.load(json_data_file)
-    # print(data)
-
-config = data["on_server"][data["is_on_server"]]["sonata"]
+CONFIG_FILE = '/home/vagrant/dev/sonata/config.json'
 
 ORIGINAL_PACKET = False
 
-SENDER_PORT = config["SENDER_PORT"]
-RECIEVE_PORT = config["RECIEVE_PORT"]
-
 SESSION_ID = 8001
 SPAN_PORT = 12
 
 
+def get_repeat_ports(config_file=CONFIG_FILE):
+    """
+    Returns the SENDER_PORT and RECIEVE_PORT of the sonata config, read only when the original packets are repeated
+    """
+    with open(config_file) as json_data_file:
+        data = json.load(json_data_file)
+    config = data["on_server"][data["is_on_server"]]["sonata"]
+    return config["SENDER_PORT"], config["RECIEVE_PORT"]
+
+
 class P4Application(object):
     def __init__(self, app, sonata_fields):
         # LOGGING
@@ -46,6 +50,9 @@ class P4Application(object):
         self.drop_meta_field = 'drop'
         self.satisfied_meta_field = 'satisfied'
         self.clone_meta_field = 'clone'
+        # register bank of the current window, and the offset of its indexes in the reported index field
+        self.epoch_meta_field = 'epoch'
+        self.epoch_offset_meta_field = 'epoch_offset'
 
         self.mirror_session = None
         self.field_list = None
@@ -57,6 +64,9 @@ class P4Application(object):
         self.init_action = None
         self.init_action_table = None
 
+        self.epoch_actions = None
+        self.epoch_table = None
+
         self.report_action = None
         self.report_action_table = None
         self.nop_action = None
@@ -90,7 +100,8 @@ class P4Application(object):
             fields.append(('%s_%i' % (self.drop_meta_field, query_id), 1))
             fields.append(('%s_%i' % (self.satisfied_meta_field, query_id), 1))
         fields.append((self.clone_meta_field, 1))
-        self.metadata = MetaData('app_data', fields)
+        epoch_fields = [(self.epoch_meta_field, 1), (self.epoch_offset_meta_field, INDEX_SIZE)]
+        self.metadata = MetaData('app_data', fields + epoch_fields)
         meta_name = self.metadata.get_name()
 
         # action and table to init app metadata
@@ -101,6 +112,17 @@ class P4Application(object):
 
         self.init_action_table = Table('init_app_metadata', self.init_action.get_name(), [], None, 1)
 
+        # one action per epoch to set the epoch fields, the controller flips the epoch with the default action
+        self.epoch_actions = list()
+        for epoch in range(REGISTER_BANKS):
+            primitives = list()
+            primitives.append(ModifyField('%s.%s' % (meta_name, self.epoch_meta_field), epoch))
+            primitives.append(ModifyField('%s.%s' % (meta_name, self.epoch_offset_meta_field),
+                                          epoch * REGISTER_INSTANCE_COUNT))
+            self.epoch_actions.append(Action('do_set_epoch_%i' % epoch, primitives))
+        self.epoch_table = Table('set_epoch', self.epoch_actions[0].get_name(),
+                                 [action.get_name() for action in self.epoch_actions[1:]], None, 1)
+
         # transforms queries
         for query_id in app:
             self.logger.debug('create query pipeline for qid: %i' % (query_id))
@@ -120,7 +142,9 @@ class P4Application(object):
                             nop_name,
                             '%s.%s' % (meta_name, self.drop_meta_field),
                             '%s.%s' % (meta_name, self.satisfied_meta_field),
-                            '%s.%s' % (meta_name, self.clone_meta_field), self.p4_raw_fields)
+                            '%s.%s' % (meta_name, self.clone_meta_field),
+                            '%s.%s' % (meta_name, self.epoch_meta_field),
+                            '%s.%s' % (meta_name, self.epoch_offset_meta_field), self.p4_raw_fields)
             queries[query_id] = query
 
         # define mirroring session
@@ -221,6 +245,9 @@ class P4Application(object):
         out = ''
         out += self.init_action.get_code()
         out += self.init_action_table.get_code()
+        for action in self.epoch_actions:
+            out += action.get_code()
+        out += self.epoch_table.get_code()
         out += self.metadata.get_code()
         out += self.nop_action.get_code()
         out += self.field_list.get_code()
@@ -263,6 +290,7 @@ table forward {
         out = ''
         out += 'control ingress {\n'
         out += '\tapply(%s);\n' % self.init_action_table.get_name()
+        out += '\tapply(%s);\n' % self.epoch_table.get_name()
 
         # add the control flow of one query after the other
         for query in self.queries.values():
@@ -302,13 +330,15 @@ table forward {
         commands = list()
         for query in self.queries.values():
             commands += query.get_commands()
+        commands.append(self.epoch_table.get_default_command())
         commands.append(self.report_action_table.get_default_command())
         commands.append(self.final_header_table.get_default_command())
         commands.append(self.mirror_session.get_command())
         if ORIGINAL_PACKET:
+            sender_port, receive_port = get_repeat_ports()
             commands.append("table_set_default forward _drop")
-            commands.append("table_add forward repeat %s => %s" % (SENDER_PORT, RECIEVE_PORT))
-            commands.append("table_add forward repeat %s => %s" % (RECIEVE_PORT, SENDER_PORT))
+            commands.append("table_add forward repeat %s => %s" % (sender_port, receive_port))
+            commands.append("table_add forward repeat %s => %s" % (receive_port, sender_port))
 
         return commands
 
@@ -325,8 +355,18 @@ table forward {
             header_formats[qid] = query.get_header_format()
         return header_formats
 
+    def get_epoch_command(self, epoch):
+        return 'table_set_default %s %s' % (self.epoch_table.get_name(), self.epoch_actions[epoch].get_name())
+
+    def get_epoch_reset_commands(self, epoch):
+        commands = list()
+        for query in self.queries.values():
+            commands.extend(query.get_epoch_reset_commands(epoch))
+        return commands
+
     def get_update_commands(self, filter_update):
         commands = list()
-        for qid, filter_id in filter_update:
-            commands.extend(self.queries[qid].get_update_commands(filter_id, filter_update[(qid, filter_id)]))
+        # filter_update: (qid, filter_id) -> (keys to add, keys to remove)
+        for (qid, filter_id), (additions, removals) in filter_update.iteritems():
+            commands.extend(self.queries[qid].get_update_commands(filter_id, additions, removals))
         return commands
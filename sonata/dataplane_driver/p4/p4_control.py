@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+import logging
+import os
+import subprocess
+from threading import Thread, Condition, Lock
+
+CLI_PROMPT = 'RuntimeCmd: '
+ADDED_ENTRY = 'Entry has been added with handle'
+COMMAND_TIMEOUT = 10
+
+
+def parse_table_add(command):
+    """
+    'table_add <table> <action> <match fields> => <action params>' -> (table, action, match, params)
+    """
+    tokens = command.split()
+    table, action = tokens[1], tokens[2]
+    if '=>' in tokens:
+        sep = tokens.index('=>')
+        return table, action, tuple(tokens[3:sep]), tuple(tokens[sep + 1:])
+    return table, action, tuple(tokens[3:]), ()
+
+
+class P4ControlSession(object):
+    """
+    Long-lived sswitch_CLI process to which batches of commands are piped, instead of spawning a new
+    CLI for every update. It keeps a shadow copy of the entries installed through it, so that
+    table_add commands for entries that are already installed are skipped, and table_delete commands
+    can be given with the match fields of the entry instead of its handle.
+    """
+    def __init__(self, cli_path, p4_json_path, thrift_port):
+        self.cli_path = cli_path
+        self.p4_json_path = p4_json_path
+        self.thrift_port = thrift_port
+
+        self.process = None
+        self.reader_thread = None
+
+        # outputs of the commands the CLI completed so far
+        self.outputs = []
+        self.completed = 0
+        self.output_ready = Condition()
+        self.send_lock = Lock()
+
+        # table -> match -> (action, params, handle)
+        self.entries = dict()
+
+        self.logger = logging.getLogger('P4ControlSession')
+
+    def start(self):
+        self.logger.info('start control session')
+        env = dict(os.environ)
+        env['PYTHONUNBUFFERED'] = '1'
+        self.process = subprocess.Popen([self.cli_path, self.p4_json_path, str(self.thrift_port)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, env=env)
+        self.outputs = []
+        self.completed = 0
+        self.reader_thread = Thread(name='control_session_reader', target=self.read_output)
+        self.reader_thread.setDaemon(True)
+        self.reader_thread.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_output(self):
+        # the CLI prints its prompt before reading each command, so the text between two prompts is
+        # the output of one command, the text before the first prompt is the CLI banner
+        buf = ''
+        seen_prompt = False
+        fd = self.process.stdout.fileno()
+        while True:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            buf += data
+            while CLI_PROMPT in buf:
+                segment, buf = buf.split(CLI_PROMPT, 1)
+                with self.output_ready:
+                    if seen_prompt:
+                        self.outputs.append(segment)
+                        self.completed += 1
+                        self.output_ready.notify_all()
+                    seen_prompt = True
+        with self.output_ready:
+            self.output_ready.notify_all()
+
+    def send(self, commands):
+        """
+        Pipes the commands in one batch and returns their outputs once the CLI processed all of them
+        """
+        # empty lines make the CLI repeat the previous command
+        commands = [cmd.strip() for cmd in commands if cmd.strip()]
+        if not commands:
+            return []
+
+        with self.send_lock:
+            if not self.is_running():
+                self.start()
+            with self.output_ready:
+                expected = self.completed + len(commands)
+            self.process.stdin.write("\n".join(commands) + "\n")
+            self.process.stdin.flush()
+
+            with self.output_ready:
+                while self.completed < expected and self.is_running():
+                    self.output_ready.wait(COMMAND_TIMEOUT)
+                outputs = self.outputs[-len(commands):]
+                self.outputs = []
+                if self.completed < expected:
+                    self.logger.error('control session ended with %i commands pending' % (expected - self.completed))
+        return outputs
+
+    def get_delta(self, commands):
+        """
+        Minimal diff between the shadow copy and the commands: table_add of installed entries are
+        dropped, table_add of entries installed with a different action are preceded by a delete,
+        and table_delete by match fields are resolved to their handles.
+        """
+        delta = list()
+        added = list()
+        pending = set()
+        for command in commands:
+            command = command.strip()
+            if command.startswith('table_add'):
+                table, action, match, params = parse_table_add(command)
+                if (table, match) in pending:
+                    continue
+                pending.add((table, match))
+                installed = self.entries.get(table, {}).get(match)
+                if installed is not None:
+                    if installed[0:2] == (action, params):
+                        continue
+                    delta.append('table_delete %s %i' % (table, installed[2]))
+                    self.entries[table].pop(match)
+                delta.append(command)
+                added.append((table, action, match, params))
+            elif command.startswith('table_delete'):
+                tokens = command.split()
+                table = tokens[1]
+                if len(tokens) == 3 and tokens[2].isdigit():
+                    handle = int(tokens[2])
+                    for match, (_, _, installed_handle) in self.entries.get(table, {}).items():
+                        if installed_handle == handle:
+                            self.entries[table].pop(match)
+                    delta.append(command)
+                else:
+                    installed = self.entries.get(table, {}).pop(tuple(tokens[2:]), None)
+                    if installed is not None:
+                        delta.append('table_delete %s %i' % (table, installed[2]))
+            elif command:
+                delta.append(command)
+        return delta, added
+
+    def apply(self, commands):
+        """
+        Sends the minimal diff for the commands and updates the shadow copy with the new handles
+        """
+        delta, added = self.get_delta(commands)
+        outputs = self.send(delta)
+
+        # the outputs of the table_add commands come in the order of the added entries
+        add_outputs = [out for cmd, out in zip(delta, outputs) if cmd.startswith('table_add')]
+        for (table, action, match, params), out in zip(added, add_outputs):
+            if ADDED_ENTRY in out:
+                handle = int(out.split(ADDED_ENTRY)[1].split()[0])
+                self.entries.setdefault(table, dict())[match] = (action, params, handle)
+            else:
+                self.logger.error('failed to add entry %s to %s: %s' % (str(match), table, out.strip()))
+        return delta
+
+    def get_installed_entries(self, table):
+        return self.entries.get(table, {}).keys()
+
+    def reset(self):
+        # reset_state flushes all tables and registers, so the shadow copy starts over as well
+        self.send(['reset_state'])
+        self.entries = dict()
@@ -6,6 +6,7 @@ from time import sleep
 import subprocess
 
 from interfaces import Interfaces
+from p4_control import P4ControlSession
 from sonata.dataplane_driver.utils import get_out, get_in
 import threading,os
 
@@ -36,6 +37,7 @@ class P4DataPlane(object):
         self.thrift_port = thrift_port
         self.bm_script = bm_script
         self.internal_interfaces = internal_interfaces
+        self.control_session = None
         # LOGGING
         log_level = logging.WARNING
         # add handler
@@ -62,7 +64,11 @@ class P4DataPlane(object):
         print "\nWaiting for switch to start..."
         sleep(2)
         print "Sending commands..."
-        self.send_commands(p4_json_path, p4_commands_path)
+        # keep one CLI session open for the initial commands and all later delta updates
+        self.control_session = P4ControlSession(self.cli_path, p4_json_path, self.thrift_port)
+        self.control_session.start()
+        with open(p4_commands_path, "r") as f:
+            self.control_session.apply(f.read().split("\n"))
 
         sleep(1)
 
@@ -74,6 +80,9 @@ class P4DataPlane(object):
 
     def reset_switch_state(self):
         self.logger.info('reset switch state')
+        if self.control_session is not None:
+            self.control_session.reset()
+            return
         cmd = "echo \'reset_state\' | " + self.cli_path + " --thrift-port "+str(self.thrift_port)
         get_out(cmd)
 
@@ -90,10 +99,13 @@ class P4DataPlane(object):
 
     def send_delta_commands(self, p4_json_path, commands):
         self.logger.info('send delta commands')
-        cmd = [self.cli_path, p4_json_path, str(self.thrift_port)]
-        get_in(cmd, commands)
+        if self.control_session is None:
+            self.control_session = P4ControlSession(self.cli_path, p4_json_path, self.thrift_port)
+        # only the entries that are not installed yet are sent, in one batch
+        return self.control_session.apply(commands)
 
     def compile_p4(self, p4_compiled, json_p4_compiled):
         self.logger.info('compile p4 to json')
         CMD = self.bm_script + " " + p4_compiled + " --json " + json_p4_compiled
-        get_out(CMD)
\ No newline at end of file
+        success, _ = get_out(CMD)
+        return success
\ No newline at end of file
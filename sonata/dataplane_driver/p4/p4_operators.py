@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 # Author: Ruediger Birkner (Networked Systems Group at ETH Zurich)
 
+import math
 
 from p4_elements import Register, HashFields, Table, MetaData, Action
 from p4_field import P4Field
 from p4_primitives import BitAnd, ModifyField, ModifyFieldWithHashBasedOffset, RegisterRead, RegisterWrite, BitOr
+from sonata.core.training.hypothesis.costs.dp_cost import get_bloom_filter_fpr
 from sonata.dataplane_driver.utils import get_logger
 
 REGISTER_WIDTH = 32
@@ -13,14 +15,90 @@ REGISTER_INSTANCE_COUNT = 2 ** REGISTER_NUM_INDEX_BITS
 TABLE_SIZE = 64
 THRESHOLD = 5
 
+# registers of Reduce and Distinct are double-buffered, the epoch field of the app metadata selects the bank packets
+# update, so the controller starts a window by flipping it and resets the bank of the previous window in the background
+REGISTER_BANKS = 2
+
 # TODO: figure out a cleaner way of getting rid of these magical numbers
 HEADER_MASK_SIZE = {'ipv4.srcIP': 8, 'ipv4.dstIP': 8, 'udp.sport': 4, 'udp.dport': 4,
                     'ipv4.totalLen': 4, 'ipv4.proto': 4, 'ethernet.srcMac': 12, 'ethernet.dstMac': 12,
-                    'qid': 4, 'count': 4, 'index': 4}
+                    'qid': 4, 'count': 4, 'index': 8}
 
 QID_SIZE = 16
 COUNT_SIZE = 16
-INDEX_SIZE = 16
+INDEX_SIZE = 32
+OVERFLOW_SIZE = 8
+FINGERPRINT_SIZE = 32
+
+
+# the rows of the count-min sketch, the hashes of the Bloom filter and the stages and fingerprint of the HashPipe hash
+# the keys with CRC-32s of different polynomials (crc32_custom). A CRC is affine in its input, so with one polynomial
+# and a seed per row the rows would differ by a constant and share all their collisions
+CRC32_POLYNOMIALS = [0x04c11db7, 0x1edc6f41, 0xa833982b, 0x741b8cd7, 0x814141ab, 0x32583499, 0x000000af, 0xf4acfb13]
+CRC32_INITIAL = 0xffffffff
+CRC32_FINAL_XOR = 0xffffffff
+
+
+def get_crc32_polynomial(row):
+    if row >= len(CRC32_POLYNOMIALS):
+        raise ValueError('at most %i independent hashes are supported, got hash %i' % (len(CRC32_POLYNOMIALS), row))
+    return CRC32_POLYNOMIALS[row]
+
+
+def get_crc32_parameters_command(calculation, row):
+    """
+    Returns the runtime command that sets the parameters of a crc32_custom calculation to the polynomial of the row
+    """
+    return 'set_crc32_parameters %s 0x%08x 0x%08x 0x%08x true true' % (calculation.get_name(),
+                                                                       get_crc32_polynomial(row), CRC32_INITIAL,
+                                                                       CRC32_FINAL_XOR)
+
+
+def get_epoch_control_flow(indent, epoch_field, tables):
+    """
+    Applies the table of the current epoch, tables has one table per register bank
+    """
+    if len(tables) == 1:
+        return '%sapply(%s);\n' % (indent, tables[0].get_name())
+    out = ''
+    for epoch, table in enumerate(tables):
+        if epoch == 0:
+            out += '%sif (%s == %i) {\n' % (indent, epoch_field, epoch)
+        elif epoch < len(tables) - 1:
+            out += '%selse if (%s == %i) {\n' % (indent, epoch_field, epoch)
+        else:
+            out += '%selse {\n' % (indent,)
+        out += '%s\tapply(%s);\n' % (indent, table.get_name())
+        out += '%s}\n' % (indent,)
+    return out
+
+
+def get_key_fields(keys, p4_raw_fields, logger):
+    """
+    Returns the P4Fields of the keys, in the metadata of the MapInit operator
+    """
+    key_fields = list()
+    for fld in keys:
+        if fld == 'qid':
+            field = P4Field(layer=None, target_name="qid", sonata_name="qid", size=QID_SIZE)
+        elif fld == 'count':
+            field = P4Field(layer=None, target_name="count", sonata_name="count", size=COUNT_SIZE)
+        elif fld == 'index':
+            field = P4Field(layer=None, target_name="index", sonata_name="index", size=INDEX_SIZE)
+        else:
+            field = p4_raw_fields.get_target_field(fld)
+        if '/' in field.sonata_name:
+            logger.error('found a / in the key')
+            raise NotImplementedError
+        key_fields.append(field)
+    return key_fields
+
+
+def get_hash_fields(key_fields, meta_init_name):
+    """
+    Returns the names of the metadata fields of the keys, to be hashed into a register index
+    """
+    return ['%s.%s' % (meta_init_name, field.target_name.replace(".", "_")) for field in key_fields]
 
 
 class P4Operator(object):
@@ -41,7 +119,7 @@ class P4Operator(object):
 
     def create_operator_specific_fields(self):
         for key in self.keys:
-            if key not in ['qid', 'count', 'index']: self.operator_specific_fields[
+            if key not in ['qid', 'count', 'index', 'overflow']: self.operator_specific_fields[
                 key] = self.p4_raw_fields.get_target_field(key)
 
     def get_out_headers(self):
@@ -61,7 +139,7 @@ class P4Operator(object):
 
 
 class P4Distinct(P4Operator):
-    def __init__(self, qid, operator_id, meta_init_name, drop_action, nop_action, keys, p4_raw_fields):
+    def __init__(self, qid, operator_id, meta_init_name, drop_action, nop_action, keys, epoch_field, p4_raw_fields):
         super(P4Distinct, self).__init__('Distinct', qid, operator_id, keys, p4_raw_fields)
 
         self.threshold = 0
@@ -72,8 +150,10 @@ class P4Distinct(P4Operator):
         fields = [('value', REGISTER_WIDTH), ('index', REGISTER_NUM_INDEX_BITS)]
         self.metadata = MetaData(self.operator_name, fields)
 
-        # create REGISTER to keep track of counts
-        self.register = Register(self.operator_name, REGISTER_WIDTH, REGISTER_INSTANCE_COUNT)
+        # create one REGISTER per epoch to keep track of the keys
+        self.epoch_field = epoch_field
+        self.registers = [Register('%s_%i' % (self.operator_name, epoch), REGISTER_WIDTH, REGISTER_INSTANCE_COUNT)
+                          for epoch in range(REGISTER_BANKS)]
 
         # Add map init
         hash_init_fields = list()
@@ -101,25 +181,28 @@ class P4Distinct(P4Operator):
         # name of metadata field where the count is kept temporarily
         self.value_field_name = '%s.value' % self.metadata.get_name()
 
-        # create ACTION and TABLE to compute hash and get value
-        primitives1 = list()
-        primitives1.append(ModifyFieldWithHashBasedOffset(self.index_field_name, 0, self.hash.get_name(),
-                                                          REGISTER_INSTANCE_COUNT))
-        primitives1.append(RegisterRead(self.value_field_name, self.register.get_name(), self.index_field_name))
-
-        self.action1 = Action('do_init_%s' % self.operator_name, primitives1)
-
-        # create ACTION and TABLE to bit_or value & write back
-        primitives2 = list()
-        primitives2.append(BitOr(self.value_field_name, self.value_field_name, 1))
-        primitives2.append(RegisterWrite(self.register.get_name(), self.index_field_name, self.value_field_name))
-        self.action2 = Action('do_update_%s' % self.operator_name, primitives2)
-
-        table_name = 'init_%s' % self.operator_name
-        self.init_table = Table(table_name, self.action1.get_name(), [], None, 1)
-
-        table_name = 'update_%s' % self.operator_name
-        self.update_table = Table(table_name, self.action2.get_name(), [], None, 1)
+        # create ACTIONs and TABLEs to compute hash and get value, and to bit_or value & write back, for each epoch
+        self.init_actions = list()
+        self.update_actions = list()
+        self.init_tables = list()
+        self.update_tables = list()
+        for epoch, register in enumerate(self.registers):
+            primitives1 = list()
+            primitives1.append(ModifyFieldWithHashBasedOffset(self.index_field_name, 0, self.hash.get_name(),
+                                                              REGISTER_INSTANCE_COUNT))
+            primitives1.append(RegisterRead(self.value_field_name, register.get_name(), self.index_field_name))
+            action1 = Action('do_init_%s_%i' % (self.operator_name, epoch), primitives1)
+
+            primitives2 = list()
+            primitives2.append(BitOr(self.value_field_name, self.value_field_name, 1))
+            primitives2.append(RegisterWrite(register.get_name(), self.index_field_name, self.value_field_name))
+            action2 = Action('do_update_%s_%i' % (self.operator_name, epoch), primitives2)
+
+            self.init_actions.append(action1)
+            self.update_actions.append(action2)
+            self.init_tables.append(Table('init_%s_%i' % (self.operator_name, epoch), action1.get_name(), [], None, 1))
+            self.update_tables.append(Table('update_%s_%i' % (self.operator_name, epoch), action2.get_name(), [], None,
+                                            1))
 
         # create two TABLEs that implement reduce operation: if count <= THRESHOLD, update count and drop, else let it
         # pass through
@@ -136,11 +219,14 @@ class P4Distinct(P4Operator):
         out += '// %s %i of query %i\n' % (self.name, self.operator_id, self.query_id)
         out += self.metadata.get_code()
         out += self.hash.get_code()
-        out += self.register.get_code()
-        out += self.action1.get_code()
-        out += self.action2.get_code()
-        out += self.update_table.get_code()
-        out += self.init_table.get_code()
+        for register in self.registers:
+            out += register.get_code()
+        for action1, action2 in zip(self.init_actions, self.update_actions):
+            out += action1.get_code()
+            out += action2.get_code()
+        for init_table, update_table in zip(self.init_tables, self.update_tables):
+            out += update_table.get_code()
+            out += init_table.get_code()
         out += self.pass_table.get_code()
         out += self.drop_table.get_code()
         out += '\n'
@@ -148,8 +234,9 @@ class P4Distinct(P4Operator):
 
     def get_commands(self):
         commands = list()
-        commands.append(self.init_table.get_default_command())
-        commands.append(self.update_table.get_default_command())
+        for init_table, update_table in zip(self.init_tables, self.update_tables):
+            commands.append(init_table.get_default_command())
+            commands.append(update_table.get_default_command())
         commands.append(self.pass_table.get_default_command())
         commands.append(self.drop_table.get_default_command())
         return commands
@@ -157,10 +244,132 @@ class P4Distinct(P4Operator):
     def get_control_flow(self, indent_level):
         indent = '\t' * indent_level
         out = ''
-        out += '%sapply(%s);\n' % (indent, self.init_table.get_name())
+        out += get_epoch_control_flow(indent, self.epoch_field, self.init_tables)
         out += '%sif (%s %s %i) {\n' % (indent, self.value_field_name, self.comp_func, self.threshold)
         out += '%s\tapply(%s);\n' % (indent, self.pass_table.get_name())
-        out += '%s\tapply(%s);\n' % (indent, self.update_table.get_name())
+        out += get_epoch_control_flow(indent + '\t', self.epoch_field, self.update_tables)
+        out += '%s}\n' % (indent,)
+        out += '%selse {\n' % (indent,)
+        out += '%s\tapply(%s);\n' % (indent, self.drop_table.get_name())
+        out += '%s}\n' % (indent,)
+        return out
+
+    def get_init_keys(self):
+        return self.keys
+
+
+class P4BloomDistinct(P4Operator):
+    """
+    Distinct over a Bloom filter: n_hashes registers of one bit wide cells, each indexed by its own hash of
+    the keys. A packet passes if any of its bits was unset, i.e. if its keys were not seen before (up to the
+    false positive rate of the filter), and sets all its bits. There is one filter per epoch, as for P4Distinct.
+    """
+    def __init__(self, qid, operator_id, meta_init_name, drop_action, nop_action, keys, n_bits, n_hashes,
+                 cardinality, epoch_field, p4_raw_fields):
+        super(P4BloomDistinct, self).__init__('BloomDistinct', qid, operator_id, keys, p4_raw_fields)
+
+        if n_hashes > len(CRC32_POLYNOMIALS):
+            raise ValueError('a Bloom filter has at most %i hashes, got %i' % (len(CRC32_POLYNOMIALS), n_hashes))
+        self.n_hashes = n_hashes
+        # each hash indexes its own partition of the bits
+        self.width = 2 ** int(math.floor(math.log(max(int(n_bits) // n_hashes, 2), 2)))
+        self.n_bits = self.width * self.n_hashes
+        self.index_bits = int(math.log(self.width, 2))
+
+        # estimated false positive rate once the filter holds the distinct keys of a training window
+        if cardinality <= 0:
+            raise ValueError('a Bloom filter needs the number of distinct keys per window, got %s' % cardinality)
+        self.cardinality = cardinality
+        self.fpr = self.get_fpr(cardinality)
+        self.logger.info('%s: %i bits, %i hashes, false positive rate %f for %i keys' %
+                         (self.operator_name, self.n_bits, self.n_hashes, self.fpr, cardinality))
+
+        # the fields of each hash: its index and the bit it read
+        fields = [('value', 1)]
+        for row in range(self.n_hashes):
+            fields += [('index_%i' % row, self.index_bits), ('bit_%i' % row, 1)]
+        self.metadata = MetaData(self.operator_name, fields)
+
+        # name of metadata field set to 1 if all the bits were set
+        self.value_field_name = '%s.value' % self.metadata.get_name()
+
+        # create one HASH per partition, and for each epoch one REGISTER per partition
+        self.key_fields = get_key_fields(self.keys, self.p4_raw_fields, self.logger)
+        hash_fields = get_hash_fields(self.key_fields, meta_init_name)
+        self.hashes = [HashFields('%s_%i' % (self.operator_name, row), hash_fields, 'crc32_custom', self.index_bits)
+                       for row in range(self.n_hashes)]
+        self.epoch_field = epoch_field
+        self.registers = [[Register('%s_%i_%i' % (self.operator_name, epoch, row), 1, self.width)
+                           for row in range(self.n_hashes)] for epoch in range(REGISTER_BANKS)]
+
+        # create ACTIONs and TABLEs to read and set the bits, for each epoch
+        self.init_actions = list()
+        self.init_tables = list()
+        for epoch, registers in enumerate(self.registers):
+            primitives = list()
+            for row, (row_hash, register) in enumerate(zip(self.hashes, registers)):
+                index_field_name = '%s.index_%i' % (self.metadata.get_name(), row)
+                bit_field_name = '%s.bit_%i' % (self.metadata.get_name(), row)
+                primitives.append(ModifyFieldWithHashBasedOffset(index_field_name, 0, row_hash.get_name(),
+                                                                 self.width))
+                primitives.append(RegisterRead(bit_field_name, register.get_name(), index_field_name))
+                primitives.append(RegisterWrite(register.get_name(), index_field_name, 1))
+                if row == 0:
+                    primitives.append(ModifyField(self.value_field_name, bit_field_name))
+                else:
+                    primitives.append(BitAnd(self.value_field_name, self.value_field_name, bit_field_name))
+            action = Action('do_init_%s_%i' % (self.operator_name, epoch), primitives)
+            self.init_actions.append(action)
+            self.init_tables.append(Table('init_%s_%i' % (self.operator_name, epoch), action.get_name(), [], None, 1))
+
+        # create two TABLEs: if any bit was unset let it pass through, else drop it
+        table_name = 'pass_%s' % self.operator_name
+        self.pass_table = Table(table_name, nop_action, [], None, 1)
+        table_name = 'drop_%s' % self.operator_name
+        self.drop_table = Table(table_name, drop_action, [], None, 1)
+
+    def __repr__(self):
+        return '.BloomDistinct(keys=' + ', '.join([x for x in self.keys]) + ', bits=' + str(self.n_bits) + \
+               ', hashes=' + str(self.n_hashes) + ')'
+
+    def get_fpr(self, cardinality):
+        return float(get_bloom_filter_fpr(cardinality, self.n_bits, self.n_hashes))
+
+    def get_code(self):
+        out = ''
+        out += '// %s %i of query %i, false positive rate %f for %i keys\n' % (self.name, self.operator_id,
+                                                                              self.query_id, self.fpr,
+                                                                              self.cardinality)
+        out += self.metadata.get_code()
+        for row_hash in self.hashes:
+            out += row_hash.get_code()
+        for registers in self.registers:
+            for register in registers:
+                out += register.get_code()
+        for action, table in zip(self.init_actions, self.init_tables):
+            out += action.get_code()
+            out += table.get_code()
+        out += self.pass_table.get_code()
+        out += self.drop_table.get_code()
+        out += '\n'
+        return out
+
+    def get_commands(self):
+        commands = list()
+        for row, row_hash in enumerate(self.hashes):
+            commands.append(get_crc32_parameters_command(row_hash, row))
+        for table in self.init_tables:
+            commands.append(table.get_default_command())
+        commands.append(self.pass_table.get_default_command())
+        commands.append(self.drop_table.get_default_command())
+        return commands
+
+    def get_control_flow(self, indent_level):
+        indent = '\t' * indent_level
+        out = ''
+        out += get_epoch_control_flow(indent, self.epoch_field, self.init_tables)
+        out += '%sif (%s == 0) {\n' % (indent, self.value_field_name)
+        out += '%s\tapply(%s);\n' % (indent, self.pass_table.get_name())
         out += '%s}\n' % (indent,)
         out += '%selse {\n' % (indent,)
         out += '%s\tapply(%s);\n' % (indent, self.drop_table.get_name())
@@ -172,7 +381,8 @@ class P4Distinct(P4Operator):
 
 
 class P4Reduce(P4Operator):
-    def __init__(self, qid, operator_id, meta_init_name, drop_action, keys, values, threshold, read_register, p4_raw_fields):
+    def __init__(self, qid, operator_id, meta_init_name, drop_action, keys, values, threshold, read_register,
+                 epoch_field, epoch_offset_field, p4_raw_fields):
         super(P4Reduce, self).__init__('Reduce', qid, operator_id, keys, p4_raw_fields)
 
         if threshold == '-1':
@@ -191,33 +401,16 @@ class P4Reduce(P4Operator):
         fields = [('value', REGISTER_WIDTH), ('index', REGISTER_NUM_INDEX_BITS)]
         self.metadata = MetaData(self.operator_name, fields)
 
-        # create REGISTER to keep track of counts
-        self.register = Register(self.operator_name, REGISTER_WIDTH, REGISTER_INSTANCE_COUNT)
+        # create one REGISTER per epoch to keep track of counts
+        self.epoch_field = epoch_field
+        self.registers = [Register('%s_%i' % (self.operator_name, epoch), REGISTER_WIDTH, REGISTER_INSTANCE_COUNT)
+                          for epoch in range(REGISTER_BANKS)]
 
         self.values = values
 
-        # Add map init
-        hash_init_fields = list()
-        for fld in self.keys:
-            if fld == 'qid':
-                hash_init_fields.append(P4Field(layer=None, target_name="qid", sonata_name="qid",
-                                                size=QID_SIZE))
-            elif fld == 'count':
-                hash_init_fields.append(P4Field(layer=None, target_name="count", sonata_name="count",
-                                                size=COUNT_SIZE))
-            elif fld == 'index':
-                hash_init_fields.append(P4Field(layer=None, target_name="index", sonata_name="index",
-                                                size=INDEX_SIZE))
-            else:
-                hash_init_fields.append(self.p4_raw_fields.get_target_field(fld))
         # create HASH for access to register
-        hash_fields = list()
-        for field in hash_init_fields:
-            if '/' in field.sonata_name:
-                self.logger.error('found a / in the key')
-                raise NotImplementedError
-            else:
-                hash_fields.append('%s.%s' % (meta_init_name, field.target_name.replace(".", "_")))
+        self.key_fields = get_key_fields(self.keys, self.p4_raw_fields, self.logger)
+        hash_fields = get_hash_fields(self.key_fields, meta_init_name)
         self.hash = HashFields(self.operator_name, hash_fields, 'crc16', REGISTER_NUM_INDEX_BITS)
 
         # name of metadata field where the index of the count within the register is stored
@@ -225,24 +418,27 @@ class P4Reduce(P4Operator):
         # name of metadata field where the count is kept temporarily
         self.value_field_name = '%s.value' % self.metadata.get_name()
 
-        # create ACTION and TABLE to compute hash and get value
-        primitives = list()
-        primitives.append(ModifyFieldWithHashBasedOffset(self.index_field_name, 0, self.hash.get_name(),
-                                                         REGISTER_INSTANCE_COUNT))
-        primitives.append(RegisterRead(self.value_field_name, self.register.get_name(), self.index_field_name))
-
         if self.values[0] == 'count':
             self.threshold = '1'
-            primitives.append(ModifyField(self.value_field_name, '%s + %i' % (self.value_field_name, 1)))
+            increment = 1
         else:
             target_fld = self.p4_raw_fields.get_target_field(self.values[0])
             self.threshold = '%s.%s' % (meta_init_name, target_fld.target_name.replace(".", "_"))
-            primitives.append(ModifyField(self.value_field_name, '%s + %s' % (self.value_field_name, '%s.%s' % (meta_init_name, target_fld.target_name.replace(".", "_")))))
-
-        primitives.append(RegisterWrite(self.register.get_name(), self.index_field_name, self.value_field_name))
-        self.init_action = Action('do_init_%s' % self.operator_name, primitives)
-        table_name = 'init_%s' % self.operator_name
-        self.init_table = Table(table_name, self.init_action.get_name(), [], None, 1)
+            increment = self.threshold
+
+        # create ACTION and TABLE to compute hash and get value, for each epoch
+        self.init_actions = list()
+        self.init_tables = list()
+        for epoch, register in enumerate(self.registers):
+            primitives = list()
+            primitives.append(ModifyFieldWithHashBasedOffset(self.index_field_name, 0, self.hash.get_name(),
+                                                             REGISTER_INSTANCE_COUNT))
+            primitives.append(RegisterRead(self.value_field_name, register.get_name(), self.index_field_name))
+            primitives.append(ModifyField(self.value_field_name, '%s + %s' % (self.value_field_name, increment)))
+            primitives.append(RegisterWrite(register.get_name(), self.index_field_name, self.value_field_name))
+            action = Action('do_init_%s_%i' % (self.operator_name, epoch), primitives)
+            self.init_actions.append(action)
+            self.init_tables.append(Table('init_%s_%i' % (self.operator_name, epoch), action.get_name(), [], None, 1))
 
         # create three TABLEs that implement reduce operation
         # if count <= THRESHOLD, update count and drop,
@@ -254,7 +450,9 @@ class P4Reduce(P4Operator):
         if not self.read_register:
             field_to_modified = ModifyField('%s.count' % meta_init_name, self.value_field_name)
         else:
-            field_to_modified = ModifyField('%s.index' % meta_init_name, self.index_field_name)
+            # the index is reported with the offset of the epoch, the emitter reads it from that register
+            field_to_modified = ModifyField('%s.index' % meta_init_name,
+                                            '%s + %s' % (self.index_field_name, epoch_offset_field))
 
         self.set_count_action = Action('set_count_%s' % self.operator_name,
                                        field_to_modified)
@@ -276,14 +474,17 @@ class P4Reduce(P4Operator):
         out += '// %s %i of query %i\n' % (self.name, self.operator_id, self.query_id)
         out += self.metadata.get_code()
         out += self.hash.get_code()
-        out += self.register.get_code()
-        out += self.init_action.get_code()
+        for register in self.registers:
+            out += register.get_code()
+        for action in self.init_actions:
+            out += action.get_code()
         out += self.set_count_action.get_code()
         if not self.read_register:
             out += self.reset_count_action.get_code()
             out += self.pass_table.get_code()
 
-        out += self.init_table.get_code()
+        for table in self.init_tables:
+            out += table.get_code()
         out += self.first_pass_table.get_code()
         out += self.drop_table.get_code()
         out += '\n'
@@ -291,7 +492,8 @@ class P4Reduce(P4Operator):
 
     def get_commands(self):
         commands = list()
-        commands.append(self.init_table.get_default_command())
+        for table in self.init_tables:
+            commands.append(table.get_default_command())
         commands.append(self.first_pass_table.get_default_command())
         if not self.read_register: commands.append(self.pass_table.get_default_command())
         commands.append(self.drop_table.get_default_command())
@@ -300,7 +502,7 @@ class P4Reduce(P4Operator):
     def get_control_flow(self, indent_level):
         indent = '\t' * indent_level
         out = ''
-        out += '%sapply(%s);\n' % (indent, self.init_table.get_name())
+        out += get_epoch_control_flow(indent, self.epoch_field, self.init_tables)
         out += '%sif (%s == %s) {\n' % (indent, self.value_field_name, self.threshold)
         out += '%s\tapply(%s);\n' % (indent, self.first_pass_table.get_name())
         out += '%s}\n' % (indent,)
@@ -319,6 +521,379 @@ class P4Reduce(P4Operator):
         return self.keys + ['count']
 
 
+class P4CMSReduce(P4Operator):
+    """
+    Reduce over a count-min sketch: d rows of w registers, each row indexed by its own hash of the keys. The
+    count of a key is the minimum of its d counters, which is then checked against the threshold as in P4Reduce.
+    There is one sketch per epoch, as for P4Reduce.
+    """
+    def __init__(self, qid, operator_id, meta_init_name, drop_action, keys, values, threshold, depth, width,
+                 epoch_field, p4_raw_fields):
+        super(P4CMSReduce, self).__init__('CMSReduce', qid, operator_id, keys, p4_raw_fields)
+
+        if threshold == '-1':
+            self.threshold = int(THRESHOLD)
+        else:
+            self.threshold = int(threshold)
+
+        self.out_headers += ['count']
+        self.values = values
+        if depth > len(CRC32_POLYNOMIALS):
+            raise ValueError('a count-min sketch has at most %i rows, got %i' % (len(CRC32_POLYNOMIALS), depth))
+        self.depth = depth
+        self.width = width
+        self.index_bits = max(1, int(math.log(width, 2)))
+
+        # the fields of each row: its index and counter
+        fields = [('value', REGISTER_WIDTH)]
+        for row in range(self.depth):
+            fields += [('index_%i' % row, self.index_bits), ('value_%i' % row, REGISTER_WIDTH)]
+        self.metadata = MetaData(self.operator_name, fields)
+
+        # name of metadata field where the minimum of the rows is kept
+        self.value_field_name = '%s.value' % self.metadata.get_name()
+
+        if self.values[0] == 'count':
+            self.threshold = '1'
+            increment = 1
+        else:
+            target_fld = self.p4_raw_fields.get_target_field(self.values[0])
+            self.threshold = '%s.%s' % (meta_init_name, target_fld.target_name.replace(".", "_"))
+            increment = self.threshold
+
+        # one HASH per row, each row hashes the keys with its own polynomial so the rows are independent, and for
+        # each epoch one REGISTER per row
+        self.key_fields = get_key_fields(self.keys, self.p4_raw_fields, self.logger)
+        hash_fields = get_hash_fields(self.key_fields, meta_init_name)
+        self.hashes = [HashFields('%s_%i' % (self.operator_name, row), hash_fields, 'crc32_custom', self.index_bits)
+                       for row in range(self.depth)]
+        self.epoch_field = epoch_field
+        self.registers = [[Register('%s_%i_%i' % (self.operator_name, epoch, row), REGISTER_WIDTH, self.width)
+                           for row in range(self.depth)] for epoch in range(REGISTER_BANKS)]
+
+        # create ACTIONs and TABLEs to update all the rows, for each epoch
+        self.init_actions = list()
+        self.init_tables = list()
+        for epoch, registers in enumerate(self.registers):
+            primitives = list()
+            for row, (row_hash, register) in enumerate(zip(self.hashes, registers)):
+                index_field_name = '%s.index_%i' % (self.metadata.get_name(), row)
+                row_value_field_name = '%s.value_%i' % (self.metadata.get_name(), row)
+                primitives.append(ModifyFieldWithHashBasedOffset(index_field_name, 0, row_hash.get_name(),
+                                                                 self.width))
+                primitives.append(RegisterRead(row_value_field_name, register.get_name(), index_field_name))
+                primitives.append(ModifyField(row_value_field_name, '%s + %s' % (row_value_field_name, increment)))
+                primitives.append(RegisterWrite(register.get_name(), index_field_name, row_value_field_name))
+            primitives.append(ModifyField(self.value_field_name, '%s.value_0' % self.metadata.get_name()))
+            action = Action('do_init_%s_%i' % (self.operator_name, epoch), primitives)
+            self.init_actions.append(action)
+            self.init_tables.append(Table('init_%s_%i' % (self.operator_name, epoch), action.get_name(), [], None, 1))
+
+        # create one ACTION and TABLE per row to keep the minimum of the rows
+        self.min_actions = list()
+        self.min_tables = list()
+        for row in range(1, self.depth):
+            action = Action('do_min_%s_%i' % (self.operator_name, row),
+                            ModifyField(self.value_field_name, '%s.value_%i' % (self.metadata.get_name(), row)))
+            self.min_actions.append(action)
+            self.min_tables.append(Table('min_%s_%i' % (self.operator_name, row), action.get_name(), [], None, 1))
+
+        # create three TABLEs that implement reduce operation
+        # if count < THRESHOLD, drop,
+        table_name = 'drop_%s' % self.operator_name
+        self.drop_table = Table(table_name, drop_action, [], None, 1)
+
+        # if count == THRESHOLD, pass through with current count
+        self.set_count_action = Action('set_count_%s' % self.operator_name,
+                                       ModifyField('%s.count' % meta_init_name, self.value_field_name))
+        table_name = 'first_pass_%s' % self.operator_name
+        self.first_pass_table = Table(table_name, self.set_count_action.get_name(), [], None, 1)
+
+        # if count > THRESHOLD, let it pass through with count set to 1
+        self.reset_count_action = Action('reset_count_%s' % self.operator_name,
+                                         ModifyField('%s.count' % meta_init_name, 1))
+        table_name = 'pass_%s' % self.operator_name
+        self.pass_table = Table(table_name, self.reset_count_action.get_name(), [], None, 1)
+
+    def __repr__(self):
+        return '.CMSReduce(keys=' + ','.join([x for x in self.keys]) + ', threshold=' + str(self.threshold) + \
+               ', d=' + str(self.depth) + ', w=' + str(self.width) + ')'
+
+    def get_code(self):
+        out = ''
+        out += '// %s %i of query %i\n' % (self.name, self.operator_id, self.query_id)
+        out += self.metadata.get_code()
+        for row_hash in self.hashes:
+            out += row_hash.get_code()
+        for registers in self.registers:
+            for register in registers:
+                out += register.get_code()
+        for action in self.init_actions:
+            out += action.get_code()
+        for action in self.min_actions:
+            out += action.get_code()
+        out += self.set_count_action.get_code()
+        out += self.reset_count_action.get_code()
+
+        for table in self.init_tables:
+            out += table.get_code()
+        for table in self.min_tables:
+            out += table.get_code()
+        out += self.first_pass_table.get_code()
+        out += self.pass_table.get_code()
+        out += self.drop_table.get_code()
+        out += '\n'
+        return out
+
+    def get_commands(self):
+        commands = list()
+        for row, row_hash in enumerate(self.hashes):
+            commands.append(get_crc32_parameters_command(row_hash, row))
+        for table in self.init_tables:
+            commands.append(table.get_default_command())
+        for table in self.min_tables:
+            commands.append(table.get_default_command())
+        commands.append(self.first_pass_table.get_default_command())
+        commands.append(self.pass_table.get_default_command())
+        commands.append(self.drop_table.get_default_command())
+        return commands
+
+    def get_control_flow(self, indent_level):
+        indent = '\t' * indent_level
+        out = ''
+        out += get_epoch_control_flow(indent, self.epoch_field, self.init_tables)
+        for row, table in enumerate(self.min_tables, 1):
+            out += '%sif (%s.value_%i < %s) {\n' % (indent, self.metadata.get_name(), row, self.value_field_name)
+            out += '%s\tapply(%s);\n' % (indent, table.get_name())
+            out += '%s}\n' % (indent,)
+
+        out += '%sif (%s == %s) {\n' % (indent, self.value_field_name, self.threshold)
+        out += '%s\tapply(%s);\n' % (indent, self.first_pass_table.get_name())
+        out += '%s}\n' % (indent,)
+        out += '%selse if (%s > %s) {\n' % (indent, self.value_field_name, self.threshold)
+        out += '%s\tapply(%s);\n' % (indent, self.pass_table.get_name())
+        out += '%s}\n' % (indent,)
+        out += '%selse {\n' % (indent,)
+        out += '%s\tapply(%s);\n' % (indent, self.drop_table.get_name())
+        out += '%s}\n' % (indent,)
+        return out
+
+    def get_init_keys(self):
+        return self.keys + ['count']
+
+
+class P4HashPipeReduce(P4Operator):
+    """
+    Reduce over s stages of w registers (HashPipe), each stage indexed by its own hash of the keys and holding the
+    fingerprint of the key next to its count. A key takes the first stage whose slot is empty or already holds its
+    fingerprint. A key that finds all its slots taken is not counted in the data plane, each of its packets is
+    reported to the emitter with the overflow field set instead, so no count is lost to a collision. There is one
+    set of stages per epoch, as for P4Reduce.
+    """
+    def __init__(self, qid, operator_id, meta_init_name, drop_action, nop_action, keys, values, threshold, n_stages,
+                 width, epoch_field, epoch_offset_field, p4_raw_fields):
+        super(P4HashPipeReduce, self).__init__('HashPipeReduce', qid, operator_id, keys, p4_raw_fields)
+
+        if threshold == '-1':
+            self.threshold = int(THRESHOLD)
+        else:
+            self.threshold = int(threshold)
+
+        self.out_headers += ['index', 'overflow']
+        self.meta_init_name = meta_init_name
+        self.values = values
+        # the stages and the fingerprint each hash the keys with a polynomial of their own
+        if n_stages >= len(CRC32_POLYNOMIALS):
+            raise ValueError('a HashPipe has at most %i stages, got %i' % (len(CRC32_POLYNOMIALS) - 1, n_stages))
+        self.n_stages = n_stages
+        self.width = width
+        self.index_bits = max(1, int(math.log(width, 2)))
+
+        # the fields of each stage: its index, and the fingerprint and count read from its registers
+        fields = [('fingerprint', FINGERPRINT_SIZE), ('value', REGISTER_WIDTH), ('index', REGISTER_NUM_INDEX_BITS)]
+        for stage in range(self.n_stages):
+            fields += [('index_%i' % stage, self.index_bits), ('fingerprint_%i' % stage, FINGERPRINT_SIZE),
+                       ('count_%i' % stage, REGISTER_WIDTH)]
+        self.metadata = MetaData(self.operator_name, fields)
+
+        self.fingerprint_field_name = '%s.fingerprint' % self.metadata.get_name()
+        # name of metadata field where the count of the key is kept temporarily
+        self.value_field_name = '%s.value' % self.metadata.get_name()
+        # name of metadata field where the index of the count within all the stages is stored
+        self.index_field_name = '%s.index' % self.metadata.get_name()
+
+        if self.values[0] == 'count':
+            self.threshold = '1'
+            increment = 1
+        else:
+            target_fld = self.p4_raw_fields.get_target_field(self.values[0])
+            self.threshold = '%s.%s' % (meta_init_name, target_fld.target_name.replace(".", "_"))
+            increment = self.threshold
+
+        # the fingerprint is the hash of the keys with the polynomial after those of the stages, offset by one as 0
+        # marks an empty slot
+        self.key_fields = get_key_fields(self.keys, self.p4_raw_fields, self.logger)
+        hash_fields = get_hash_fields(self.key_fields, meta_init_name)
+        self.fingerprint_hash = HashFields('%s_fp' % self.operator_name, hash_fields, 'crc32_custom', FINGERPRINT_SIZE)
+        primitives = list()
+        primitives.append(ModifyFieldWithHashBasedOffset(self.fingerprint_field_name, 1,
+                                                         self.fingerprint_hash.get_name(),
+                                                         '0x%08x' % (2 ** FINGERPRINT_SIZE - 1)))
+
+        # one HASH per stage, and for each epoch two REGISTERs (fingerprints and counts) per stage
+        self.hashes = list()
+        for stage in range(self.n_stages):
+            stage_hash = HashFields('%s_%i' % (self.operator_name, stage), hash_fields, 'crc32_custom', self.index_bits)
+            self.hashes.append(stage_hash)
+            primitives.append(ModifyFieldWithHashBasedOffset('%s.index_%i' % (self.metadata.get_name(), stage), 0,
+                                                             stage_hash.get_name(), self.width))
+        self.epoch_field = epoch_field
+        self.fingerprint_registers = [[Register('%s_fingerprints_%i_%i' % (self.operator_name, epoch, stage),
+                                                FINGERPRINT_SIZE, self.width) for stage in range(self.n_stages)]
+                                      for epoch in range(REGISTER_BANKS)]
+        self.count_registers = [[Register('%s_counts_%i_%i' % (self.operator_name, epoch, stage), REGISTER_WIDTH,
+                                          self.width) for stage in range(self.n_stages)]
+                                for epoch in range(REGISTER_BANKS)]
+
+        # create ACTIONs and TABLEs to read the slots of all the stages, for each epoch, and to take the slot of a
+        # stage or count in it, for each epoch and stage
+        self.init_actions = list()
+        self.init_tables = list()
+        self.update_actions = list()
+        # stage -> update table of each epoch
+        self.update_tables = [list() for _ in range(self.n_stages)]
+        for epoch in range(REGISTER_BANKS):
+            init_primitives = list(primitives)
+            for stage in range(self.n_stages):
+                index_field_name = '%s.index_%i' % (self.metadata.get_name(), stage)
+                fingerprint_field_name = '%s.fingerprint_%i' % (self.metadata.get_name(), stage)
+                count_field_name = '%s.count_%i' % (self.metadata.get_name(), stage)
+                fingerprint_register = self.fingerprint_registers[epoch][stage]
+                count_register = self.count_registers[epoch][stage]
+                init_primitives.append(RegisterRead(fingerprint_field_name, fingerprint_register.get_name(),
+                                                    index_field_name))
+                init_primitives.append(RegisterRead(count_field_name, count_register.get_name(), index_field_name))
+
+                update_primitives = list()
+                update_primitives.append(RegisterWrite(fingerprint_register.get_name(), index_field_name,
+                                                       self.fingerprint_field_name))
+                update_primitives.append(ModifyField(self.value_field_name, '%s + %s' % (count_field_name, increment)))
+                update_primitives.append(RegisterWrite(count_register.get_name(), index_field_name,
+                                                       self.value_field_name))
+                update_primitives.append(ModifyField(self.index_field_name,
+                                                     '%s + %i' % (index_field_name, stage * self.width)))
+                action = Action('do_update_%s_%i_%i' % (self.operator_name, epoch, stage), update_primitives)
+                self.update_actions.append(action)
+                self.update_tables[stage].append(Table('update_%s_%i_%i' % (self.operator_name, epoch, stage),
+                                                       action.get_name(), [], None, 1))
+
+            action = Action('do_init_%s_%i' % (self.operator_name, epoch), init_primitives)
+            self.init_actions.append(action)
+            self.init_tables.append(Table('init_%s_%i' % (self.operator_name, epoch), action.get_name(), [], None, 1))
+
+        # if the key found no slot, pass through with the overflow flag set
+        self.overflow_action = Action('set_overflow_%s' % self.operator_name,
+                                      ModifyField('%s.overflow' % meta_init_name, 1))
+        table_name = 'overflow_%s' % self.operator_name
+        self.overflow_table = Table(table_name, self.overflow_action.get_name(), [], None, 1)
+        table_name = 'pass_%s' % self.operator_name
+        self.pass_table = Table(table_name, nop_action, [], None, 1)
+
+        # if count == THRESHOLD, pass through with the index of the count and the offset of the epoch, else drop
+        self.set_index_action = Action('set_index_%s' % self.operator_name,
+                                       ModifyField('%s.index' % meta_init_name,
+                                                   '%s + %s' % (self.index_field_name, epoch_offset_field)))
+        table_name = 'first_pass_%s' % self.operator_name
+        self.first_pass_table = Table(table_name, self.set_index_action.get_name(), [], None, 1)
+        table_name = 'drop_%s' % self.operator_name
+        self.drop_table = Table(table_name, drop_action, [], None, 1)
+
+    def __repr__(self):
+        return '.HashPipeReduce(keys=' + ','.join([x for x in self.keys]) + ', threshold=' + str(self.threshold) + \
+               ', stages=' + str(self.n_stages) + ', w=' + str(self.width) + ')'
+
+    def get_registers(self):
+        """
+        Returns (register name, offset of its indexes in the index field, width, epoch) of the count registers
+        """
+        return [(register.get_name(), epoch * REGISTER_INSTANCE_COUNT + stage * self.width, self.width, epoch)
+                for epoch, registers in enumerate(self.count_registers) for stage, register in enumerate(registers)]
+
+    def get_code(self):
+        out = ''
+        out += '// %s %i of query %i\n' % (self.name, self.operator_id, self.query_id)
+        out += self.metadata.get_code()
+        out += self.fingerprint_hash.get_code()
+        for stage_hash in self.hashes:
+            out += stage_hash.get_code()
+        for fingerprint_registers, count_registers in zip(self.fingerprint_registers, self.count_registers):
+            for fingerprint_register, count_register in zip(fingerprint_registers, count_registers):
+                out += fingerprint_register.get_code()
+                out += count_register.get_code()
+        for action in self.init_actions:
+            out += action.get_code()
+        for action in self.update_actions:
+            out += action.get_code()
+        out += self.overflow_action.get_code()
+        out += self.set_index_action.get_code()
+
+        for table in self.init_tables:
+            out += table.get_code()
+        for tables in self.update_tables:
+            for table in tables:
+                out += table.get_code()
+        out += self.overflow_table.get_code()
+        out += self.pass_table.get_code()
+        out += self.first_pass_table.get_code()
+        out += self.drop_table.get_code()
+        out += '\n'
+        return out
+
+    def get_commands(self):
+        commands = list()
+        for stage, stage_hash in enumerate(self.hashes):
+            commands.append(get_crc32_parameters_command(stage_hash, stage))
+        commands.append(get_crc32_parameters_command(self.fingerprint_hash, self.n_stages))
+        for table in self.init_tables:
+            commands.append(table.get_default_command())
+        for tables in self.update_tables:
+            for table in tables:
+                commands.append(table.get_default_command())
+        commands.append(self.overflow_table.get_default_command())
+        commands.append(self.pass_table.get_default_command())
+        commands.append(self.first_pass_table.get_default_command())
+        commands.append(self.drop_table.get_default_command())
+        return commands
+
+    def get_control_flow(self, indent_level):
+        indent = '\t' * indent_level
+        out = ''
+        out += get_epoch_control_flow(indent, self.epoch_field, self.init_tables)
+        for stage, tables in enumerate(self.update_tables):
+            fingerprint_field_name = '%s.fingerprint_%i' % (self.metadata.get_name(), stage)
+            out += '%s%sif (%s == %s or %s == 0) {\n' % (indent, 'else ' if stage > 0 else '', fingerprint_field_name,
+                                                        self.fingerprint_field_name, fingerprint_field_name)
+            out += get_epoch_control_flow(indent + '\t', self.epoch_field, tables)
+            out += '%s}\n' % (indent,)
+        out += '%selse {\n' % (indent,)
+        out += '%s\tapply(%s);\n' % (indent, self.overflow_table.get_name())
+        out += '%s}\n' % (indent,)
+
+        out += '%sif (%s.overflow == 1) {\n' % (indent, self.meta_init_name)
+        out += '%s\tapply(%s);\n' % (indent, self.pass_table.get_name())
+        out += '%s}\n' % (indent,)
+        out += '%selse if (%s == %s) {\n' % (indent, self.value_field_name, self.threshold)
+        out += '%s\tapply(%s);\n' % (indent, self.first_pass_table.get_name())
+        out += '%s}\n' % (indent,)
+        out += '%selse {\n' % (indent,)
+        out += '%s\tapply(%s);\n' % (indent, self.drop_table.get_name())
+        out += '%s}\n' % (indent,)
+        return out
+
+    def get_init_keys(self):
+        return self.keys + ['count']
+
+
 class P4MapInit(P4Operator):
     def __init__(self, qid, operator_id, keys, p4_raw_fields):
         super(P4MapInit, self).__init__('MapInit', qid, operator_id, keys, p4_raw_fields)
@@ -335,6 +910,9 @@ class P4MapInit(P4Operator):
             elif fld == 'index':
                 map_init_fields.append(P4Field(layer=None, target_name="index", sonata_name="index",
                                                size=INDEX_SIZE))
+            elif fld == 'overflow':
+                map_init_fields.append(P4Field(layer=None, target_name="overflow", sonata_name="overflow",
+                                               size=OVERFLOW_SIZE))
             else:
                 map_init_fields.append(self.p4_raw_fields.get_target_field(fld))
         # create METADATA object to store data for all keys
@@ -358,6 +936,8 @@ class P4MapInit(P4Operator):
                 primitives.append(ModifyField(meta_field_name, 0))
             elif sonata_name == 'index':
                 primitives.append(ModifyField(meta_field_name, 0))
+            elif sonata_name == 'overflow':
+                primitives.append(ModifyField(meta_field_name, 0))
             else:
                 # Read data from raw header fields and assign them to these meta fields
                 primitives.append(ModifyField(meta_field_name, target_name))
@@ -4,13 +4,18 @@
 
 from p4_elements import Action, Header, Table
 # TODO: Fix these imports
-from p4_operators import P4Distinct, P4Filter, P4Map, P4MapInit, P4Reduce, QID_SIZE, COUNT_SIZE,INDEX_SIZE
+from p4_operators import P4Distinct, P4Filter, P4Map, P4MapInit, P4Reduce, P4CMSReduce, P4BloomDistinct
+from p4_operators import P4HashPipeReduce
+from p4_operators import QID_SIZE, COUNT_SIZE, INDEX_SIZE, OVERFLOW_SIZE
+from p4_operators import REGISTER_WIDTH, REGISTER_INSTANCE_COUNT, REGISTER_BANKS
+from sonata.core.training.hypothesis.costs.dp_cost import get_cms_dimensions, get_bloom_filter_hashes
 from p4_primitives import ModifyField, AddHeader
 from sonata.dataplane_driver.utils import get_logger
 from p4_field import P4Field
 from p4_layer import P4Layer
 from p4_layer import OutHeaders
 import logging
+import math
 
 
 # Class that holds one refined query - which consists of an ordered list of operators
@@ -23,7 +28,7 @@ class P4Query(object):
 
     def __init__(self, query_id, parse_payload, payload_fields, read_register, filter_payload,
                  filter_payload_str, generic_operators, nop_name, drop_meta_field,
-                 satisfied_meta_field, clone_meta_field, p4_raw_fields):
+                 satisfied_meta_field, clone_meta_field, epoch_meta_field, epoch_offset_meta_field, p4_raw_fields):
 
         # LOGGING
         log_level = logging.ERROR
@@ -37,6 +42,13 @@ class P4Query(object):
         self.filter_payload = filter_payload
         self.filter_payload_str = filter_payload_str
         self.registers_to_read = []
+        # register -> (offset of its indexes in the index field, width), for the banks of a Reduce and the stages of
+        # a HashPipeReduce
+        self.register_offsets = {}
+        # register -> epoch, for the banks of the registers the emitter reads
+        self.register_epochs = {}
+        # epoch -> registers the emitter does not read, the controller resets them once their epoch is over
+        self.epoch_registers = dict((epoch, []) for epoch in range(REGISTER_BANKS))
         self.meta_init_name = ''
         # print '$$$$$$$$$$$$$ vals: ' + str(self.parse_payload) + ":" + str(self.read_register)
 
@@ -47,6 +59,8 @@ class P4Query(object):
         self.drop_meta_field = '%s_%i' % (drop_meta_field, self.id)
         self.satisfied_meta_field = '%s_%i' % (satisfied_meta_field, self.id)
         self.clone_meta_field = clone_meta_field
+        self.epoch_meta_field = epoch_meta_field
+        self.epoch_offset_meta_field = epoch_offset_meta_field
 
         self.p4_raw_fields = p4_raw_fields
 
@@ -84,7 +98,7 @@ class P4Query(object):
         out_header_name = 'out_header_%i' % self.id
         self.out_header = OutHeaders(out_header_name)
         print "Last Operator", self.operators[-1], self.payload_fields+['ts', 'count']
-        sonata_field_list = filter(lambda x: x not in self.payload_fields+['ts', 'count', 'index'], self.operators[-1].get_out_headers())
+        sonata_field_list = filter(lambda x: x not in self.payload_fields+['ts', 'count', 'index', 'overflow'], self.operators[-1].get_out_headers())
         out_header_fields = [self.p4_raw_fields.get_target_field(x) for x in sonata_field_list]
 
         qid_field = P4Field(layer=self.out_header, target_name="qid", sonata_name="qid", size=QID_SIZE)
@@ -95,10 +109,30 @@ class P4Query(object):
         if 'index' in self.operators[-1].get_out_headers():
             out_header_fields.append(P4Field(layer=self.out_header, target_name="index", sonata_name="index",
                                              size=INDEX_SIZE))
+        if 'overflow' in self.operators[-1].get_out_headers():
+            out_header_fields.append(P4Field(layer=self.out_header, target_name="overflow", sonata_name="overflow",
+                                             size=OVERFLOW_SIZE))
 
         for operator in self.operators:
-            if operator.name == 'Reduce':
-                self.registers_to_read.append(operator.register.name)
+            if operator.name == 'Reduce' and self.read_register:
+                for epoch, register in enumerate(operator.registers):
+                    self.registers_to_read.append(register.get_name())
+                    self.register_offsets[register.get_name()] = (epoch * REGISTER_INSTANCE_COUNT,
+                                                                  REGISTER_INSTANCE_COUNT)
+                    self.register_epochs[register.get_name()] = epoch
+            elif operator.name in ['Reduce', 'Distinct']:
+                for epoch, register in enumerate(operator.registers):
+                    self.epoch_registers[epoch].append(register.get_name())
+            elif operator.name in ['CMSReduce', 'BloomDistinct']:
+                for epoch, registers in enumerate(operator.registers):
+                    self.epoch_registers[epoch] += [register.get_name() for register in registers]
+            elif operator.name == 'HashPipeReduce':
+                for register_name, offset, width, epoch in operator.get_registers():
+                    self.registers_to_read.append(register_name)
+                    self.register_offsets[register_name] = (offset, width)
+                    self.register_epochs[register_name] = epoch
+                for epoch, registers in enumerate(operator.fingerprint_registers):
+                    self.epoch_registers[epoch] += [register.get_name() for register in registers]
 
         # Add fields to this out header
         self.out_header.fields = out_header_fields
@@ -140,6 +174,8 @@ class P4Query(object):
         map_init_keys = ['qid'] + self.get_init_fields(generic_operators)
 
         if self.read_register: map_init_keys += ['index']
+        if self.read_register and any(self.is_hash_pipe_reduce(operator) for operator in generic_operators):
+            map_init_keys += ['overflow']
 
         print "For Query", self.id, "MapInit fields", map_init_keys
 
@@ -181,6 +217,43 @@ class P4Query(object):
                                           operator.map_keys,
                                           operator.func, self.p4_raw_fields))
 
+            elif operator.name == 'Reduce' and getattr(operator, 'cms_bits', 0) > 0 and not self.read_register:
+                # the counters of a count-min sketch can't be read back by index, only for counts in the out header.
+                # cms_bits is set on the query: the size the training cost model picks is printed by Costs, the
+                # final plan of the config does not carry it to the operators
+                depth, width = get_cms_dimensions(operator.cms_bits, REGISTER_WIDTH,
+                                                  max_columns=REGISTER_INSTANCE_COUNT)
+                self.logger.debug('count-min sketch with %i rows of %i registers' % (depth, width))
+                p4_operators.append(P4CMSReduce(self.id,
+                                                operator_id,
+                                                self.meta_init_name,
+                                                self.query_drop_action,
+                                                operator.keys,
+                                                operator.values,
+                                                operator.threshold,
+                                                depth,
+                                                width,
+                                                self.epoch_meta_field,
+                                                self.p4_raw_fields))
+
+            elif self.is_hash_pipe_reduce(operator):
+                # the stages share the indexes of one register, the emitter reads each stage at its offset
+                width = 2 ** int(math.floor(math.log(REGISTER_INSTANCE_COUNT // operator.stages, 2)))
+                self.logger.debug('HashPipe with %i stages of %i registers' % (operator.stages, width))
+                p4_operators.append(P4HashPipeReduce(self.id,
+                                                     operator_id,
+                                                     self.meta_init_name,
+                                                     self.query_drop_action,
+                                                     self.nop_action,
+                                                     operator.keys,
+                                                     operator.values,
+                                                     operator.threshold,
+                                                     operator.stages,
+                                                     width,
+                                                     self.epoch_meta_field,
+                                                     self.epoch_offset_meta_field,
+                                                     self.p4_raw_fields))
+
             elif operator.name == 'Reduce':
                 p4_operators.append(P4Reduce(self.id,
                                              operator_id,
@@ -190,20 +263,44 @@ class P4Query(object):
                                              operator.values,
                                              operator.threshold,
                                              self.read_register,
+                                             self.epoch_meta_field,
+                                             self.epoch_offset_meta_field,
                                              self.p4_raw_fields))
 
+            elif operator.name == 'Distinct' and getattr(operator, 'bloom_bits', 0) > 0:
+                n_hashes = operator.bloom_hashes
+                if not n_hashes:
+                    n_hashes = get_bloom_filter_hashes(operator.bloom_bits, operator.cardinality)
+                p4_operators.append(P4BloomDistinct(self.id,
+                                                    operator_id,
+                                                    self.meta_init_name,
+                                                    self.query_drop_action,
+                                                    self.nop_action,
+                                                    operator.keys,
+                                                    operator.bloom_bits,
+                                                    n_hashes,
+                                                    operator.cardinality,
+                                                    self.epoch_meta_field,
+                                                    self.p4_raw_fields))
+
             elif operator.name == 'Distinct':
                 p4_operators.append(P4Distinct(self.id,
                                                operator_id,
                                                self.meta_init_name,
                                                self.query_drop_action,
                                                self.nop_action,
-                                               operator.keys, self.p4_raw_fields))
+                                               operator.keys,
+                                               self.epoch_meta_field, self.p4_raw_fields))
 
             else:
                 self.logger.error('tried to add an unsupported operator: %s' % operator.name)
         return p4_operators
 
+    def is_hash_pipe_reduce(self, operator):
+        # the overflow reports complete the counts read from the registers, one report per packet
+        return (operator.name == 'Reduce' and getattr(operator, 'stages', 0) > 1 and self.read_register and
+                operator.values[0] == 'count')
+
     def get_ingress_control_flow(self, indent_level):
         curr_indent_level = indent_level
 
@@ -280,6 +377,9 @@ class P4Query(object):
         header_format['filter_payload'] = self.filter_payload
         header_format['filter_payload_str'] = self.filter_payload_str
         header_format['registers'] = self.registers_to_read
+        header_format['register_offsets'] = self.register_offsets
+        header_format['register_epochs'] = self.register_epochs
+        header_format['overflow'] = 'overflow' in self.operators[-1].get_out_headers()
         print "%%%% get_header_format %%%% :" + str(self.out_header)
         if self.out_header:
             header_format['headers'] = self.out_header
@@ -288,7 +388,10 @@ class P4Query(object):
 
         return header_format
 
-    def get_update_commands(self, filter_id, update):
+    def get_epoch_reset_commands(self, epoch):
+        return ['register_reset %s' % register for register in self.epoch_registers[epoch]]
+
+    def get_update_commands(self, filter_id, additions, removals=()):
         commands = list()
         if filter_id in self.src_to_filter_operator:
             filter_operator = self.src_to_filter_operator[filter_id]
@@ -296,7 +399,10 @@ class P4Query(object):
             filter_table_name = filter_operator.table.get_name()
             filter_action = filter_operator.get_match_action()
 
-            for dip in update:
+            for dip in removals:
+                dip = dip.strip('\n')
+                commands.append('table_delete %s %s/%i' % (filter_table_name, dip, filter_mask))
+            for dip in additions:
                 dip = dip.strip('\n')
                 commands.append('table_add %s %s  %s/%i =>' % (filter_table_name, filter_action, dip, filter_mask))
         return commands
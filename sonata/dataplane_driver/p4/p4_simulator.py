@@ -0,0 +1,568 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+"""
+In-process simulator of the switch running the program of a P4Application, to test and benchmark the compiled
+queries without bmv2. It interprets the object model the P4 code is generated from: the control flow of the ingress
+and egress pipelines, the tables and the runtime commands that fill them, the primitives of the actions, the hash
+field lists and the registers. The report packets it returns are the frames the emitter would capture: the out
+headers of the satisfied queries and the final header, followed by the original packet.
+"""
+
+import re
+import socket
+import struct
+
+from p4_control import ADDED_ENTRY, parse_table_add
+from p4_elements import Action, FieldList, HashFields, MetaData, Register, Table
+from p4_layer import OutHeaders
+from p4_operators import P4Operator
+from p4_query import P4Query
+from reference_model import HASH_ALGORITHMS, PacketParser, get_crc_function, get_fields_packer
+from sonata.dataplane_driver.utils import get_logger
+
+# instance types of bmv2, the egress pipeline tells the report clone from the original packet with them
+INSTANCE_TYPE_FIELD = 'standard_metadata.instance_type'
+INSTANCE_TYPE_NORMAL = 0
+INSTANCE_TYPE_INGRESS_CLONE = 1
+
+# keys of the packet state that are not fields: the field list of a pending clone, and the valid bit of a header
+CLONE_KEY = '$clone'
+VALID_KEY = '%s.$valid'
+
+ELEMENT_TYPES = (Action, Table, HashFields, Register, MetaData, FieldList, OutHeaders)
+
+CONTROL_STATEMENT = re.compile(r'^control (\w+) \{(.*)$')
+IF_STATEMENT = re.compile(r'^(else )?if \((.*)\) \{$')
+APPLY_STATEMENT = re.compile(r'^apply\((\w+)\);$')
+COMPARISON = re.compile(r'^(\S+)\s*(==|!=|<=|>=|<|>)\s*(\S+)$')
+
+COMPARISONS = {'==': lambda a, b: a == b, '!=': lambda a, b: a != b, '<=': lambda a, b: a <= b,
+               '>=': lambda a, b: a >= b, '<': lambda a, b: a < b, '>': lambda a, b: a > b}
+
+BINARY_PRIMITIVES = {'bit_and': lambda a, b: a & b, 'bit_or': lambda a, b: a | b, 'bit_xor': lambda a, b: a ^ b,
+                     'add': lambda a, b: a + b, 'subtract': lambda a, b: a - b,
+                     'shift_left': lambda a, b: a << b, 'shift_right': lambda a, b: a >> b}
+
+
+def get_elements(obj, elements=None):
+    """
+    Returns the P4 elements (actions, tables, hashes, registers, metadata and headers) held by obj, by the
+    attributes of its queries and by those of their operators, as element type -> name -> element
+    """
+    if elements is None:
+        elements = dict((element_type, dict()) for element_type in ELEMENT_TYPES)
+    if isinstance(obj, ELEMENT_TYPES):
+        for element_type in ELEMENT_TYPES:
+            if isinstance(obj, element_type):
+                elements[element_type][obj.get_name()] = obj
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            get_elements(item, elements)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            get_elements(item, elements)
+    elif isinstance(obj, (P4Query, P4Operator)):
+        get_elements(vars(obj).values(), elements)
+    return elements
+
+
+def parse_control_flow(code):
+    """
+    Parses the control blocks generated by P4Application, returns control name -> statements, a statement being
+    ('apply', table) or ('if', [(condition, statements), ...]), the condition of an else branch being None
+    """
+    controls = dict()
+    stack = []
+    for line in code.splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        match = CONTROL_STATEMENT.match(line)
+        if match:
+            controls[match.group(1)] = []
+            stack = [controls[match.group(1)]]
+            if match.group(2).strip() == '}':
+                stack = []
+            continue
+        if line == '}':
+            stack.pop()
+            continue
+        match = IF_STATEMENT.match(line)
+        if match or line == 'else {':
+            block = []
+            if match and not match.group(1):
+                stack[-1].append(('if', [(match.group(2), block)]))
+            else:
+                stack[-1][-1][1].append((match.group(2) if match else None, block))
+            stack.append(block)
+            continue
+        match = APPLY_STATEMENT.match(line)
+        if match:
+            stack[-1].append(('apply', match.group(1)))
+            continue
+        raise ValueError('unsupported statement in the control flow: %s' % line)
+    return controls
+
+
+def parse_match_value(value, width):
+    """
+    Returns the value of a match field given in a runtime command: an IP, a MAC or an integer
+    """
+    if value.count('.') == 3:
+        return struct.unpack('!I', socket.inet_aton(value))[0]
+    elif ':' in value:
+        return int(value.replace(':', ''), 16)
+    return int(value, 0) & ((1 << width) - 1)
+
+
+class TableState(object):
+    """
+    Entries of a table installed by the runtime commands, indexed by their match: the exact fields match by value,
+    the lpm field by the value of its prefix and the longest prefix wins
+    """
+    def __init__(self, table, widths):
+        self.name = table.get_name()
+        reads = table.reads or []
+        self.fields = [field for field, _ in reads]
+        self.widths = [widths[field] for field in self.fields]
+        self.lpm = None
+        for position, (field, match_type) in enumerate(reads):
+            if match_type == 'lpm':
+                self.lpm = position
+            elif match_type != 'exact':
+                raise ValueError('unsupported match type %s of table %s' % (match_type, self.name))
+
+        self.default_action = None
+        # match -> (action, handle), the match ends with the prefix length of the lpm field
+        self.entries = dict()
+        self.handles = dict()
+        self.next_handle = 0
+        self.prefix_lengths = []
+
+    def get_match(self, match_values):
+        values = []
+        prefix_length = None
+        for position, (value, width) in enumerate(zip(match_values, self.widths)):
+            if position == self.lpm:
+                prefix_length = width
+                if '/' in value:
+                    value, prefix_length = value.split('/')
+                    prefix_length = int(prefix_length)
+                value = self.get_prefix(parse_match_value(value, width), width, prefix_length)
+            else:
+                value = parse_match_value(value, width)
+            values.append(value)
+        return tuple(values) + (prefix_length,)
+
+    def get_prefix(self, value, width, prefix_length):
+        return value & (((1 << prefix_length) - 1) << (width - prefix_length))
+
+    def add(self, match_values, action):
+        match = self.get_match(match_values)
+        if match in self.entries:
+            return None
+        handle = self.next_handle
+        self.next_handle += 1
+        self.entries[match] = (action, handle)
+        self.handles[handle] = match
+        self.update_prefix_lengths()
+        return handle
+
+    def delete(self, match_values):
+        if len(match_values) == 1 and match_values[0].isdigit() and int(match_values[0]) in self.handles:
+            match = self.handles[int(match_values[0])]
+        else:
+            match = self.get_match(match_values)
+        if match not in self.entries:
+            return False
+        del self.handles[self.entries.pop(match)[1]]
+        self.update_prefix_lengths()
+        return True
+
+    def clear(self):
+        self.entries = dict()
+        self.handles = dict()
+        self.prefix_lengths = []
+
+    def update_prefix_lengths(self):
+        self.prefix_lengths = sorted(set([match[-1] for match in self.entries]), reverse=True)
+
+    def lookup(self, fields):
+        """
+        Returns the action of the entry matching the packet, the default action if there is none
+        """
+        if not self.entries:
+            return self.default_action
+        values = [fields.get(field, 0) for field in self.fields]
+        for prefix_length in self.prefix_lengths:
+            if self.lpm is not None:
+                values[self.lpm] = self.get_prefix(fields.get(self.fields[self.lpm], 0), self.widths[self.lpm],
+                                                   prefix_length)
+            entry = self.entries.get(tuple(values) + (prefix_length,))
+            if entry is not None:
+                return entry[0]
+        return self.default_action
+
+
+class P4Simulator(object):
+    """
+    Switch running the program of a P4Application. process() runs a frame through the ingress and egress pipelines
+    and returns the report packet the emitter would capture, send_commands() takes the runtime commands of the CLI
+    and the read/write/reset methods are those of the RegisterClient of the emitter.
+    """
+    def __init__(self, app):
+        self.logger = get_logger('P4Simulator', 'INFO')
+
+        elements = get_elements(vars(app).values())
+        self.actions = elements[Action]
+        self.hashes = elements[HashFields]
+        self.field_lists = elements[FieldList]
+        for calculation in self.hashes.values():
+            self.field_lists[calculation.field_list.get_name()] = calculation.field_list
+        # hash function of each calculation, the set_crc*_parameters commands change those of the custom ones
+        self.hash_functions = dict((name, HASH_ALGORITHMS[calculation.algorithm])
+                                   for name, calculation in self.hashes.iteritems())
+
+        # width of every field, by its name in the P4 program
+        self.widths = dict()
+        for layer in app.p4_raw_fields.layers:
+            for fld in layer.fields:
+                self.widths[fld.target_name] = fld.size
+        self.headers = dict()
+        for metadata in elements[MetaData].values():
+            self.headers[metadata.get_name()] = [field_name for field_name, _ in metadata.fields]
+            for field_name, width in metadata.fields:
+                self.widths['%s.%s' % (metadata.get_name(), field_name)] = width
+        for header in elements[OutHeaders].values():
+            self.headers[header.get_name()] = [fld.target_name.replace('.', '_') for fld in header.fields]
+            for fld in header.fields:
+                self.widths['%s.%s' % (header.get_name(), fld.target_name.replace('.', '_'))] = fld.size
+
+        self.registers = dict()
+        self.register_widths = dict()
+        for register in elements[Register].values():
+            self.registers[register.get_name()] = [0] * register.instance_count
+            self.register_widths[register.get_name()] = register.width
+
+        self.tables = dict((name, TableState(table, self.widths)) for name, table in elements[Table].iteritems())
+        self.mirror_sessions = dict()
+
+        # the deparser emits the out headers in the order they are extracted by the parser, the original packet
+        # follows the final header
+        self.deparser = list()
+        for header in [query.out_header for query in app.queries.values()] + [app.final_header]:
+            field_names = ['%s.%s' % (header.get_name(), fld.target_name.replace('.', '_')) for fld in header.fields]
+            self.deparser.append((VALID_KEY % header.get_name(), field_names,
+                                  get_fields_packer([fld.size for fld in header.fields])))
+
+        self.parser = PacketParser(app.p4_raw_fields)
+        self.compiled_actions = dict()
+        controls = parse_control_flow(app.get_ingress_pipeline() + app.get_egress_pipeline())
+        self.ingress = self.compile_block(controls['ingress'])
+        self.egress = self.compile_block(controls['egress'])
+
+        self.send_commands(app.get_commands())
+
+    # COMPILE THE OBJECT MODEL INTO FUNCTIONS OF THE PACKET STATE
+    def compile_block(self, statements):
+        steps = [self.compile_statement(statement) for statement in statements]
+
+        def run_block(fields):
+            for step in steps:
+                step(fields)
+        return run_block
+
+    def compile_statement(self, statement):
+        if statement[0] == 'apply':
+            table = self.tables[statement[1]]
+            actions = self.compiled_actions
+
+            def apply_table(fields):
+                action = table.lookup(fields)
+                if action is not None:
+                    actions[action](fields)
+            return apply_table
+
+        branches = [(self.compile_condition(condition) if condition is not None else None, self.compile_block(block))
+                    for condition, block in statement[1]]
+
+        def run_if(fields):
+            for condition, block in branches:
+                if condition is None or condition(fields):
+                    block(fields)
+                    return
+        return run_if
+
+    def compile_condition(self, condition):
+        alternatives = list()
+        for alternative in condition.split(' or '):
+            comparisons = list()
+            for comparison in alternative.split(' and '):
+                match = COMPARISON.match(comparison.strip())
+                if match is None:
+                    raise ValueError('unsupported condition in the control flow: %s' % condition)
+                comparisons.append((self.compile_operand(match.group(1)), COMPARISONS[match.group(2)],
+                                    self.compile_operand(match.group(3))))
+            alternatives.append(comparisons)
+
+        if len(alternatives) == 1 and len(alternatives[0]) == 1:
+            left, compare, right = alternatives[0][0]
+            return lambda fields: compare(left(fields), right(fields))
+
+        def check_condition(fields):
+            for comparisons in alternatives:
+                for left, compare, right in comparisons:
+                    if not compare(left(fields), right(fields)):
+                        break
+                else:
+                    return True
+            return False
+        return check_condition
+
+    def compile_operand(self, value):
+        """
+        Returns the function giving the value of an argument of a primitive: a constant, a field or a sum of them
+        """
+        if isinstance(value, (int, long)):
+            return lambda fields: value
+        value = str(value).strip()
+        if ' + ' in value:
+            terms = [self.compile_operand(term) for term in value.split(' + ')]
+            return lambda fields: sum([term(fields) for term in terms])
+        if value[0].isdigit():
+            constant = int(value, 0)
+            return lambda fields: constant
+        return lambda fields: fields.get(value, 0)
+
+    def get_setter(self, field_name):
+        # the value is truncated to the width of the field
+        mask = (1 << self.widths[field_name]) - 1 if field_name in self.widths else -1
+
+        def set_field(fields, value):
+            fields[field_name] = value & mask
+        return set_field
+
+    def get_field_list_names(self, field_list_name):
+        field_names = list()
+        for name in self.field_lists[field_list_name].fields:
+            if name in self.headers:
+                field_names += ['%s.%s' % (name, field_name) for field_name in self.headers[name]]
+            else:
+                field_names.append(name)
+        return field_names
+
+    def compile_action(self, action):
+        steps = [self.compile_primitive(primitive) for primitive in action.primitives]
+
+        def run_action(fields):
+            for step in steps:
+                step(fields)
+        self.compiled_actions[action.get_name()] = run_action
+
+    def compile_primitive(self, primitive):
+        name, args = primitive.name, primitive.args
+        if name == 'modify_field':
+            set_field = self.get_setter(args[0])
+            value = self.compile_operand(args[1])
+            return lambda fields: set_field(fields, value(fields))
+
+        elif name in BINARY_PRIMITIVES:
+            set_field = self.get_setter(args[0])
+            compute = BINARY_PRIMITIVES[name]
+            value1 = self.compile_operand(args[1])
+            value2 = self.compile_operand(args[2])
+            return lambda fields: set_field(fields, compute(value1(fields), value2(fields)))
+
+        elif name in ['add_to_field', 'subtract_from_field']:
+            set_field = self.get_setter(args[0])
+            compute = BINARY_PRIMITIVES['add' if name == 'add_to_field' else 'subtract']
+            value1 = self.compile_operand(args[0])
+            value2 = self.compile_operand(args[1])
+            return lambda fields: set_field(fields, compute(value1(fields), value2(fields)))
+
+        elif name == 'modify_field_with_hash_based_offset':
+            set_field = self.get_setter(args[0])
+            base = self.compile_operand(args[1])
+            calculation = self.hashes[args[2]]
+            size = self.compile_operand(args[3])
+            field_names = self.get_field_list_names(calculation.field_list.get_name())
+            pack = get_fields_packer([self.widths[field_name] for field_name in field_names])
+            hash_functions = self.hash_functions
+            output_mask = (1 << calculation.output_width) - 1
+
+            def modify_with_hash(fields):
+                data = pack([fields.get(field_name, 0) for field_name in field_names])
+                hash_value = hash_functions[args[2]](data) & output_mask
+                set_field(fields, base(fields) + hash_value % size(fields))
+            return modify_with_hash
+
+        elif name == 'register_read':
+            set_field = self.get_setter(args[0])
+            register = self.registers[args[1]]
+            index = self.compile_operand(args[2])
+            return lambda fields: set_field(fields, register[index(fields)])
+
+        elif name == 'register_write':
+            register = self.registers[args[0]]
+            mask = (1 << self.register_widths[args[0]]) - 1
+            index = self.compile_operand(args[1])
+            value = self.compile_operand(args[2])
+
+            def write_register(fields):
+                register[index(fields)] = value(fields) & mask
+            return write_register
+
+        elif name in ['add_header', 'remove_header']:
+            header = args[0]
+            field_names = ['%s.%s' % (header, field_name) for field_name in self.headers[header]]
+            is_valid = 1 if name == 'add_header' else 0
+
+            def set_header(fields):
+                if is_valid and not fields.get(VALID_KEY % header):
+                    for field_name in field_names:
+                        fields[field_name] = 0
+                fields[VALID_KEY % header] = is_valid
+            return set_header
+
+        elif name == 'clone_ingress_pkt_to_egress':
+            field_names = set(self.get_field_list_names(args[1]))
+
+            def clone_packet(fields):
+                fields[CLONE_KEY] = field_names
+            return clone_packet
+
+        elif name in ['no_op', 'drop']:
+            # only the report clones leave the simulated switch, dropping the original packet changes nothing
+            return lambda fields: None
+
+        raise ValueError('unsupported primitive %s' % primitive.get_code())
+
+    # RUN PACKETS
+    def process(self, frame):
+        """
+        Runs a frame through the pipelines, returns the report packet cloned to the emitter, None if the frame
+        satisfied no query
+        """
+        packet = self.parser.parse(frame)
+        fields = dict(packet)
+        fields[INSTANCE_TYPE_FIELD] = INSTANCE_TYPE_NORMAL
+        self.ingress(fields)
+        self.egress(fields)
+        if CLONE_KEY not in fields:
+            return None
+
+        # the clone is the packet as it was parsed, with the metadata of the field list of the clone primitive
+        clone = packet
+        for field_name in fields[CLONE_KEY]:
+            if field_name in fields:
+                clone[field_name] = fields[field_name]
+        clone[INSTANCE_TYPE_FIELD] = INSTANCE_TYPE_INGRESS_CLONE
+        self.egress(clone)
+        return self.deparse(clone, frame)
+
+    def deparse(self, fields, frame):
+        out = ''
+        for valid_key, field_names, pack in self.deparser:
+            if fields.get(valid_key):
+                out += pack([fields.get(field_name, 0) for field_name in field_names])
+        return out + frame
+
+    # RUNTIME COMMANDS
+    def send_commands(self, commands):
+        """
+        Applies the commands of the runtime CLI, returns their outputs as the CLI prints them
+        """
+        outputs = list()
+        for command in commands:
+            tokens = command.split()
+            if not tokens:
+                continue
+            outputs.append(self.send_command(command, tokens))
+        return outputs
+
+    def send_command(self, command, tokens):
+        if tokens[0] == 'table_set_default':
+            self.tables[tokens[1]].default_action = tokens[2]
+            self.get_action(tokens[2])
+            return ''
+
+        elif tokens[0] == 'table_add':
+            table, action, match, _ = parse_table_add(command)
+            self.get_action(action)
+            handle = self.tables[table].add(match, action)
+            if handle is None:
+                return 'Invalid table operation (DUPLICATE_ENTRY)'
+            return '%s %i' % (ADDED_ENTRY, handle)
+
+        elif tokens[0] == 'table_delete':
+            if not self.tables[tokens[1]].delete(tokens[2:]):
+                return 'Invalid table operation (INVALID_HANDLE)'
+            return ''
+
+        elif tokens[0] == 'table_clear':
+            self.tables[tokens[1]].clear()
+            return ''
+
+        elif tokens[0] == 'register_read':
+            return '%s[%s]= %i' % (tokens[1], tokens[2], self.read(tokens[1], int(tokens[2])))
+
+        elif tokens[0] == 'register_write':
+            self.write(tokens[1], int(tokens[2]), int(tokens[3], 0))
+            return ''
+
+        elif tokens[0] == 'register_reset':
+            self.reset(tokens[1])
+            return ''
+
+        elif tokens[0] in ['set_crc16_parameters', 'set_crc32_parameters']:
+            width = 16 if tokens[0] == 'set_crc16_parameters' else 32
+            polynomial, initial, final_xor = [int(value, 0) for value in tokens[2:5]]
+            reflect_data, reflect_remainder = [value.lower() == 'true' for value in tokens[5:7]]
+            if reflect_data != reflect_remainder:
+                return 'Invalid crc parameters, the data and the remainder are either both reflected or not'
+            self.hash_functions[tokens[1]] = get_crc_function(width, polynomial, initial, final_xor, reflect_data)
+            return ''
+
+        elif tokens[0] == 'mirroring_add':
+            self.mirror_sessions[int(tokens[1])] = int(tokens[2])
+            return ''
+
+        elif tokens[0] == 'reset_state':
+            for table in self.tables.values():
+                table.clear()
+            for register in self.registers:
+                self.reset(register)
+            return ''
+
+        self.logger.error('unsupported command: %s' % command)
+        return 'Unknown command'
+
+    def get_action(self, action_name):
+        if action_name not in self.compiled_actions:
+            self.compile_action(self.actions[action_name])
+
+    # REGISTERS, AS READ BY THE EMITTER
+    def read(self, register, index):
+        return self.registers[register][index]
+
+    def read_all(self, register):
+        return list(self.registers[register])
+
+    def write(self, register, index, value):
+        self.registers[register][index] = value & ((1 << self.register_widths[register]) - 1)
+
+    def reset(self, register):
+        # in place, the compiled primitives hold the arrays
+        values = self.registers[register]
+        values[:] = [0] * len(values)
+
+    def read_and_reset(self, register, indexes):
+        # only the indexes read, as the RegisterClient of the emitter
+        values = self.registers[register]
+        output = {}
+        for index in indexes:
+            if values[index] != 0:
+                output[index] = values[index]
+                values[index] = 0
+        return output
@@ -5,11 +5,15 @@
 from collections import namedtuple
 from threading import Thread
 import logging
+import os
 from emitter.emitter import Emitter
+from emitter.sharded_emitter import ShardedEmitter
 from p4_application import P4Application
 from p4_dataplane import P4DataPlane
+from p4_operators import REGISTER_BANKS
 from sonata.dataplane_driver.utils import get_logger
 from sonata.dataplane_driver.utils import write_to_file
+from sonata.compilation_cache import get_compilation_cache, get_cache_key, get_file_version, CACHE_MAX_ENTRIES
 
 
 Operator = namedtuple('Operator', 'name keys')
@@ -24,6 +28,9 @@ class P4Target(object):
         self.JSON_P4_COMPILED = self.COMPILED_SRCS + target_conf['json_p4_compiled']
         self.P4_COMPILED = self.COMPILED_SRCS + target_conf['p4_compiled']
         self.P4C_BM_SCRIPT = target_conf['p4c_bm_script']
+        # compiled p4 json of previously seen p4 programs, p4c is skipped for them
+        self.compile_cache = get_compilation_cache(target_conf.get('cache_dir'),
+                                                   target_conf.get('cache_max_entries', CACHE_MAX_ENTRIES))
         self.internal_interfaces = internal_interfaces
         # Initialization of Switch
         self.BMV2_PATH = target_conf['bmv2_path']
@@ -61,6 +68,9 @@ class P4Target(object):
 
         # p4 app object
         self.app = None
+        self.emitter = None
+        # epoch of the current window, its register bank is the one the packets update
+        self.epoch = 0
         print "P4 target initialized"
 
     def get_supported_operators(self):
@@ -82,9 +92,25 @@ class P4Target(object):
         write_to_file(self.P4_COMMANDS, commands_string)
 
         # compile p4 to json
-        self.logger.info('compile p4 code to json')
-        # TODO: uncomment this line
-        self.dataplane.compile_p4(self.P4_COMPILED, self.JSON_P4_COMPILED)
+        compile_key = get_cache_key('p4c', p4_src, get_file_version(self.P4C_BM_SCRIPT))
+        cached = None
+        if self.compile_cache is not None:
+            cached = self.compile_cache.get(compile_key)
+        if cached is not None:
+            self.logger.info('compiled p4 json found in the cache, skipping p4c')
+            write_to_file(self.JSON_P4_COMPILED, cached['compiled.json'])
+        else:
+            self.logger.info('compile p4 code to json')
+            # the json of the previous program must not pass for the output of a failed p4c
+            if os.path.exists(self.JSON_P4_COMPILED):
+                os.remove(self.JSON_P4_COMPILED)
+            success = self.dataplane.compile_p4(self.P4_COMPILED, self.JSON_P4_COMPILED)
+            if not success or not os.path.exists(self.JSON_P4_COMPILED):
+                raise RuntimeError('p4c failed to compile %s to %s' % (self.P4_COMPILED, self.JSON_P4_COMPILED))
+            if self.compile_cache is not None:
+                with open(self.JSON_P4_COMPILED) as f:
+                    self.compile_cache.put(compile_key, {'compiled.p4': p4_src, 'compiled.json': f.read(),
+                                                         'commands.txt': commands_string})
 
         # initialize dataplane and run the configuration
         self.logger.info('initialize the dataplane with the json configuration')
@@ -94,20 +120,46 @@ class P4Target(object):
         # start the emitter
         if self.em_conf:
             self.logger.info('start the emitter')
-            em = Emitter(self.em_conf, self.app.get_header_formats())
+            if self.em_conf.get('workers', 1) > 1:
+                em = ShardedEmitter(self.em_conf, self.app.get_header_formats())
+            else:
+                em = Emitter(self.em_conf, self.app.get_header_formats())
+            self.emitter = em
             em_thread = Thread(name='emitter', target=em.start)
             em_thread.setDaemon(True)
             em_thread.start()
 
     def update(self, filter_update):
         self.logger.info('update')
-        # Reset the data plane registers/tables before pushing the new delta config
+        # Start the new window on the other register bank, instead of resetting the whole switch state
         # self.dataplane.reset_switch_state()
+        old_epoch = self.epoch
+        self.swap_epoch()
 
         # Get the commands to add new filter flow rules
         commands = self.app.get_update_commands(filter_update)
         commands_string = "\n".join(commands)
         write_to_file(self.P4_DELTA_COMMANDS, commands_string)
-        self.dataplane.send_commands(self.JSON_P4_COMPILED, self.P4_COMMANDS)
-        self.dataplane.send_commands(self.JSON_P4_COMPILED, self.P4_DELTA_COMMANDS)
+        delta = self.dataplane.send_delta_commands(self.JSON_P4_COMPILED, commands)
+        self.logger.info('sent %i of %i delta commands' % (len(delta), len(commands)))
+
+        drain_thread = Thread(name='drain_epoch', target=self.drain_epoch, args=(old_epoch,))
+        drain_thread.setDaemon(True)
+        drain_thread.start()
+
+    def swap_epoch(self):
+        """
+        Flips the epoch with a single default action, the packets of the new window update the other register bank
+        """
+        self.epoch = (self.epoch + 1) % REGISTER_BANKS
+        self.dataplane.send_delta_commands(self.JSON_P4_COMPILED, [self.app.get_epoch_command(self.epoch)])
+        if self.emitter is not None and REGISTER_BANKS > 1:
+            # the emitter drains the registers it reads from the bank of the previous window
+            self.emitter.set_epoch(self.epoch)
+
+    def drain_epoch(self, epoch):
+        # reset the registers of the previous window that the emitter does not read, before their bank is used again
+        commands = self.app.get_epoch_reset_commands(epoch)
+        self.dataplane.send_delta_commands(self.JSON_P4_COMPILED, commands)
+        self.logger.info('reset %i registers of epoch %i' % (len(commands), epoch))
 
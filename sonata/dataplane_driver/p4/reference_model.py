@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# Author: Arpit Gupta (arpitg@cs.princeton.edu)
+
+"""
+Python reference model of the data plane operators, to check them against a pcap without a switch. The hashes
+follow bmv2: the fields of a field list are concatenated big-endian into bytes, crc16 is CRC-16/ARC, crc32 the
+zlib CRC-32 and crc32_custom the CRC-32 of the polynomial set for the calculation, truncated to the output width.
+"""
+
+import struct
+import zlib
+
+from p4_operators import CRC32_FINAL_XOR, CRC32_INITIAL, FINGERPRINT_SIZE, REGISTER_INSTANCE_COUNT, REGISTER_WIDTH
+from p4_operators import get_crc32_polynomial
+
+
+def reflect_bits(value, width):
+    out = 0
+    for _ in range(width):
+        out = (out << 1) | (value & 1)
+        value >>= 1
+    return out
+
+
+def get_crc_function(width, polynomial, initial, final_xor, reflect):
+    """
+    Returns the function computing a CRC of width bits with the parameters of the crc16_custom and crc32_custom
+    calculations of bmv2 (polynomial in normal form), the data and the remainder being both reflected or not
+    """
+    mask = (1 << width) - 1
+    table = []
+    if reflect:
+        reflected_polynomial = reflect_bits(polynomial, width)
+        for byte in range(256):
+            crc = byte
+            for _ in range(8):
+                crc = (crc >> 1) ^ reflected_polynomial if crc & 1 else crc >> 1
+            table.append(crc)
+        reflected_initial = reflect_bits(initial, width)
+
+        def compute_crc(data):
+            crc = reflected_initial
+            for byte in bytearray(data):
+                crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+            return crc ^ final_xor
+    else:
+        top_bit = 1 << (width - 1)
+        for byte in range(256):
+            crc = byte << (width - 8)
+            for _ in range(8):
+                crc = ((crc << 1) ^ polynomial) & mask if crc & top_bit else (crc << 1) & mask
+            table.append(crc)
+
+        def compute_crc(data):
+            crc = initial
+            for byte in bytearray(data):
+                crc = ((crc << 8) & mask) ^ table[((crc >> (width - 8)) ^ byte) & 0xff]
+            return crc ^ final_xor
+    return compute_crc
+
+
+def get_crc32_custom(polynomial):
+    return get_crc_function(32, polynomial, CRC32_INITIAL, CRC32_FINAL_XOR, True)
+
+
+crc16 = get_crc_function(16, 0x8005, 0, 0, True)
+
+
+def crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+# the custom calculations compute the standard CRCs until their parameters are set
+HASH_ALGORITHMS = {'crc16': crc16, 'crc32': crc32, 'crc16_custom': crc16, 'crc32_custom': crc32}
+
+
+def pack_fields(values, sizes):
+    """
+    Concatenates the values of the fields (sizes in bits) big-endian, padded with zeros to whole bytes
+    """
+    data = 0
+    n_bits = 0
+    for value, size in zip(values, sizes):
+        data = (data << size) | (int(value) & ((1 << size) - 1))
+        n_bits += size
+    n_bytes = (n_bits + 7) // 8
+    data <<= n_bytes * 8 - n_bits
+    return ('%0*x' % (n_bytes * 2, data)).decode('hex')
+
+
+# struct codes of the fields that are whole bytes
+FIELD_SIZE_TO_FORMAT = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}
+
+
+def get_fields_packer(sizes):
+    """
+    Returns the function packing the values of fields of these sizes as pack_fields does, with a struct if all
+    the fields are whole bytes
+    """
+    if not all([size in FIELD_SIZE_TO_FORMAT for size in sizes]):
+        return lambda values: pack_fields(values, sizes)
+    packer = struct.Struct('>' + ''.join([FIELD_SIZE_TO_FORMAT[size] for size in sizes]))
+    return lambda values: packer.pack(*values)
+
+
+def get_hash(algorithm, values, sizes, output_width):
+    return HASH_ALGORITHMS[algorithm](pack_fields(values, sizes)) & ((1 << output_width) - 1)
+
+
+def get_hash_offset(base, hash_value, size):
+    # modify_field_with_hash_based_offset
+    return base + hash_value % size
+
+
+class PacketParser(object):
+    """
+    Parses a frame into target field name -> value, walking the layers of the SonataRawFields from the root
+    layer as the P4 parser does. Payload layers are not parsed.
+    """
+    def __init__(self, p4_raw_fields):
+        self.root_layer = p4_raw_fields.root_layer
+        # layer name -> (size in bytes, [(target name, shift, mask)], field selecting the child, value -> child)
+        self.layers = {}
+        for layer in p4_raw_fields.layers:
+            n_bits = sum([fld.size for fld in layer.fields])
+            fields = []
+            shift = n_bits
+            for fld in layer.fields:
+                shift -= fld.size
+                fields.append((fld.target_name, shift, (1 << fld.size) - 1))
+            child_field = None
+            if layer.field_that_determines_child is not None:
+                child_field = layer.fields[int(layer.field_that_determines_child)].target_name
+            child_layers = dict((int(key, 0), child) for key, child in layer.child_layers.items())
+            self.layers[layer.name] = (n_bits // 8, fields, child_field, child_layers)
+
+    def parse(self, frame):
+        values = {}
+        offset = 0
+        layer = self.root_layer
+        while layer is not None and not layer.is_payload and layer.fields:
+            n_bytes, fields, child_field, child_layers = self.layers[layer.name]
+            if len(frame) < offset + n_bytes:
+                break
+            header = int(frame[offset:offset + n_bytes].encode('hex'), 16)
+            for target_name, shift, mask in fields:
+                values[target_name] = (header >> shift) & mask
+            offset += n_bytes
+            if child_field is None:
+                break
+            layer = child_layers.get(values[child_field])
+        return values
+
+
+def get_increment(operator, values):
+    if operator.values[0] == 'count':
+        return 1
+    return values[operator.p4_raw_fields.get_target_field(operator.values[0]).target_name]
+
+
+class HashPipeReduceModel(object):
+    """
+    Model of a P4HashPipeReduce: process() takes the metadata of a packet (target name -> value, qid included)
+    and the epoch, and returns the (index, overflow) fields of its out header, None if the packet is dropped. The
+    registers are read and reset by name as with the RegisterClient of the emitter, which resets only the indexes
+    it reads.
+    """
+    def __init__(self, operator):
+        self.operator = operator
+        self.key_names = [fld.target_name for fld in operator.key_fields]
+        self.pack = get_fields_packer([fld.size for fld in operator.key_fields])
+        self.index_mask = (1 << operator.index_bits) - 1
+        self.hashes = [get_crc32_custom(get_crc32_polynomial(stage)) for stage in range(operator.n_stages)]
+        self.fingerprint_hash = get_crc32_custom(get_crc32_polynomial(operator.n_stages))
+        # epoch -> names of the registers of the stages
+        self.fingerprint_registers = [[register.get_name() for register in registers]
+                                      for registers in operator.fingerprint_registers]
+        self.count_registers = [[register.get_name() for register in registers]
+                                for registers in operator.count_registers]
+        self.registers = dict((name, [0] * operator.width)
+                              for names in self.fingerprint_registers + self.count_registers for name in names)
+
+    def get_fingerprint(self, key):
+        fp_hash = self.fingerprint_hash(self.pack(key)) & ((1 << FINGERPRINT_SIZE) - 1)
+        return get_hash_offset(1, fp_hash, 2 ** FINGERPRINT_SIZE - 1)
+
+    def get_indexes(self, key):
+        data = self.pack(key)
+        return [get_hash_offset(0, stage_hash(data) & self.index_mask, self.operator.width)
+                for stage_hash in self.hashes]
+
+    def process(self, values, epoch=0):
+        key = [values[name] for name in self.key_names]
+        increment = threshold = get_increment(self.operator, values)
+
+        fingerprint = self.get_fingerprint(key)
+        for stage, index in enumerate(self.get_indexes(key)):
+            fingerprints = self.registers[self.fingerprint_registers[epoch][stage]]
+            if fingerprints[index] == fingerprint or fingerprints[index] == 0:
+                counts = self.registers[self.count_registers[epoch][stage]]
+                fingerprints[index] = fingerprint
+                counts[index] = (counts[index] + increment) & ((1 << REGISTER_WIDTH) - 1)
+                if counts[index] == threshold:
+                    return index + stage * self.operator.width + epoch * REGISTER_INSTANCE_COUNT, 0
+                return None
+        return 0, 1
+
+    def reset(self, register):
+        self.registers[register] = [0] * len(self.registers[register])
+
+    def read_and_reset(self, register, indexes):
+        values = self.registers[register]
+        output = {}
+        for index in indexes:
+            if values[index] != 0:
+                output[index] = values[index]
+                values[index] = 0
+        return output
+
+
+class CMSReduceModel(object):
+    """
+    Model of a P4CMSReduce: process() takes the metadata of a packet and the epoch, and returns the count field of
+    its out header, None if the packet is dropped
+    """
+    def __init__(self, operator):
+        self.operator = operator
+        self.key_names = [fld.target_name for fld in operator.key_fields]
+        self.pack = get_fields_packer([fld.size for fld in operator.key_fields])
+        self.hashes = [get_crc32_custom(get_crc32_polynomial(row)) for row in range(operator.depth)]
+        self.index_mask = (1 << operator.index_bits) - 1
+        # epoch -> names of the registers of the rows
+        self.row_registers = [[register.get_name() for register in registers] for registers in operator.registers]
+        self.registers = dict((name, [0] * operator.width) for names in self.row_registers for name in names)
+
+    def get_indexes(self, key):
+        data = self.pack(key)
+        return [(row_hash(data) & self.index_mask) % self.operator.width for row_hash in self.hashes]
+
+    def process(self, values, epoch=0):
+        increment = threshold = get_increment(self.operator, values)
+        counts = list()
+        for name, index in zip(self.row_registers[epoch], self.get_indexes([values[name] for name in self.key_names])):
+            register = self.registers[name]
+            register[index] = (register[index] + increment) & ((1 << REGISTER_WIDTH) - 1)
+            counts.append(register[index])
+        count = min(counts)
+        if count == threshold:
+            return count
+        elif count > threshold:
+            return 1
+        return None
+
+    def reset(self, register):
+        self.registers[register] = [0] * len(self.registers[register])
+
+
+class BloomDistinctModel(object):
+    """
+    Model of a P4BloomDistinct: process() takes the metadata of a packet and the epoch, and returns whether it
+    passes, i.e. whether any of its bits was unset
+    """
+    def __init__(self, operator):
+        self.operator = operator
+        self.key_names = [fld.target_name for fld in operator.key_fields]
+        self.pack = get_fields_packer([fld.size for fld in operator.key_fields])
+        self.hashes = [get_crc32_custom(get_crc32_polynomial(row)) for row in range(operator.n_hashes)]
+        self.index_mask = (1 << operator.index_bits) - 1
+        # epoch -> names of the registers of the hashes
+        self.bit_registers = [[register.get_name() for register in registers] for registers in operator.registers]
+        self.registers = dict((name, [0] * operator.width) for names in self.bit_registers for name in names)
+
+    def get_indexes(self, key):
+        data = self.pack(key)
+        return [(row_hash(data) & self.index_mask) % self.operator.width for row_hash in self.hashes]
+
+    def process(self, values, epoch=0):
+        passes = False
+        for name, index in zip(self.bit_registers[epoch], self.get_indexes([values[name] for name in self.key_names])):
+            register = self.registers[name]
+            if register[index] == 0:
+                passes = True
+                register[index] = 1
+        return passes
+
+    def reset(self, register):
+        self.registers[register] = [0] * len(self.registers[register])
@@ -52,6 +52,9 @@ def get_clean_application(application):
                 new_o = Distinct()
                 new_o.keys = keys
                 new_o.values = operator.values
+                new_o.bloom_bits = getattr(operator, 'bloom_bits', 0)
+                new_o.bloom_hashes = getattr(operator, 'bloom_hashes', 0)
+                new_o.cardinality = getattr(operator, 'cardinality', 0)
                 new_o.prev_keys = operator.prev_keys
                 new_o.prev_values = operator.prev_values
             elif operator.name == 'Filter':
@@ -74,6 +77,8 @@ def get_clean_application(application):
                 new_o.prev_keys = operator.prev_keys
                 new_o.prev_values = operator.prev_values
                 new_o.func = operator.func
+                new_o.cms_bits = getattr(operator, 'cms_bits', 0)
+                new_o.stages = getattr(operator, 'stages', 0)
                 if index < len(query.operators)-1:
                     next_operator = query.operators[index + 1]
 
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import pickle
+import socket
+import time
+from multiprocessing.connection import Client, Listener
+from threading import Thread, Lock, Event, BoundedSemaphore
+
+"""
+Persistent connections between the runtime, the streaming driver and the dataplane driver.
+Each message is sent as (request id, message) and answered with (request id, reply) once the
+receiver handled it, so a sender waits for the acknowledgement of its request instead of sleeping,
+and at most max_pending messages of a client are in flight at a time.
+"""
+
+CONNECT_RETRY_INTERVAL = 0.1
+CONNECT_TIMEOUT = 60
+MAX_PENDING = 4
+
+
+class MessageClient(object):
+    def __init__(self, address, max_pending=MAX_PENDING, connect_timeout=CONNECT_TIMEOUT):
+        self.address = tuple(address)
+        self.connect_timeout = connect_timeout
+        self.conn = None
+        self.next_id = 0
+        # request id -> [event, reply]
+        self.pending = dict()
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(max_pending)
+
+    def connect(self):
+        # the other end may not listen yet, retry until it does
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                self.conn = Client(self.address)
+                break
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(CONNECT_RETRY_INTERVAL)
+        reader_thread = Thread(name='message_client_reader', target=self.read_replies, args=(self.conn,))
+        reader_thread.setDaemon(True)
+        reader_thread.start()
+
+    def read_replies(self, conn):
+        while True:
+            try:
+                request_id, reply = conn.recv()
+            except (EOFError, IOError):
+                break
+            with self.lock:
+                waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter[1] = reply
+                waiter[0].set()
+                self.slots.release()
+
+        # connection lost, release the senders still waiting and reconnect on the next send
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+            waiters = self.pending.values()
+            self.pending = dict()
+        for waiter in waiters:
+            waiter[0].set()
+            self.slots.release()
+
+    def send(self, message):
+        """
+        Sends the message without waiting for its reply, blocks while max_pending messages are in flight
+        """
+        self.slots.acquire()
+        with self.lock:
+            if self.conn is None:
+                try:
+                    self.connect()
+                except socket.error:
+                    self.slots.release()
+                    raise
+            request_id = self.next_id
+            self.next_id += 1
+            waiter = [Event(), None]
+            self.pending[request_id] = waiter
+            self.conn.send((request_id, message))
+        return waiter
+
+    def request(self, message, timeout=None):
+        """
+        Sends the message and returns the reply of the receiver once it handled it
+        """
+        waiter = self.send(message)
+        waiter[0].wait(timeout)
+        return waiter[1]
+
+
+class MessageServer(object):
+    """
+    Accepts persistent connections and calls handler(message) for every message, one at a time,
+    replying with what it returns. Clients that send a single pickled message per connection are
+    still served, they only get a reply if the handler returns one.
+    """
+    def __init__(self, address, handler):
+        self.address = tuple(address)
+        self.handler = handler
+        self.handler_lock = Lock()
+        self.listener = Listener(self.address)
+
+    def serve_forever(self):
+        while True:
+            conn = self.listener.accept()
+            conn_thread = Thread(name='message_server_conn', target=self.serve_connection, args=(conn,))
+            conn_thread.setDaemon(True)
+            conn_thread.start()
+
+    def serve_connection(self, conn):
+        while True:
+            try:
+                data = conn.recv()
+            except (EOFError, IOError):
+                break
+            if isinstance(data, tuple):
+                request_id, message = data
+                with self.handler_lock:
+                    reply = self.handler(message)
+                conn.send((request_id, reply))
+            else:
+                with self.handler_lock:
+                    reply = self.handler(pickle.loads(data))
+                if reply is not None:
+                    conn.send(reply)
+        conn.close()
+
+
+def receive_request(listener):
+    """
+    Waits for a single request on the listener, returns (connection, request id, message)
+    """
+    conn = listener.accept()
+    request_id, message = conn.recv()
+    return conn, request_id, message
+
+
+def send_reply(conn, request_id, reply):
+    conn.send((request_id, reply))
+
+
+clients = dict()
+clients_lock = Lock()
+
+
+def get_client(address):
+    """
+    Returns the shared client for the address, created on first use
+    """
+    address = tuple(address)
+    with clients_lock:
+        if address not in clients:
+            clients[address] = MessageClient(address)
+        return clients[address]
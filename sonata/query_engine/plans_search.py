@@ -5,7 +5,6 @@
 import random
 import sys
 import time
-import networkx as nx
 
 def swap(input, ind1, ind2):
     tmp = input[ind2]
@@ -61,13 +60,6 @@ def generate_costs(p1, p2, ref_levels):
     # print costs
     return costs
 
-def get_plan_cost(plan, cost=0):
-    if len(plan) > 1:
-        cost += costs[tuple([plan[0], plan[1]])] + get_plan_cost(plan[1:], cost)
-    else:
-        return 0
-    return cost
-
 def generate_query_tree(depth, all_queries, qid=1):
     query_tree = {}
 
@@ -84,231 +76,152 @@ def generate_query_tree(depth, all_queries, qid=1):
     return query_tree
 
 
-def get_possibility_space(start_level, final_level, ref_levels, plans):
-    possibility_space = []
-    for plan_id in plans:
-        for elem in ref_levels:
-            if elem > final_level:
-                break
-            elif elem > start_level:
-                possibility_space.append((plan_id, elem))
-    return possibility_space
+def get_transitions(costs):
+    """
+    Returns the transitions into each (plan_id, elem) state, as {(plan_id, elem): [(prev_plan_id, prev, cost)]}
+    """
+    transitions = {}
+    for ((prev_plan_id, plan_id), (prev, elem)), cost in costs.iteritems():
+        if (plan_id, elem) not in transitions:
+            transitions[(plan_id, elem)] = []
+        transitions[(plan_id, elem)].append((prev_plan_id, prev, cost))
+    return transitions
 
 
-def check_transit(prev, elem, costs):
-    # TODO Make this more reasonable
-    if (tuple([prev, elem])) in costs:
-        return True
-    else:
-        return False
+class RefinementPlanner(object):
+    """
+    Bottom-up dynamic program over the (query, refinement level, partition plan) states. For a query and the
+    level its refinement starts from, the states are visited by increasing refinement level: the cost of a state
+    is that of the cheapest transit into it, plus the cost of refining the child queries over that transit. Each
+    state keeps a back-pointer to the state it comes from, the plans are only built for the chosen states.
+    """
+    def __init__(self, ref_levels, query_2_plans, query_2_cost, tables=None):
+        self.ref_levels = sorted(ref_levels)
+        self.root = self.ref_levels[0]
+        self.query_2_plans = query_2_plans
+        self.query_2_transitions = dict((qid, get_transitions(query_2_cost[qid])) for qid in query_2_cost)
+        self.query_2_children = {}
+        self.children_costs = {}
+        # (qid, start) -> (dist, parent) for all the states of the query
+        self.tables = {} if tables is None else tables
+
+    def add_query_tree(self, query_tree):
+        for qid, subtree in query_tree.iteritems():
+            # children without any partition plan are not refined
+            self.query_2_children[qid] = [child for child in sorted(subtree) if len(self.query_2_plans[child]) > 0]
+            self.add_query_tree(subtree)
+
+    def get_table(self, qid, start):
+        if (qid, start) in self.tables:
+            return self.tables[(qid, start)]
+
+        plans = self.query_2_plans[qid]
+        transitions = self.query_2_transitions.get(qid, {})
+        initial_state = (plans[0], self.root)
+        dist = {initial_state: 0}
+        parent = {initial_state: None}
+        for elem in self.ref_levels:
+            if elem <= start:
+                continue
+            for plan_id in plans:
+                state = (plan_id, elem)
+                for prev_plan_id, prev, cost in transitions.get(state, []):
+                    prev_state = (prev_plan_id, prev)
+                    if prev >= elem or prev_state not in dist:
+                        continue
+                    candidate = dist[prev_state] + cost + self.get_children_cost(qid, prev, elem)
+                    if state not in dist or candidate < dist[state]:
+                        dist[state] = candidate
+                        parent[state] = prev_state
+
+        self.tables[(qid, start)] = (dist, parent)
+        return dist, parent
+
+    def get_best_state(self, qid, start, final):
+        """
+        Returns the cheapest (plan_id, final) state reachable from start, and its cost
+        """
+        dist, _ = self.get_table(qid, start)
+        best_state, min_cost = None, sys.maxint
+        for plan_id in self.query_2_plans[qid]:
+            if (plan_id, final) in dist and dist[(plan_id, final)] < min_cost:
+                best_state, min_cost = (plan_id, final), dist[(plan_id, final)]
+        return best_state, min_cost
+
+    def get_children_cost(self, qid, prev, elem):
+        if (qid, prev, elem) not in self.children_costs:
+            self.children_costs[(qid, prev, elem)] = sum(self.get_best_state(child, prev, elem)[1]
+                                                         for child in self.query_2_children[qid])
+        return self.children_costs[(qid, prev, elem)]
+
+    def get_plan(self, qid, start, final):
+        state, min_cost = self.get_best_state(qid, start, final)
+        final_plan = []
+        if state is not None:
+            _, parent = self.get_table(qid, start)
+            while state is not None:
+                final_plan.append(state)
+                state = parent[state]
+            final_plan.reverse()
+        return final_plan, min_cost
+
+    def add_final_plans(self, qid, start, final, query_2_final_plan):
+        """
+        Adds the plan of qid, and those of its children for each transit of this plan, to query_2_final_plan
+        """
+        final_plan, min_cost = self.get_plan(qid, start, final)
+        if qid not in query_2_final_plan:
+            query_2_final_plan[qid] = {}
+        query_2_final_plan[qid][final] = (final_plan, min_cost)
+        for (_, prev), (_, elem) in zip(final_plan, final_plan[1:]):
+            for child in self.query_2_children[qid]:
+                self.add_final_plans(child, prev, elem, query_2_final_plan)
+        return final_plan, min_cost
 
 
 def get_refinement_plan(start_level, final_level, query_id, ref_levels, query_2_plans, query_tree, query_2_cost,
                         query_2_final_plan, memoized_plans):
-    # print "Function called for", query_id, final_level, subtree
-    root = 0
-
-    node_2_plan = {}
-    node_2_all_plans = {}
-    plan_2_cost = {}
-    explore_further = {}
-    # Enumerate the possibility space given the final level
-    possibility_space = get_possibility_space(start_level, final_level, ref_levels, query_2_plans[query_id])
-    subtree = query_tree[query_id]
-    costs = query_2_cost[query_id]
-    levels = range(root, len(possibility_space) + 1)
-    plans = query_2_plans[query_id]
-
-    for curr_level in levels:
-
-        if curr_level == 0:
-            explore_further[curr_level] = {(plans[0], root): 0}
-            node_2_all_plans[curr_level] = {}
-            node_2_all_plans[curr_level][(plans[0], 0)] = [(plans[0], 0)]
-
-        next_level = curr_level + 1
-        if curr_level in explore_further:
-            # print curr_level, explore_further
-            explore_further[next_level] = {}
-            for prev_plan_id, prev in explore_further[curr_level]:
-                for plan_id, elem in possibility_space:
-                    is_transit_allowed = False
-                    if ((prev_plan_id, plan_id), (prev, elem)) in costs:
-                        is_transit_allowed = True
-                    # print curr_level, (prev_plan_id, plan_id), (prev,elem), is_transit_allowed
-                    if is_transit_allowed:
-                        # print curr_level, prev, elem, is_transit_allowed
-                        candidate_plan_cost = 0
-                        if len(subtree.keys()) > 0:
-                            # Explore the refinement plan for each child tree of this query
-                            for qid in subtree:
-                                if len(query_2_plans[qid]) > 0:
-                                    if qid not in memoized_plans:
-                                        memoized_plans[qid] = {}
-                                    if elem not in memoized_plans[qid]:
-                                        fp, cst = get_refinement_plan(prev, elem, qid, ref_levels, query_2_plans,
-                                                                      subtree, query_2_cost, query_2_final_plan,
-                                                                      memoized_plans)
-                                        memoized_plans[qid][(prev, elem)] = (fp, cst)
-                                    else:
-                                        # We don't need to explore again the subtree for same refinement level
-                                        (fp, cst) = memoized_plans[qid][(prev, elem)]
-
-                                    # Add the cost of refining the subtree to this refinement plan's cost
-                                    candidate_plan_cost += cst
-                                    # print qid, fp, cst
-
-                        prev_plan = node_2_all_plans[curr_level][(prev_plan_id, prev)]
-                        if tuple(prev_plan) in plan_2_cost:
-                            prev_plan_cost = plan_2_cost[tuple(prev_plan)]
-                        else:
-                            prev_plan_cost = get_plan_cost(tuple(prev_plan))
-
-                        cand_plan = prev_plan + [(plan_id, elem)]
-                        candidate_plan_cost += costs[((prev_plan_id, plan_id), (prev, elem))] + prev_plan_cost
-                        if (plan_id, elem) not in node_2_plan:
-                            node_2_plan[(plan_id, elem)] = cand_plan
-                            explore_further[next_level][(plan_id, elem)] = 0
-                        else:
-
-                            curr_cost = plan_2_cost[tuple(node_2_plan[(plan_id, elem)])]
-                            new_cost = candidate_plan_cost
-                            # print "For Query", query_id, final_level
-                            # print "Current Plan:", node_2_plan[(plan_id, elem)]," Cost:", plan_2_cost[tuple(node_2_plan[(plan_id, elem)])]
-                            # print "New Plan:", curr_plan, " Cost:", curr_plan_cost
-                            if new_cost < curr_cost:
-                                # We need to update the plan for this node
-                                # print "Updating Plan for Node", elem
-                                node_2_plan[(plan_id, elem)] = cand_plan
-                                explore_further[next_level][(plan_id, elem)] = 0
-
-                        if next_level not in node_2_all_plans:
-                            node_2_all_plans[next_level] = {}
-                        node_2_all_plans[next_level][(plan_id, elem)] = cand_plan
-
-                        # print curr_plan, curr_plan_cost, node_2_plan
-                        # print tuple(curr_plan)
-                        plan_2_cost[tuple(cand_plan)] = candidate_plan_cost
-    # print node_2_plan
-    min_cost = sys.maxint
-    final_plan = []
-    for (plan, elem) in node_2_plan:
-        # print final_level, elem, elem == final_level
-        if elem == final_level:
-            candidate_plan = node_2_plan[(plan, elem)]
-            cost = plan_2_cost[tuple(candidate_plan)]
-            # print "Final Candidate Plans", candidate_plan, cost
-            if cost < min_cost:
-                final_plan = candidate_plan
-                min_cost = cost
-
-    # print "Final plan", final_plan, " cost", min_cost
-    if query_id not in query_2_final_plan:
-        query_2_final_plan[query_id] = {}
-    query_2_final_plan[query_id][final_level] = (final_plan, min_cost)
-
-    # print query_id, final_level, final_plan, min_cost
-    return (final_plan, min_cost)
-
-
-def get_refplan_dijkstra():
-    pass
+    """
+    Returns (final_plan, cost) for query_id, the cheapest list of (plan_id, ref_level) from start_level to
+    final_level, and adds it and the plans of its sub queries to query_2_final_plan. memoized_plans keeps the
+    dynamic program tables across the calls with the same costs.
+    """
+    planner = RefinementPlanner(ref_levels, query_2_plans, query_2_cost, memoized_plans)
+    planner.add_query_tree({query_id: query_tree[query_id]})
+    return planner.add_final_plans(query_id, start_level, final_level, query_2_final_plan)
 
 
 if __name__ == '__main__':
-    # print node_2_plan
-    memorized_plans = {}
     # Tuning parameters
-    query_tree_depth = 0
-    max_plans = 1
+    query_tree_depth = 2
+    max_plans = 3
     ref_levels = range(0, 33, 8)
 
-    a = ref_levels
-    plans = range(1, 4)
-
-    query_tree = {}
     all_queries = [1]
-
     # Binary tree representing query tree
-    query_tree[1] = generate_query_tree(query_tree_depth, all_queries)
-
+    query_tree = {1: generate_query_tree(query_tree_depth, all_queries)}
     all_queries.sort()
-    # print all_queries
-    # print query_tree
 
-    # query_tree = {1:{2:{}, 3:{}}}
     query_2_cost = {}
     query_2_plans = {}
     query_2_final_plan = {}
     for query_id in all_queries:
-        if query_id not in query_2_cost:
-            query_2_cost[query_id] = {}
+        query_2_cost[query_id] = {}
         # randomly select number of plans, i.e. number of paths in the partition tree
         n_plans = random.randint(1, max_plans)
         query_2_plans[query_id] = range(1, n_plans + 1)
-        if query_id == 3:
-            n_plans = 0
-            query_2_plans[query_id] = []
-
-        for p1 in range(1, n_plans + 1):
-            for p2 in range(1, n_plans + 1):
+        for p1 in query_2_plans[query_id]:
+            for p2 in query_2_plans[query_id]:
                 # For each path combination for each query we generate cost using the cost function above.
-                tmp = generate_costs(ref_levels)
+                tmp = generate_costs(p1, p2, ref_levels)
                 for transit in tmp:
                     query_2_cost[query_id][(p1, p2), transit] = tmp[transit]
 
-    # print query_2_plans
-    # print query_2_cost
-    # print query_2_cost.keys()
     start = time.time()
-
     for query_id in query_tree:
         # We start with the finest refinement level, as expressed in the original query
-        final_plan, cost = get_refinement_plan(ref_levels[0], ref_levels[-1], query_id, ref_levels, query_2_plans,
-                                               query_tree, query_2_cost, query_2_final_plan, memorized_plans)
-
-        # Verify that the refinement search is not a complicated backtracking
-        # problem. Instead, it cab be mapped as a simple shortest path problem.
-        # TODO: update the get_refinement_plan() function to make it simpler
-        G = nx.DiGraph()
-        src_node = str('src')
-        G.add_node(src_node)
-        sink_node = str('sink')
-        G.add_node(sink_node)
-        query_id = 1
-
-        for ref_level in range(1, len(ref_levels) + 1):
-            for plan_id in query_2_plans[query_id]:
-                for dimension in ref_levels[1:]:
-                    node_name = str((ref_level, plan_id, dimension))
-                    G.add_node(node_name)
-                    print "Added node", node_name
-
-        for ref_level in range(1, len(ref_levels)):
-            for ((prev_plan, curr_plan), (prev_dim, curr_dim)) in query_2_cost[query_id]:
-                if prev_dim != 0 and curr_dim != 0:
-                    src = str((ref_level, prev_plan, prev_dim))
-                    dst = str((ref_level + 1, curr_plan, curr_dim))
-                    cost = query_2_cost[query_id][((prev_plan, curr_plan), (prev_dim, curr_dim))]
-                    G.add_edge(src, dst, cost=cost)
-                    print "Added edge", src, dst, cost
-
-        ref_level = 1
-        for plan_id in query_2_plans[query_id]:
-            for dimension in ref_levels[1:]:
-                dst = str((ref_level, plan_id, dimension))
-                cost = query_2_cost[query_id][((1, plan_id), (0, dimension))]
-                G.add_edge(src_node, dst, cost=cost)
-                print "Added edge", src_node, dst, cost
-
-        for ref_level in range(1, len(ref_levels) + 1):
-            for plan_id in query_2_plans[query_id]:
-                dimension = ref_levels[-1]
-                src = str((ref_level, plan_id, dimension))
-                G.add_edge(src, sink_node, cost=10)
-                print "Added edge", src, sink_node, 0
-
-        print(nx.shortest_path(G, source=src_node, target=sink_node, weight='cost'))
+        get_refinement_plan(ref_levels[0], ref_levels[-1], query_id, ref_levels, query_2_plans, query_tree,
+                            query_2_cost, query_2_final_plan, {})
 
     print query_2_final_plan
-    print "Took", time.time() - start, "seconds"
\ No newline at end of file
+    print "Took", time.time() - start, "seconds"
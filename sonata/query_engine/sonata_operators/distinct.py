@@ -16,6 +16,13 @@ class Distinct(Query):
         self.prev_values = ()
         self.keys = ()
         self.values = ()
+        # data plane bits for a Bloom filter instead of the exact register, 0 to keep the register
+        self.bloom_bits = 0
+        # hashes of the Bloom filter, 0 to size them for the cardinality
+        self.bloom_hashes = 0
+        # distinct keys per window in the training data, required with bloom_bits. Not set by the training, which
+        # only prints it
+        self.cardinality = 0
 
         if 'prev_keys' in map_dict:
             self.prev_keys = map_dict['prev_keys']
@@ -26,6 +33,12 @@ class Distinct(Query):
         else:
             self.keys = self.prev_keys
         self.values = ()
+        if 'bloom_bits' in map_dict:
+            self.bloom_bits = map_dict['bloom_bits']
+        if 'bloom_hashes' in map_dict:
+            self.bloom_hashes = map_dict['bloom_hashes']
+        if 'cardinality' in map_dict:
+            self.cardinality = map_dict['cardinality']
 
     def __repr__(self):
         return '.Distinct(keys=' + str(self.keys) + ')'
@@ -17,6 +17,11 @@ class Reduce(Query):
         self.values = ()
         self.func = ()
         self.threshold = 1
+        # data plane bits for a count-min sketch instead of the exact register, 0 to keep the register. Not set by
+        # the training, which only prints the size it estimates
+        self.cms_bits = 0
+        # stages of fingerprints and counts (HashPipe) for the queries reading the register, 0 or 1 to keep one
+        self.stages = 0
 
         if 'prev_keys' in map_dict:
             self.prev_keys = map_dict['prev_keys']
@@ -29,6 +34,10 @@ class Reduce(Query):
         self.values = self.prev_values
         if 'func' in map_dict:
             self.func = map_dict['func']
+        if 'cms_bits' in map_dict:
+            self.cms_bits = map_dict['cms_bits']
+        if 'stages' in map_dict:
+            self.stages = map_dict['stages']
 
     def get_init_keys(self):
         return self.keys + ('count', )
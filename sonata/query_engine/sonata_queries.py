@@ -10,6 +10,7 @@ from sonata.query_engine.sonata_operators.reduce import Reduce
 from sonata.query_engine.sonata_operators.filter import Filter
 
 from sonata.query_engine.utils import *
+import sonata.query_engine.plans_search as rs
 
 # from sonata.system_config import *
 
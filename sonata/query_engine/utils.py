@@ -108,11 +108,16 @@ def copy_operators(query, optr):
     elif optr.name == "Reduce":
         query.reduce(keys=optr.keys,
                      values=optr.values,
-                     func=optr.func)
+                     func=optr.func,
+                     cms_bits=getattr(optr, 'cms_bits', 0),
+                     stages=getattr(optr, 'stages', 0))
 
     elif optr.name == "Distinct":
         query.distinct(keys=optr.keys,
-                       values=optr.values)
+                       values=optr.values,
+                       bloom_bits=getattr(optr, 'bloom_bits', 0),
+                       bloom_hashes=getattr(optr, 'bloom_hashes', 0),
+                       cardinality=getattr(optr, 'cardinality', 0))
 
 
 def copy_sonata_operators_to_spark(query, optr):
@@ -124,6 +124,27 @@ class SonataRawFields(object):
     def get_target_field(self, sonata_field_name):
         return self.all_sonata_fields[sonata_field_name]
 
+def get_sonata_raw_fields(data, layer_2_target, initial_layer="ethernet"):
+    """
+    Builds the SonataRawFields of the layer tree described by fields_mapping.json (data)
+    """
+    initial_conf = data[initial_layer][layer_2_target[initial_layer]]
+    field_that_determines_child = None
+    if "field_that_determines_child" in initial_conf: field_that_determines_child = initial_conf["field_that_determines_child"]
+    layers = SonataLayer(initial_layer,
+                         data,
+                         fields=initial_conf["fields"],
+                         offset=initial_conf,
+                         parent_layer=None,
+                         child_layers=initial_conf["child_layers"],
+                         field_that_determines_child=field_that_determines_child,
+                         is_payload=initial_conf["in_payload"],
+                         layer_2_target=layer_2_target
+                         )
+
+    return SonataRawFields(layers)
+
+
 def test():
     INITIAL_LAYER = "ethernet"
     layer_2_target = {"ethernet": "bmv2",
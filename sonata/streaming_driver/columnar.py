@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+"""
+Columnar execution of the PacketStream operators for the native stream processor. The tuples of a
+window are turned into one NumPy array per field (IPs as uint32, ports as uint16, other numeric
+fields as int64) and Map, Reduce (sum), Distinct and Filter run on the arrays. The records it returns
+are the ones the compiled operators return on a WindowRDD. Reduce only sums computed values: the
+input fields are strings there, which x + y would concatenate.
+"""
+
+import socket
+import struct
+import numpy as np
+
+IP_STRUCT = struct.Struct('>I')
+
+# column kinds: input fields are sent back as strings, computed values as numbers
+KIND_IP = 'ip'
+KIND_PORT = 'port'
+KIND_INT = 'int'
+KIND_STR = 'str'
+KIND_NUM = 'num'
+
+
+class UnsupportedOperator(Exception):
+    pass
+
+
+def get_field_kind(field):
+    if 'IP' in field:
+        return KIND_IP
+    elif field.endswith('sport') or field.endswith('dport'):
+        return KIND_PORT
+    return KIND_INT
+
+
+def ip_to_int(ip):
+    return IP_STRUCT.unpack(socket.inet_aton(ip))[0]
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(IP_STRUCT.pack(int(value)))
+
+
+def to_column(values, kind):
+    if kind == KIND_IP:
+        return np.fromiter((ip_to_int(value) for value in values), dtype=np.uint32, count=len(values)), kind
+    try:
+        if kind == KIND_PORT:
+            return np.array(values, dtype=np.uint32).astype(np.uint16), kind
+        return np.array(values, dtype=np.int64), kind
+    except ValueError:
+        # not numeric, e.g. payload fields
+        return np.array(values, dtype=object), KIND_STR
+
+
+def from_column(column):
+    array, kind = column
+    if kind == KIND_IP:
+        return [int_to_ip(value) for value in array]
+    elif kind in (KIND_PORT, KIND_INT):
+        return [str(value) for value in array.tolist()]
+    return array.tolist()
+
+
+def group_codes(arrays):
+    """
+    Returns one int64 code per row, equal for the rows with the same values in all the arrays
+    """
+    codes = np.zeros(len(arrays[0]), dtype=np.int64)
+    for array in arrays:
+        uniques, inverse = np.unique(array, return_inverse=True)
+        codes = codes * len(uniques) + inverse
+        # keep the codes small enough for the next multiplication
+        _, codes = np.unique(codes, return_inverse=True)
+    return codes
+
+
+class ColumnBatch(object):
+    def __init__(self, columns, keys, values, size):
+        self.columns = columns
+        self.keys = list(keys)
+        self.values = list(values)
+        self.size = size
+
+    def take(self, indexes, keys, values):
+        columns = dict((fld, (self.columns[fld][0][indexes], self.columns[fld][1])) for fld in keys + values)
+        return ColumnBatch(columns, keys, values, len(indexes))
+
+
+class ColumnarQuery(object):
+    """
+    Runs the operators of a streaming query on the columns of a window. Raises UnsupportedOperator
+    for the queries it cannot run, these keep the WindowRDD path.
+    """
+    def __init__(self, query):
+        self.query = query
+        self.fields = list(query.basic_headers)
+        self.steps = [self.get_step(operator) for operator in query.operators]
+
+    def get_step(self, operator):
+        if operator.name == 'Map':
+            return self.get_map(operator)
+        elif operator.name == 'Reduce':
+            if operator.func[0] != 'sum':
+                raise UnsupportedOperator('reduce ' + str(operator.func))
+            return self.reduce_sum
+        elif operator.name == 'Distinct':
+            return self.distinct
+        elif operator.name == 'Filter':
+            return self.get_filter(operator)
+        raise UnsupportedOperator(operator.name)
+
+    def get_map(self, operator):
+        keys = list(operator.keys)
+        func = operator.func
+        mask_keys = []
+        if len(func) > 0 and func[0] == 'mask':
+            mask_keys = [key for key in keys if key in operator.map_keys]
+            mask = (0xffffffff << (32 - int(func[1]))) & 0xffffffff
+        elif len(func) > 0 and func[0] not in ('eq', 'div'):
+            raise UnsupportedOperator('map ' + str(func))
+        if len(operator.values) > 0 and len(func) > 0:
+            values = list(operator.map_values)
+        elif len(operator.values) > 0:
+            values = list(operator.values)
+        else:
+            values = []
+
+        def map_step(batch):
+            columns = {}
+            for key in keys:
+                array, kind = batch.columns[key]
+                if key in mask_keys:
+                    if kind != KIND_IP:
+                        raise UnsupportedOperator('mask on ' + key)
+                    array = array & np.uint32(mask)
+                columns[key] = (array, kind)
+            for value in values:
+                if len(func) > 0 and func[0] == 'eq':
+                    columns[value] = (np.full(batch.size, func[1], dtype=np.array(func[1]).dtype), KIND_NUM)
+                elif len(func) > 0 and func[0] == 'div':
+                    numerator, denominator = [batch.columns[fld][0].astype(np.float64) for fld in operator.prev_values]
+                    columns[value] = (numerator / denominator, KIND_NUM)
+                else:
+                    columns[value] = batch.columns[value]
+            return ColumnBatch(columns, keys, values, batch.size)
+        return map_step
+
+    def reduce_sum(self, batch):
+        if batch.size == 0:
+            return batch
+        if len(batch.values) != 1:
+            raise UnsupportedOperator('reduce over %i values' % len(batch.values))
+        codes = group_codes([batch.columns[key][0] for key in batch.keys])
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        value = batch.values[0]
+        array, kind = batch.columns[value]
+        if kind != KIND_NUM:
+            # the WindowRDD path adds the strings of an input field, it does not sum them
+            raise UnsupportedOperator('reduce over the input field ' + value)
+        sums = np.zeros(len(first), dtype=np.float64 if array.dtype.kind == 'f' else np.int64)
+        np.add.at(sums, inverse, array.astype(sums.dtype))
+        result = batch.take(first, batch.keys, [])
+        result.values = [value]
+        result.columns[value] = (sums, KIND_NUM)
+        return result
+
+    def distinct(self, batch):
+        if batch.size == 0:
+            return batch
+        codes = group_codes([batch.columns[fld][0] for fld in batch.keys + batch.values])
+        _, first = np.unique(codes, return_index=True)
+        return batch.take(first, batch.keys, batch.values)
+
+    def get_filter(self, operator):
+        comparisons = {'eq': np.equal, 'geq': np.greater_equal, 'leq': np.less_equal}
+        if operator.func[0] not in comparisons:
+            raise UnsupportedOperator('filter ' + str(operator.func))
+        compare = comparisons[operator.func[0]]
+        threshold = float(operator.func[1])
+        fields = list(operator.filter_keys) + list(operator.filter_vals)
+
+        def filter_step(batch):
+            selected = np.ones(batch.size, dtype=bool)
+            for fld in fields:
+                array, kind = batch.columns[fld]
+                if kind == KIND_IP:
+                    raise UnsupportedOperator('filter on ' + fld)
+                selected &= compare(array.astype(np.float64), threshold)
+            return batch.take(np.flatnonzero(selected), batch.keys, batch.values)
+        return filter_step
+
+    def get_batch(self, tuples):
+        columns = {}
+        field_values = zip(*tuples) if tuples else [() for _ in self.fields]
+        for fld, values in zip(self.fields, field_values):
+            columns[fld] = to_column(list(values), get_field_kind(fld))
+        return ColumnBatch(columns, self.fields, [], len(tuples))
+
+    def get_records(self, batch):
+        keys = zip(*[from_column(batch.columns[key]) for key in batch.keys])
+        if len(batch.keys) == 1:
+            keys = [key[0] for key in keys]
+        if len(batch.values) == 0:
+            return keys
+        values = zip(*[from_column(batch.columns[value]) for value in batch.values])
+        if len(batch.values) == 1:
+            values = [value[0] for value in values]
+        return zip(keys, values)
+
+    def run(self, tuples):
+        """
+        Returns the records of the query for the tuples of one window
+        """
+        if not tuples:
+            return []
+        batch = self.get_batch(tuples)
+        for step in self.steps:
+            batch = step(batch)
+        return self.get_records(batch)
+
+
+def get_columnar_query(query):
+    """
+    Returns the ColumnarQuery of a streaming query, None if one of its operators is not supported
+    """
+    try:
+        return ColumnarQuery(query)
+    except UnsupportedOperator:
+        return None
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import struct
+
+# has to match the frames of sonata.dataplane_driver.p4.emitter.emitter_transport
+FRAME_LAYOUT = 0
+FRAME_RECORDS = 1
+FRAME_TEXT = 2
+
+FRAME_HEADER = struct.Struct('>BHH')
+
+# field kind -> (struct code, number of values, tuple template)
+FIELD_KINDS = {'B': ('B', 1, '%d'), 'H': ('H', 1, '%d'), 'I': ('I', 1, '%d'),
+               'ip': ('4B', 4, '%d.%d.%d.%d'), 'mac': ('6B', 6, '%d.%d.%d.%d.%d.%d')}
+
+
+class RecordLayout(object):
+    def __init__(self, qid, field_kinds):
+        self.qid = qid
+        self.field_kinds = field_kinds
+        self.record_struct = struct.Struct('>' + ''.join([FIELD_KINDS[kind][0] for kind in field_kinds]))
+        self.size = self.record_struct.size
+
+        # (first value, last value, template) for each field of the record
+        self.converters = []
+        start = 0
+        for kind in field_kinds:
+            _, nvalues, template = FIELD_KINDS[kind]
+            self.converters.append((start, start + nvalues, template))
+            start += nvalues
+
+    def iter_values(self, data, count):
+        unpack_from = self.record_struct.unpack_from
+        size = self.size
+        for offset in xrange(0, count * size, size):
+            yield unpack_from(data, offset)
+
+    def to_tuple(self, values):
+        # same tuple as processLogLine returns for the text line of this record
+        return ('k',) + tuple([template % values[start:end] for (start, end, template) in self.converters])
+
+
+class FrameDecoder(object):
+    """
+    Decodes the frames sent by the emitter's FrameEncoder into the tuples processLogLine returns
+    for the text transport.
+    """
+    def __init__(self):
+        self.layouts = dict()
+
+    def decode_values(self, frame):
+        """
+        Returns (qid, numeric record values) for a records frame, without converting them to strings
+        """
+        frame_type, qid, count = FRAME_HEADER.unpack_from(frame, 0)
+        if frame_type != FRAME_RECORDS:
+            return qid, []
+        return qid, list(self.layouts[qid].iter_values(buffer(frame, FRAME_HEADER.size), count))
+
+    def decode(self, frame):
+        frame_type, qid, count = FRAME_HEADER.unpack_from(frame, 0)
+        if frame_type == FRAME_LAYOUT:
+            self.layouts[qid] = RecordLayout(qid, frame[FRAME_HEADER.size:].split(","))
+            return []
+        elif frame_type == FRAME_RECORDS:
+            layout = self.layouts[qid]
+            to_tuple = layout.to_tuple
+            return [to_tuple(values) for values in layout.iter_values(buffer(frame, FRAME_HEADER.size), count)]
+        elif frame_type == FRAME_TEXT:
+            return [tuple(line.split(",")) for line in frame[FRAME_HEADER.size:].split("\n")]
+        else:
+            raise ValueError('unknown frame type %i' % frame_type)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+from __future__ import print_function
+
+import time
+import socket
+from collections import defaultdict
+from multiprocessing.connection import Client, Listener
+from sonata.message_bus import get_client, receive_request, send_reply
+from sonata.wire_format import decode_message
+from threading import Thread, Lock
+from netaddr import IPNetwork
+
+from frame_decoder import FrameDecoder
+from columnar import get_columnar_query, UnsupportedOperator
+
+CONNECT_RETRY_INTERVAL = 1
+
+
+class WindowRDD(object):
+    """
+    The tuples of one query in one window. It implements the part of the RDD API the compiled
+    PacketStream operators use, so the same query.compile() expressions run without Spark.
+    """
+    def __init__(self, records):
+        self.records = records
+
+    def map(self, func):
+        return WindowRDD([func(record) for record in self.records])
+
+    def filter(self, func):
+        return WindowRDD([record for record in self.records if func(record)])
+
+    def reduceByKey(self, func):
+        # hash aggregation
+        aggregates = {}
+        for key, value in self.records:
+            if key in aggregates:
+                aggregates[key] = func(aggregates[key], value)
+            else:
+                aggregates[key] = value
+        return WindowRDD(aggregates.items())
+
+    def distinct(self):
+        return WindowRDD(list(set(self.records)))
+
+    def join(self, other):
+        right = defaultdict(list)
+        for key, value in other.records:
+            right[key].append(value)
+        return WindowRDD([(key, (value, right_value))
+                          for key, value in self.records if key in right
+                          for right_value in right[key]])
+
+    def collect(self):
+        return self.records
+
+    def take(self, n):
+        return self.records[:n]
+
+
+def send_reduction_keys(records, op_handler_socket, start_time, qid='0'):
+    reduction_str = ",".join([r for r in records])
+    # persistent connection to the op handler, shared by all the queries
+    get_client(op_handler_socket).send("k," + qid + "," + reduction_str + "\n")
+    print("Sending P2: ", qid, records, reduction_str, " at time", time.time() - start_time)
+
+
+class NativeStreamingDriver(object):
+    """
+    In-process replacement for the Spark StreamingDriver ("sp": "native"). It reads the tuples from
+    the emitter(s), groups them per qid into tumbling windows of window_length seconds, and runs
+    the compiled PacketStream operators of each query on WindowRDDs at the end of every window.
+    """
+    def __init__(self, conf):
+        self.window_length = conf['window_length']
+        self.sm_socket = tuple(conf['sm_socket'])
+        self.sm_listener = Listener(self.sm_socket)
+        self.op_handler_socket = conf['op_handler_socket']
+
+        self.spark_stream_address = conf['spark_stream_address']
+        self.spark_stream_port = conf['spark_stream_port']
+        self.emitter_workers = conf.get('emitter_workers', 1)
+        # has to match the transport of the emitter
+        self.transport = conf.get('transport', 'text')
+        # run the supported queries on NumPy columns instead of WindowRDDs
+        self.columnar = conf.get('columnar', True)
+
+        self.start_time = time.time()
+
+        # qid (as sent by the emitter) -> tuples of the current window
+        self.window = defaultdict(list)
+        self.window_lock = Lock()
+
+        self.queries = {}
+        self.columnar_queries = {}
+        self.join_queries = []
+
+    def start(self):
+        self.receive_queries()
+        for worker_id in range(self.emitter_workers):
+            receiver = Thread(name='native_receiver_%i' % worker_id, target=self.receive_tuples,
+                              args=(self.spark_stream_port + worker_id,))
+            receiver.setDaemon(True)
+            receiver.start()
+
+        next_window = time.time() + self.window_length
+        while True:
+            time.sleep(max(0, next_window - time.time()))
+            next_window += self.window_length
+            with self.window_lock:
+                window, self.window = self.window, defaultdict(list)
+            self.process_window(window)
+
+    def receive_queries(self):
+        conn, request_id, data = receive_request(self.sm_listener)
+        data = decode_message(data)
+        self.join_queries = data['join_queries']
+
+        # compile each query once, the expressions are then applied to every window
+        for queryId, query in data['queries'].iteritems():
+            if not query.has_join:
+                query_str = "lambda rdd: rdd." + query.compile()
+            else:
+                query_str = "lambda spark_queries: " + query.compile()
+            print(query_str)
+            self.queries[queryId] = (query, eval(query_str))
+            if self.columnar and not query.has_join:
+                columnar_query = get_columnar_query(query)
+                if columnar_query is not None:
+                    self.columnar_queries[queryId] = columnar_query
+        # the runtime waits for this acknowledgement
+        send_reply(conn, request_id, 'ready')
+
+    def connect(self, port):
+        while True:
+            try:
+                return Client((self.spark_stream_address, port))
+            except socket.error:
+                time.sleep(CONNECT_RETRY_INTERVAL)
+
+    def receive_tuples(self, port):
+        conn = self.connect(port)
+        decoder = FrameDecoder()
+        while True:
+            data = conn.recv_bytes()
+            if self.transport == 'binary':
+                tuples = decoder.decode(data)
+            else:
+                tuples = [tuple(line.split(",")) for line in data.strip("\n").split("\n")]
+            with self.window_lock:
+                for tup in tuples:
+                    self.window[tup[1]].append(tup[2:])
+
+    def run_query(self, queryId, func, tuples):
+        if queryId in self.columnar_queries:
+            try:
+                return WindowRDD(self.columnar_queries[queryId].run(tuples))
+            except UnsupportedOperator as e:
+                print("Columnar execution not supported for", queryId, e)
+                del self.columnar_queries[queryId]
+        return func(WindowRDD(tuples))
+
+    def process_window(self, window):
+        spark_queries = {}
+        # queries without a join first, the joins read their output
+        for queryId, (query, func) in self.queries.iteritems():
+            if not query.has_join:
+                result = self.run_query(queryId, func, window.get(str(queryId), []))
+                if queryId in self.join_queries:
+                    spark_queries[queryId] = result
+                else:
+                    send_reduction_keys(result.collect(), self.op_handler_socket, self.start_time, str(queryId))
+
+        for queryId, (query, func) in self.queries.iteritems():
+            if query.has_join:
+                print("Join " + str(func(spark_queries).take(5)))
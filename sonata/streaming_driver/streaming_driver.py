@@ -5,18 +5,19 @@
 from __future__ import print_function
 
 import time
-import pickle
 from pyspark import SparkContext, SparkConf
 from pyspark.streaming import StreamingContext
-from multiprocessing.connection import Client, Listener
+from multiprocessing.connection import Listener
+from sonata.message_bus import get_client, receive_request, send_reply
+from sonata.wire_format import decode_message
 import json
 
 
 def send_reduction_keys(rdd, op_handler_socket, start_time, qid='0'):
     list_rdd = rdd.collect()
     reduction_str = ",".join([r for r in list_rdd])
-    reduction_socket = Client(tuple(op_handler_socket))
-    reduction_socket.send_bytes("k," + qid + "," + reduction_str + "\n")
+    # persistent connection to the op handler, shared by all the queries
+    get_client(op_handler_socket).send("k," + qid + "," + reduction_str + "\n")
     print("Sending P2: ", qid, list_rdd, reduction_str, " at time", time.time() - start_time)
 
 
@@ -36,6 +37,8 @@ class StreamingDriver(object):
 
         self.spark_stream_address = conf['spark_stream_address']
         self.spark_stream_port = conf['spark_stream_port']
+        # a sharded emitter has one socket per worker, on consecutive ports
+        self.emitter_workers = conf.get('emitter_workers', 1)
 
         self.start_time = time.time()
 
@@ -44,11 +47,14 @@ class StreamingDriver(object):
         self.ssc = StreamingContext(self.sc, self.batch_interval)
 
     def start(self):
-        lines = self.ssc.socketTextStream(self.spark_stream_address, self.spark_stream_port)
+        lines = self.ssc.union(*[self.ssc.socketTextStream(self.spark_stream_address, self.spark_stream_port + worker_id)
+                                 for worker_id in range(self.emitter_workers)])
         pktstream = (lines.map(lambda line: processLogLine(line)))
         print(self.window_length, self.sliding_interval)
         self.process_pktstream(pktstream)
         self.ssc.start()
+        # the runtime waits for this acknowledgement
+        send_reply(self.sm_conn, self.sm_request_id, 'ready')
         self.ssc.awaitTermination()
 
     def process_pktstream(self, pktstream):
@@ -56,9 +62,8 @@ class StreamingDriver(object):
 
         spark_queries = {}
 
-        conn = self.sm_listener.accept()
-        raw_data = conn.recv()
-        data = pickle.loads(raw_data)
+        self.sm_conn, self.sm_request_id, data = receive_request(self.sm_listener)
+        data = decode_message(data)
 
         queries = data['queries']
         join_queries = data['join_queries']
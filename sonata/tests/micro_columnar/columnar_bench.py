@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# Compares the per-window CPU time of the native stream processor on WindowRDDs (the compiled
+# operators, as on Spark) and on NumPy columns, for a superspreader and a heavy hitter query.
+from sonata.streaming_driver.query_object import PacketStream
+from sonata.streaming_driver.native_driver import WindowRDD
+from sonata.streaming_driver.columnar import ColumnarQuery
+from netaddr import IPNetwork
+import random, sys, time
+
+QID = 10032
+T = 10
+
+
+def get_superspreader():
+    query = PacketStream(QID)
+    query.basic_headers = ['ipv4_dstIP', 'ipv4_srcIP']
+    return (query
+            .map(keys=('ipv4_dstIP', 'ipv4_srcIP'))
+            .distinct(keys=('ipv4_dstIP', 'ipv4_srcIP'))
+            .map(keys=('ipv4_dstIP',), map_keys=('ipv4_dstIP',), func=('mask', 16))
+            .map(keys=('ipv4_dstIP',), map_values=('count',), func=('eq', 1,))
+            .reduce(keys=('ipv4_dstIP',), func=('sum',))
+            .filter(filter_vals=('count',), func=('geq', T)))
+
+
+def get_heavy_hitter():
+    query = PacketStream(QID)
+    query.basic_headers = ['ipv4_dstIP', 'udp_sport']
+    return (query
+            .map(keys=('ipv4_dstIP', 'udp_sport'))
+            .map(keys=('ipv4_dstIP', 'udp_sport'), map_values=('count',), func=('eq', 1,))
+            .reduce(keys=('ipv4_dstIP', 'udp_sport'), func=('sum',))
+            .filter(filter_vals=('count',), func=('geq', T)))
+
+
+def get_high_ports():
+    # a filter on a key, compared as a number on both paths
+    query = PacketStream(QID)
+    query.basic_headers = ['ipv4_dstIP', 'udp_sport']
+    return (query
+            .map(keys=('ipv4_dstIP', 'udp_sport'))
+            .filter(filter_keys=('udp_sport',), func=('geq', 50))
+            .map(keys=('ipv4_dstIP', 'udp_sport'), map_values=('count',), func=('eq', 1,))
+            .reduce(keys=('ipv4_dstIP', 'udp_sport'), func=('sum',))
+            .filter(filter_vals=('count',), func=('geq', T)))
+
+
+def create_tuples(number_of_tuples):
+    return [('10.%d.%d.%d' % (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)),
+             '%d.%d.%d.%d' % (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)))
+            for _ in range(number_of_tuples)]
+
+
+def run(name, query, tuples):
+    # the compiled operators refer to IPNetwork, as in the native driver
+    func = eval("lambda rdd: rdd." + query.compile())
+    start = time.time()
+    rdd_records = func(WindowRDD(tuples)).collect()
+    rdd_time = time.time() - start
+
+    columnar_query = ColumnarQuery(query)
+    start = time.time()
+    columnar_records = columnar_query.run(tuples)
+    columnar_time = time.time() - start
+
+    assert sorted(rdd_records) == sorted(columnar_records)
+    print name, len(tuples), "tuples: rdd %.3f s, columnar %.3f s" % (rdd_time, columnar_time)
+
+
+if __name__ == '__main__':
+    NUMBER_OF_TUPLES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    tuples = create_tuples(NUMBER_OF_TUPLES)
+    run("superspreader", get_superspreader(), tuples)
+    port_tuples = [(dst, str(random.randint(1, 100))) for (dst, _) in tuples]
+    run("heavy_hitter", get_heavy_hitter(), port_tuples)
+    run("high_ports", get_high_ports(), port_tuples)
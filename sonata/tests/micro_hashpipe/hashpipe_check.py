@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# Replays a pcap through the reference model of the HashPipe Reduce (dataplane_driver/p4/reference_model.py)
+# and through the emitter's handling of its reports: the first report of a key gives the index of its count,
+# the keys that found no register are counted from their overflow reports. Checks that the count of every key,
+# per window, is the exact count of its packets. Each window updates the other register bank, the registers of
+# the previous one are read as by the emitter and its fingerprints reset as by the controller.
+from sonata.core.training.training_data import iter_pcap_frames
+from sonata.dataplane_driver.p4.p4_operators import P4HashPipeReduce, REGISTER_BANKS
+from sonata.dataplane_driver.p4.reference_model import PacketParser, HashPipeReduceModel
+from sonata.sonata_layers import get_sonata_raw_fields
+from collections import Counter
+from itertools import chain
+import json, sys, time
+
+LAYER_2_TARGET = {"ethernet": "bmv2", "tcp": "bmv2", "ipv4": "bmv2", "udp": "bmv2",
+                  "DNS": "scapy", "payload": "scapy"}
+PCAP_FILE = 'sonata/tests/micro_packet_size/campus_dns_1min.pcap'
+QID = 10032
+KEYS = ['ipv4.dstIP']
+T = 3
+
+
+def get_reported_counts(model, index_store, overflow_counts, epoch):
+    counts = Counter(overflow_counts)
+    for register, offset, width, register_epoch in model.operator.get_registers():
+        if register_epoch != epoch:
+            continue
+        indexes = [index - offset for index in index_store if offset <= index < offset + width]
+        for index, value in model.read_and_reset(register, indexes).iteritems():
+            counts[index_store[index + offset]] += value
+        assert not any(model.registers[register])
+    for register in model.fingerprint_registers[epoch]:
+        model.reset(register)
+    return counts
+
+
+def run(pcap_file, n_stages, width):
+    with open('sonata/fields_mapping.json') as json_data_file:
+        p4_raw_fields = get_sonata_raw_fields(json.load(json_data_file), LAYER_2_TARGET)
+    operator = P4HashPipeReduce(QID, 3, 'meta_mapinit_%i_1' % QID, 'drop_%i' % QID, '_nop', KEYS, ('count',), '-1',
+                                n_stages, width, 'meta_app_data.epoch', 'meta_app_data.epoch_offset', p4_raw_fields)
+    parser = PacketParser(p4_raw_fields)
+    model = HashPipeReduceModel(operator)
+
+    epoch = 0
+    window = None
+    index_store = {}
+    overflow_counts = Counter()
+    exact_counts = Counter()
+    stats = Counter()
+    start = time.time()
+    for ts, frame in chain(iter_pcap_frames(pcap_file), [(None, None)]):
+        if ts is None or ts // T != window:
+            if window is not None:
+                assert get_reported_counts(model, index_store, overflow_counts, epoch) == exact_counts
+                epoch = (epoch + 1) % REGISTER_BANKS
+                stats['windows'] += 1
+                stats['keys'] += len(exact_counts)
+                stats['overflow keys'] += len(overflow_counts)
+            if ts is None:
+                break
+            window = ts // T
+            index_store = {}
+            overflow_counts = Counter()
+            exact_counts = Counter()
+
+        values = parser.parse(frame)
+        if not all([key in values for key in KEYS]):
+            continue
+        values['qid'] = QID
+        key = tuple([values[key] for key in KEYS])
+        exact_counts[key] += 1
+        stats['packets'] += 1
+
+        report = model.process(values, epoch)
+        if report is None:
+            continue
+        index, overflow = report
+        stats['reports'] += 1
+        if overflow:
+            overflow_counts[key] += 1
+        else:
+            index_store[index] = key
+    total = time.time() - start
+    print "stages|%i|width|%i|packets|%i|reports|%i|windows|%i|keys|%i|overflow keys|%i|per packet|%.6f" % (
+        n_stages, width, stats['packets'], stats['reports'], stats['windows'], stats['keys'], stats['overflow keys'],
+        total / max(stats['packets'], 1))
+
+
+if __name__ == '__main__':
+    pcap_file = sys.argv[1] if len(sys.argv) > 1 else PCAP_FILE
+    for n_stages, width in [(1, 16), (2, 16), (4, 16), (4, 1024)]:
+        run(pcap_file, n_stages, width)
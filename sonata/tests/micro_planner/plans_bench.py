@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# Time of the refinement planner (query_engine/plans_search.get_refinement_plan) on the query trees of the
+# QueryGenerator cases 0-5, for coarse to fine refinement levels and 1 to 3 partition plans per query.
+from sonata.query_engine.plans_search import generate_costs, get_refinement_plan
+from sonata.query_engine.query_generator import QueryGenerator
+import os, random, shutil, sys, tempfile, time
+
+CASES = range(6)
+# directories the QueryGenerator cases pickle themselves into
+GENERATOR_DIRS = ['data/use_case_0_100_all_new_data', 'data/use_case_0_filtered_data', 'query_engine/use_cases_aws']
+PLANS = [1, 10, 11]
+
+
+def get_query_trees(case, query_tree_depth):
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp_dir)
+        for path in GENERATOR_DIRS:
+            os.makedirs(path)
+        query_generator = QueryGenerator(case, 2, 2, query_tree_depth, 100)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+    return query_generator.query_trees.values()
+
+
+def get_queries(query_tree):
+    queries = []
+    for qid in query_tree:
+        queries.append(qid)
+        queries.extend(get_queries(query_tree[qid]))
+    return queries
+
+
+def run(case, query_tree, ref_levels, n_plans):
+    query_2_plans = {}
+    query_2_cost = {}
+    for qid in get_queries(query_tree):
+        query_2_plans[qid] = PLANS[:n_plans]
+        query_2_cost[qid] = {}
+        for p1 in query_2_plans[qid]:
+            for p2 in query_2_plans[qid]:
+                tmp = generate_costs(p1, p2, ref_levels)
+                for transit in tmp:
+                    query_2_cost[qid][(p1, p2), transit] = tmp[transit]
+
+    query_2_final_plan = {}
+    start = time.time()
+    for qid in query_tree:
+        final_plan, cost = get_refinement_plan(ref_levels[0], ref_levels[-1], qid, ref_levels, query_2_plans,
+                                               query_tree, query_2_cost, query_2_final_plan, {})
+    print "case %i, %i queries, %i levels, %i plans: %.4f s" % (case, len(query_2_plans), len(ref_levels), n_plans,
+                                                                 time.time() - start), final_plan
+
+
+if __name__ == '__main__':
+    query_tree_depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    random.seed(0)
+    for case in CASES:
+        for query_tree in get_query_trees(case, query_tree_depth):
+            for step in [16, 8, 4, 2]:
+                for n_plans in [1, 3]:
+                    run(case, query_tree, range(0, 33, step), n_plans)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# Local stand-in for the register part of the bmv2 thrift runtime, to exercise the emitter's
+# RegisterClient without a running simple_switch. Needs the thrift and bm_runtime modules from bmv2.
+from sonata.dataplane_driver.p4.emitter.register_client import RegisterClient, THRIFT_SERVICE
+import threading, time, sys, random
+
+THRIFT_IP = 'localhost'
+THRIFT_PORT = 22223
+REGISTER_NAME = 'reduce_10032_3'
+REGISTER_INSTANCE_COUNT = 2 ** 16
+
+
+class FakeRegisterHandler(object):
+    def __init__(self, registers):
+        # register name -> list of values
+        self.registers = registers
+
+    def bm_register_read(self, cxt_id, register_name, index):
+        return self.registers[register_name][index]
+
+    def bm_register_read_all(self, cxt_id, register_name):
+        return list(self.registers[register_name])
+
+    def bm_register_write(self, cxt_id, register_name, index, value):
+        self.registers[register_name][index] = value
+
+    def bm_register_reset(self, cxt_id, register_name):
+        self.registers[register_name] = [0] * len(self.registers[register_name])
+
+
+class FakeSwitch(threading.Thread):
+    def __init__(self, registers, thrift_port=THRIFT_PORT):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.handler = FakeRegisterHandler(registers)
+        self.thrift_port = thrift_port
+
+    def run(self):
+        from thrift.transport import TSocket, TTransport
+        from thrift.protocol import TBinaryProtocol
+        from thrift.server import TServer
+        from thrift.TMultiplexedProcessor import TMultiplexedProcessor
+        from bm_runtime.standard import Standard
+
+        processor = TMultiplexedProcessor()
+        processor.registerProcessor(THRIFT_SERVICE, Standard.Processor(self.handler))
+        server = TServer.TSimpleServer(processor,
+                                       TSocket.TServerSocket(THRIFT_IP, self.thrift_port),
+                                       TTransport.TBufferedTransportFactory(),
+                                       TBinaryProtocol.TBinaryProtocolFactory())
+        server.serve()
+
+
+if __name__ == '__main__':
+    NUMBER_OF_POLLS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    NUMBER_OF_KEYS = 1000
+
+    registers = {REGISTER_NAME: [0] * REGISTER_INSTANCE_COUNT}
+    FakeSwitch(registers).start()
+    time.sleep(1)
+
+    client = RegisterClient(THRIFT_IP, THRIFT_PORT)
+    indexes = random.sample(range(REGISTER_INSTANCE_COUNT), NUMBER_OF_KEYS + 1)
+    # the count of a key not yet in the index store, it must not be reset
+    unread_index = indexes.pop()
+
+    start = time.time()
+    for poll in range(0, NUMBER_OF_POLLS):
+        for index in indexes:
+            registers[REGISTER_NAME][index] = poll + 1
+        registers[REGISTER_NAME][unread_index] += 1
+        output = client.read_and_reset(REGISTER_NAME, indexes)
+        assert len(output) == NUMBER_OF_KEYS and set(output.values()) == {poll + 1}
+        assert registers[REGISTER_NAME][unread_index] == poll + 1
+        assert sum(registers[REGISTER_NAME]) == poll + 1
+    total = time.time() - start
+
+    client.close()
+    print "polls|" + str(NUMBER_OF_POLLS) + "|keys|" + str(NUMBER_OF_KEYS) + "|per poll|%.6f" % (total / NUMBER_OF_POLLS)
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# Compares the size and the encode/decode time of the runtime messages (dataplane init, streaming
+# init and filter table deltas) with pickle and with the sonata wire format.
+from sonata.dataplane_driver.query_object import QueryObject
+from sonata.query_engine.sonata_operators.filter import Filter
+from sonata.query_engine.sonata_operators.map import Map
+from sonata.query_engine.sonata_operators.reduce import Reduce
+from sonata.sonata_layers import get_sonata_raw_fields
+from sonata.streaming_driver.query_object import PacketStream
+from sonata.wire_format import encode_message, decode_message
+import json, pickle, random, sys, time
+
+LAYER_2_TARGET = {"ethernet": "bmv2", "tcp": "bmv2", "ipv4": "bmv2", "udp": "bmv2",
+                  "DNS": "scapy", "payload": "scapy"}
+ITERATIONS = 100
+
+
+def get_dp_queries(number_of_queries):
+    dp_queries = {}
+    for ctr in range(number_of_queries):
+        qid = (ctr + 1) * 10000 + 32
+        query = QueryObject(qid)
+        query.operators = [Filter(filter_keys=('ipv4.protocol',), func=('eq', 17)),
+                           Map(keys=('ipv4.dstIP', 'udp.sport'), map_values=('count',), func=('eq', 1,)),
+                           Reduce(keys=('ipv4.dstIP', 'udp.sport'), func=('sum',)),
+                           Filter(filter_vals=('count',), func=('geq', 10))]
+        query.read_register = True
+        dp_queries[qid] = query
+    return dp_queries
+
+
+def get_sp_queries(number_of_queries):
+    sp_queries = {}
+    for ctr in range(number_of_queries):
+        qid = (ctr + 1) * 10000 + 32
+        query = PacketStream(qid)
+        query.basic_headers = ['ipv4_dstIP', 'udp_sport', 'count']
+        sp_queries[qid] = (query
+                           .map(keys=('ipv4_dstIP', 'udp_sport'), values=('count',))
+                           .reduce(keys=('ipv4_dstIP', 'udp_sport'), func=('sum',))
+                           .filter(filter_vals=('count',), func=('geq', 10)))
+    return sp_queries
+
+
+def get_delta_config(number_of_keys):
+    keys = ['10.%d.%d.0' % (random.randint(0, 255), random.randint(0, 255)) for _ in range(number_of_keys)]
+    return {(20032, 10032): (keys, keys[:number_of_keys / 10])}
+
+
+def measure(name, message):
+    start = time.time()
+    for _ in range(ITERATIONS):
+        pickled = pickle.dumps(message)
+    pickle_encode = (time.time() - start) / ITERATIONS
+    start = time.time()
+    for _ in range(ITERATIONS):
+        pickle.loads(pickled)
+    pickle_decode = (time.time() - start) / ITERATIONS
+
+    start = time.time()
+    for _ in range(ITERATIONS):
+        encoded = encode_message(message)
+    wire_encode = (time.time() - start) / ITERATIONS
+    start = time.time()
+    for _ in range(ITERATIONS):
+        decode_message(encoded)
+    wire_decode = (time.time() - start) / ITERATIONS
+
+    print "%s: pickle %i bytes, encode %.6f s, decode %.6f s | wire %i bytes, encode %.6f s, decode %.6f s" % (
+        name, len(pickled), pickle_encode, pickle_decode, len(encoded), wire_encode, wire_decode)
+
+
+if __name__ == '__main__':
+    NUMBER_OF_KEYS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with open('sonata/fields_mapping.json') as json_data_file:
+        sonata_fields = get_sonata_raw_fields(json.load(json_data_file), LAYER_2_TARGET)
+
+    measure("dp init", {'init': {0: get_dp_queries(4), 1: 1, 2: sonata_fields}})
+    measure("sp init", {'queries': get_sp_queries(4), 'join_queries': []})
+    measure("delta", {'delta': {0: get_delta_config(NUMBER_OF_KEYS), 1: 1}})
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# Replays a pcap through the P4Simulator (dataplane_driver/p4/p4_simulator.py) running the program compiled for a few
+# queries, and decodes its report packets with the emitter's header decoders. At the end of each window the epoch is
+# flipped and the registers are read and reset as by the P4Target and the emitter. The tuples and the register values
+# are checked against a direct model of the operators, the HashPipe, the count-min sketch and the Bloom filter
+# against their reference models.
+from sonata.core.training.training_data import iter_pcap_frames
+from sonata.dataplane_driver.p4.emitter.emitter_decoder import get_header_decoders
+from sonata.dataplane_driver.p4.p4_application import P4Application
+from sonata.dataplane_driver.p4.p4_operators import REGISTER_BANKS, REGISTER_INSTANCE_COUNT, REGISTER_NUM_INDEX_BITS
+from sonata.dataplane_driver.p4.p4_simulator import P4Simulator
+from sonata.dataplane_driver.p4.reference_model import BloomDistinctModel, CMSReduceModel, HashPipeReduceModel
+from sonata.dataplane_driver.p4.reference_model import get_hash
+from sonata.dataplane_driver.query_object import QueryObject
+from sonata.query_engine.sonata_operators.distinct import Distinct
+from sonata.query_engine.sonata_operators.filter import Filter
+from sonata.query_engine.sonata_operators.map import Map
+from sonata.query_engine.sonata_operators.reduce import Reduce
+from sonata.sonata_layers import get_sonata_raw_fields
+from collections import Counter, defaultdict
+from itertools import chain
+import json, socket, struct, sys, time
+
+LAYER_2_TARGET = {"ethernet": "bmv2", "tcp": "bmv2", "ipv4": "bmv2", "udp": "bmv2",
+                  "DNS": "scapy", "payload": "scapy"}
+PCAP_FILE = 'sonata/tests/micro_packet_size/campus_dns_1min.pcap'
+QID_UDP = 1
+QID_SPREADER = 2
+QID_HASHPIPE = 3
+QID_CMS = 4
+CMS_BITS = 2 ** 11
+QID_BLOOM = 5
+BLOOM_BITS = 2 ** 10
+# about the distinct pairs of a window of the pcap
+BLOOM_CARDINALITY = 400
+T = 3
+
+
+def get_query(qid, operators, read_register=False):
+    query = QueryObject(qid)
+    query.operators = operators
+    query.read_register = read_register
+    return query
+
+
+def get_reduce(keys, stages=0, cms_bits=0):
+    reduce_operator = Reduce(keys=keys, func=('sum',), stages=stages, cms_bits=cms_bits)
+    reduce_operator.values = ('count',)
+    return reduce_operator
+
+
+def get_app(p4_raw_fields):
+    queries = dict()
+    # udp packets per /16 destination
+    queries[QID_UDP] = get_query(QID_UDP, [Filter(keys=('ipv4.dstIP',), filter_keys=('ipv4.protocol',), func=('eq', 17)),
+                                           Map(keys=('ipv4.dstIP',), map_keys=('ipv4.dstIP',), func=('mask', 16)),
+                                           get_reduce(('ipv4.dstIP',))])
+    # distinct sources per destination, counted in the registers
+    queries[QID_SPREADER] = get_query(QID_SPREADER, [Distinct(keys=('ipv4.dstIP', 'ipv4.srcIP')),
+                                                     Map(keys=('ipv4.dstIP',)),
+                                                     get_reduce(('ipv4.dstIP',))], True)
+    # packets per source, counted in the stages of a HashPipe
+    queries[QID_HASHPIPE] = get_query(QID_HASHPIPE, [get_reduce(('ipv4.srcIP',), 4)], True)
+    # packets per destination, counted in a count-min sketch small enough for the keys to collide
+    queries[QID_CMS] = get_query(QID_CMS, [get_reduce(('ipv4.dstIP',), cms_bits=CMS_BITS)])
+    # distinct pairs, in a Bloom filter small enough for false positives
+    queries[QID_BLOOM] = get_query(QID_BLOOM, [Distinct(keys=('ipv4.dstIP', 'ipv4.srcIP'), bloom_bits=BLOOM_BITS,
+                                                        bloom_hashes=3, cardinality=BLOOM_CARDINALITY)])
+    return P4Application(queries, p4_raw_fields)
+
+
+def get_index(values, sizes):
+    return get_hash('crc16', values, sizes, REGISTER_NUM_INDEX_BITS) % REGISTER_INSTANCE_COUNT
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+class OperatorModel(object):
+    """
+    Direct model of the queries for one window: the tuples they report and the counts in their registers
+    """
+    def __init__(self, epoch, hash_pipe, cms, bloom):
+        self.epoch = epoch
+        self.hash_pipe = hash_pipe
+        self.cms = cms
+        self.bloom = bloom
+        self.distinct_indexes = set()
+        self.counts = Counter()
+        self.tuples = defaultdict(list)
+
+    def process(self, values):
+        dst_ip = values.get('ipv4.dstIP', 0)
+        src_ip = values.get('ipv4.srcIP', 0)
+        if values.get('ipv4.protocol', 0) == 17:
+            self.tuples[QID_UDP].append('k,%i,%s,1' % (QID_UDP, int_to_ip(dst_ip & 0xffff0000)))
+
+        distinct_index = get_index([dst_ip, src_ip], [32, 32])
+        if distinct_index not in self.distinct_indexes:
+            self.distinct_indexes.add(distinct_index)
+            index = get_index([dst_ip], [32]) + self.epoch * REGISTER_INSTANCE_COUNT
+            self.counts[index] += 1
+            if self.counts[index] == 1:
+                self.tuples[QID_SPREADER].append('k,%i,%s,%i' % (QID_SPREADER, int_to_ip(dst_ip), index))
+
+        report = self.hash_pipe.process(dict(values, **{'ipv4.srcIP': src_ip}), self.epoch)
+        if report is not None:
+            self.tuples[QID_HASHPIPE].append('k,%i,%s,%i,%i' % ((QID_HASHPIPE, int_to_ip(src_ip)) + report))
+
+        count = self.cms.process(dict(values, **{'ipv4.dstIP': dst_ip}), self.epoch)
+        if count is not None:
+            self.tuples[QID_CMS].append('k,%i,%s,%i' % (QID_CMS, int_to_ip(dst_ip), count))
+
+        if self.bloom.process(dict(values, **{'ipv4.dstIP': dst_ip, 'ipv4.srcIP': src_ip}), self.epoch):
+            self.tuples[QID_BLOOM].append('k,%i,%s,%s' % (QID_BLOOM, int_to_ip(dst_ip), int_to_ip(src_ip)))
+
+
+def decode_report(decoders, report, tuples):
+    # as the emitter, one out header after the other until the final header
+    offset = 0
+    qid = struct.unpack_from('>H', report, offset)[0]
+    while qid in decoders:
+        tuples[qid].append(decoders[qid].decode(report, offset))
+        offset = decoders[qid].get_updated_offset(offset)
+        qid = struct.unpack_from('>H', report, offset)[0]
+
+
+def check_window(app, simulator, model, tuples, old_epoch):
+    assert tuples == model.tuples
+
+    # the emitter reads the registers of the previous epoch at the indexes of the reported tuples
+    query = app.queries[QID_SPREADER]
+    indexes = [int(tuple.rsplit(',', 1)[1]) for tuple in tuples[QID_SPREADER]]
+    counts = {}
+    for register in query.registers_to_read:
+        if query.register_epochs[register] != old_epoch:
+            continue
+        offset, width = query.register_offsets[register]
+        output = simulator.read_and_reset(register, [index - offset for index in indexes
+                                                     if offset <= index < offset + width])
+        counts.update(dict((index + offset, value) for index, value in output.iteritems()))
+    assert counts == dict((index, model.counts[index]) for index in indexes)
+
+    for register in model.hash_pipe.fingerprint_registers[old_epoch] + model.hash_pipe.count_registers[old_epoch]:
+        assert simulator.read_all(register) == model.hash_pipe.registers[register]
+    # the HashPipe counts are read at the indexes of the first reports, which leaves the count registers empty
+    query = app.queries[QID_HASHPIPE]
+    indexes = [int(tuple.split(',')[3]) for tuple in tuples[QID_HASHPIPE] if tuple.endswith(',0')]
+    for register in query.registers_to_read:
+        if query.register_epochs[register] != old_epoch:
+            continue
+        offset, width = query.register_offsets[register]
+        register_indexes = [index - offset for index in indexes if offset <= index < offset + width]
+        assert simulator.read_and_reset(register, register_indexes) == model.hash_pipe.read_and_reset(
+            register, register_indexes)
+        assert not any(simulator.read_all(register))
+
+    for register in model.cms.row_registers[old_epoch]:
+        assert simulator.read_all(register) == model.cms.registers[register]
+    for register in model.bloom.bit_registers[old_epoch]:
+        assert simulator.read_all(register) == model.bloom.registers[register]
+
+    # the controller resets the banks the emitter does not read
+    simulator.send_commands(app.get_epoch_reset_commands(old_epoch))
+    for register in model.cms.row_registers[old_epoch]:
+        model.cms.reset(register)
+    for register in model.bloom.bit_registers[old_epoch]:
+        model.bloom.reset(register)
+    for register in model.hash_pipe.fingerprint_registers[old_epoch]:
+        assert not any(simulator.read_all(register))
+        model.hash_pipe.reset(register)
+
+
+def run(pcap_file):
+    with open('sonata/fields_mapping.json') as json_data_file:
+        p4_raw_fields = get_sonata_raw_fields(json.load(json_data_file), LAYER_2_TARGET)
+    app = get_app(p4_raw_fields)
+    app.get_p4_code()
+    simulator = P4Simulator(app)
+    decoders = get_header_decoders(app.get_header_formats())
+    hash_pipe = HashPipeReduceModel(app.queries[QID_HASHPIPE].operators[-1])
+    cms = CMSReduceModel(app.queries[QID_CMS].operators[-1])
+    bloom = BloomDistinctModel(app.queries[QID_BLOOM].operators[-1])
+
+    epoch = 0
+    window = None
+    model = None
+    tuples = None
+    stats = Counter()
+    process_time = 0
+    for ts, frame in chain(iter_pcap_frames(pcap_file), [(None, None)]):
+        if ts is None or ts // T != window:
+            if window is not None:
+                # the new window updates the other bank
+                old_epoch = epoch
+                epoch = (epoch + 1) % REGISTER_BANKS
+                simulator.send_commands([app.get_epoch_command(epoch)])
+                check_window(app, simulator, model, tuples, old_epoch)
+                stats['windows'] += 1
+                for qid in tuples:
+                    stats['tuples %i' % qid] += len(tuples[qid])
+            if ts is None:
+                break
+            window = ts // T
+            model = OperatorModel(epoch, hash_pipe, cms, bloom)
+            tuples = defaultdict(list)
+
+        model.process(simulator.parser.parse(frame))
+        start = time.time()
+        report = simulator.process(frame)
+        process_time += time.time() - start
+        stats['packets'] += 1
+        if report is not None:
+            stats['reports'] += 1
+            decode_report(decoders, report, tuples)
+
+    print "packets|%i|reports|%i|windows|%i|tuples|%i|%i|%i|%i|%i|per packet|%.6f" % (
+        stats['packets'], stats['reports'], stats['windows'], stats['tuples %i' % QID_UDP],
+        stats['tuples %i' % QID_SPREADER], stats['tuples %i' % QID_HASHPIPE], stats['tuples %i' % QID_CMS],
+        stats['tuples %i' % QID_BLOOM], process_time / max(stats['packets'], 1))
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else PCAP_FILE)
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# Checks the hashes of the count-min sketch compiled for a Reduce with cms_bits, and of the HashPipe compiled for a
+# Reduce with stages: its rows must be independent, keys colliding in one row collide in another about as often as
+# random keys do. Checks the false positive rate of the
+# Bloom filter compiled for a Distinct with bloom_bits, measured on its reference model, against the rate its
+# operator estimates. The CRCs of the reference model are checked against the standard ones first.
+from sonata.dataplane_driver.p4.p4_operators import CRC32_POLYNOMIALS
+from sonata.dataplane_driver.p4.p4_query import P4Query
+from sonata.dataplane_driver.p4.reference_model import BloomDistinctModel, CMSReduceModel, HashPipeReduceModel
+from sonata.dataplane_driver.p4.reference_model import crc16, get_crc_function
+from sonata.query_engine.sonata_operators.distinct import Distinct
+from sonata.query_engine.sonata_operators.reduce import Reduce
+from sonata.sonata_layers import get_sonata_raw_fields
+from collections import defaultdict
+import json, random, sys, zlib
+
+LAYER_2_TARGET = {"ethernet": "bmv2", "tcp": "bmv2", "ipv4": "bmv2", "udp": "bmv2",
+                  "DNS": "scapy", "payload": "scapy"}
+QID = 10032
+KEYS = ('ipv4.dstIP', 'ipv4.srcIP')
+N_KEYS = 20000
+CMS_BITS = 2 ** 18
+HASHPIPE_STAGES = 4
+BLOOM_BITS = 2 ** 14
+BLOOM_HASHES = 4
+BLOOM_KEYS = 2000
+N_PROBES = 20000
+
+
+def get_query(qid, operators, p4_raw_fields, read_register=False):
+    return P4Query(qid, False, [], read_register, False, '', operators, '_nop', 'meta_app_data.drop',
+                   'meta_app_data.satisfied', 'meta_app_data.clone', 'meta_app_data.epoch',
+                   'meta_app_data.epoch_offset', p4_raw_fields)
+
+
+def check_crcs():
+    data = [''.join(chr(random.randint(0, 255)) for _ in range(random.randint(1, 16))) for _ in range(1000)]
+    crc32 = get_crc_function(32, CRC32_POLYNOMIALS[0], 0xffffffff, 0xffffffff, True)
+    assert all(crc32(value) == zlib.crc32(value) & 0xffffffff for value in data)
+    # CRC-16/ARC and CRC-32/MPEG-2 of the standard check string
+    assert crc16('123456789') == 0xbb3d
+    assert get_crc_function(32, 0x04c11db7, 0xffffffff, 0, False)('123456789') == 0x0376e6e7
+
+
+def get_shared_collisions(model, keys):
+    """
+    Returns the pairs of keys colliding in the first row, and how many of them collide in each other row
+    """
+    indexes = [model.get_indexes(list(key)) for key in keys]
+    depth = len(indexes[0])
+    first_row = defaultdict(list)
+    for key_indexes in indexes:
+        first_row[key_indexes[0]].append(key_indexes)
+    pairs = 0
+    shared = [0] * depth
+    for colliding in first_row.values():
+        for i in range(len(colliding)):
+            for j in range(i + 1, len(colliding)):
+                pairs += 1
+                for row in range(1, depth):
+                    if colliding[i][row] == colliding[j][row]:
+                        shared[row] += 1
+    return pairs, shared[1:]
+
+
+def get_keys(n_keys, excluded=()):
+    keys = set()
+    while len(keys) < n_keys:
+        key = (random.getrandbits(32), random.getrandbits(32))
+        if key not in excluded:
+            keys.add(key)
+    return keys
+
+
+def check_cms(p4_raw_fields, cms_bits):
+    reduce_operator = Reduce(keys=KEYS, func=('sum',), cms_bits=cms_bits)
+    reduce_operator.values = ('count',)
+    query = get_query(QID, [reduce_operator], p4_raw_fields)
+    operator = query.operators[-1]
+    assert operator.name == 'CMSReduce'
+    commands = [command for command in operator.get_commands() if command.startswith('set_crc32_parameters')]
+    assert len(commands) == operator.depth
+    assert len(set(command.split()[2] for command in commands)) == operator.depth
+
+    model = CMSReduceModel(operator)
+    pairs, shared = get_shared_collisions(model, list(get_keys(N_KEYS)))
+    expected = float(pairs) / operator.width
+    # independent rows share about 1 / width of the collisions of the first row, dependent ones all of them
+    assert pairs > 0
+    assert all(count < 3 * expected + 10 for count in shared)
+
+    print "rows|%i|width|%i|keys|%i|colliding pairs|%i|shared per row|%s|expected|%.1f" % (
+        operator.depth, operator.width, N_KEYS, pairs, ','.join(str(count) for count in shared), expected)
+
+
+def check_hashpipe(p4_raw_fields, n_stages):
+    reduce_operator = Reduce(keys=KEYS, func=('sum',), stages=n_stages)
+    reduce_operator.values = ('count',)
+    query = get_query(QID, [reduce_operator], p4_raw_fields, True)
+    operator = query.operators[-1]
+    assert operator.name == 'HashPipeReduce'
+    commands = [command for command in operator.get_commands() if command.startswith('set_crc32_parameters')]
+    # one polynomial per stage and one for the fingerprint
+    assert len(commands) == n_stages + 1
+    assert len(set(command.split()[2] for command in commands)) == n_stages + 1
+
+    model = HashPipeReduceModel(operator)
+    pairs, shared = get_shared_collisions(model, list(get_keys(N_KEYS)))
+    expected = float(pairs) / operator.width
+    assert pairs > 0
+    assert all(count < 3 * expected + 10 for count in shared)
+
+    print "stages|%i|width|%i|keys|%i|colliding pairs|%i|shared per stage|%s|expected|%.1f" % (
+        n_stages, operator.width, N_KEYS, pairs, ','.join(str(count) for count in shared), expected)
+
+
+def check_bloom(p4_raw_fields, bloom_bits):
+    distinct_operator = Distinct(keys=KEYS, bloom_bits=bloom_bits, bloom_hashes=BLOOM_HASHES,
+                                 cardinality=BLOOM_KEYS)
+    query = get_query(QID, [distinct_operator], p4_raw_fields)
+    operator = query.operators[-1]
+    assert operator.name == 'BloomDistinct'
+    commands = [command for command in operator.get_commands() if command.startswith('set_crc32_parameters')]
+    assert len(commands) == operator.n_hashes
+
+    model = BloomDistinctModel(operator)
+    keys = get_keys(BLOOM_KEYS)
+    for key in keys:
+        model.process(dict(zip(model.key_names, key)))
+    # the probes only read the filter, a probe whose bits are all set is a false positive
+    false_positives = 0
+    for key in get_keys(N_PROBES, keys):
+        indexes = model.get_indexes(list(key))
+        if all(model.registers[name][index] for name, index in zip(model.bit_registers[0], indexes)):
+            false_positives += 1
+    fpr = float(false_positives) / N_PROBES
+    assert abs(fpr - operator.fpr) < 0.005
+
+    print "bits|%i|hashes|%i|keys|%i|probes|%i|fpr|%.4f|expected|%.4f" % (
+        operator.n_bits, operator.n_hashes, BLOOM_KEYS, N_PROBES, fpr, operator.fpr)
+
+
+def run(cms_bits, bloom_bits):
+    with open('sonata/fields_mapping.json') as json_data_file:
+        p4_raw_fields = get_sonata_raw_fields(json.load(json_data_file), LAYER_2_TARGET)
+    check_crcs()
+    check_cms(p4_raw_fields, cms_bits)
+    check_hashpipe(p4_raw_fields, HASHPIPE_STAGES)
+    check_bloom(p4_raw_fields, bloom_bits)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else CMS_BITS, int(sys.argv[2]) if len(sys.argv) > 2 else BLOOM_BITS)
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# Compares the text and the binary framed transport between the emitter and the stream processor:
+# encoding at the emitter, sending over a local multiprocessing connection, and decoding the tuples
+# at the streaming side.
+from sonata.dataplane_driver.p4.emitter.emitter_decoder import HeaderDecoder
+from sonata.dataplane_driver.p4.emitter.emitter_transport import FrameEncoder
+from sonata.dataplane_driver.p4.p4_field import P4Field
+from sonata.dataplane_driver.p4.p4_layer import OutHeaders
+from sonata.streaming_driver.frame_decoder import FrameDecoder
+from multiprocessing.connection import Client, Listener
+import random, logging, struct, sys, threading, time
+
+BASE_PATH = '/home/vagrant/dev/sonata/tests/micro_socket_speed/'
+transport_socket = ("localhost", 6667)
+QID = 10032
+
+
+def create_return_logger(PATH):
+    # create a logger for the object
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+    # create file handler which logs messages
+    fh = logging.FileHandler(PATH)
+    fh.setLevel(logging.INFO)
+    logger.addHandler(fh)
+
+    return logger
+
+
+def get_decoder():
+    out_header = OutHeaders("out_header_%i" % QID)
+    out_header.fields = [P4Field(out_header, "qid", "qid", 16),
+                         P4Field(out_header, "ipv4.dstIP", "ipv4.dstIP", 32),
+                         P4Field(out_header, "udp.sport", "udp.sport", 16),
+                         P4Field(out_header, "count", "count", 16)]
+    return HeaderDecoder(QID, out_header)
+
+
+def create_reports(number_of_reports):
+    # out header followed by the final header delimiter, as captured by the emitter
+    reports = []
+    for i in range(0, number_of_reports):
+        reports.append(struct.pack('>H4BHHI', QID, random.randint(0, 255), random.randint(0, 255),
+                                   random.randint(0, 255), random.randint(0, 255),
+                                   53, random.randint(1, 100), 0))
+    return reports
+
+
+class Receiver(threading.Thread):
+    def __init__(self, number_of_reports, mode):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.number_of_reports = number_of_reports
+        self.mode = mode
+        self.tuples = []
+
+    def run(self):
+        conn = Client(transport_socket)
+        decoder = FrameDecoder()
+        while len(self.tuples) < self.number_of_reports:
+            data = conn.recv_bytes()
+            if self.mode == 'text':
+                self.tuples.append(tuple(data.strip("\n").split(",")))
+            else:
+                self.tuples.extend(decoder.decode(data))
+        conn.close()
+
+
+def run_transport(reports, mode, listener, frame_size):
+    decoder = get_decoder()
+    receiver = Receiver(len(reports), mode)
+    receiver.start()
+    conn = listener.accept()
+
+    start = time.time()
+    if mode == 'text':
+        for report in reports:
+            conn.send_bytes(decoder.decode(report, 0) + "\n")
+    else:
+        encoder = FrameEncoder({QID: decoder}, conn.send_bytes, frame_size)
+        encoder.send_layouts()
+        for report in reports:
+            encoder.add_record(QID, report, 0)
+        encoder.flush()
+    receiver.join()
+    end = time.time()
+    conn.close()
+    return start, end, receiver.tuples
+
+
+if __name__ == '__main__':
+    NUMBER_OF_REPORTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    FRAME_SIZES = [16, 64, 256, 1024]
+
+    logger = create_return_logger(BASE_PATH + "results/transport.log")
+    listener = Listener(transport_socket)
+    reports = create_reports(NUMBER_OF_REPORTS)
+
+    start, end, text_tuples = run_transport(reports, 'text', listener, None)
+    logger.info("text|" + str(NUMBER_OF_REPORTS) + "|" + "%.20f,%.20f" % (start, end))
+    print "text", NUMBER_OF_REPORTS, "reports in %.3f s" % (end - start)
+
+    for frame_size in FRAME_SIZES:
+        start, end, binary_tuples = run_transport(reports, 'binary', listener, frame_size)
+        assert binary_tuples == text_tuples
+        logger.info("binary_" + str(frame_size) + "|" + str(NUMBER_OF_REPORTS) + "|" + "%.20f,%.20f" % (start, end))
+        print "binary, frames of", frame_size, ":", NUMBER_OF_REPORTS, "reports in %.3f s" % (end - start)
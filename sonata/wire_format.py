@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#  Author:
+#  Arpit Gupta (arpitg@cs.princeton.edu)
+
+import json
+import struct
+import zlib
+
+"""
+Versioned wire format for the messages between the runtime and its drivers. Messages are encoded as
+compressed JSON, tuples, sets and non-string dict keys are tagged so they come back as they were sent,
+and objects are only encoded for the registered query classes. SonataRawFields is sent as the
+fields_mapping.json content it was built from, instead of the pickled layer tree. Decoding never
+executes code, unlike unpickling.
+"""
+
+WIRE_MAGIC = 'SW'
+WIRE_VERSION = 1
+WIRE_HEADER = struct.Struct('>2sBB')
+
+FLAG_COMPRESSED = 1
+COMPRESS_MIN_SIZE = 512
+
+registry = None
+
+
+def get_registry():
+    """
+    Returns (class -> name, name -> class) for the classes that can be encoded
+    """
+    global registry
+    if registry is None:
+        from sonata.dataplane_driver.query_object import QueryObject
+        from sonata.query_engine.sonata_operators import map as op_map, filter as op_filter, \
+            reduce as op_reduce, distinct as op_distinct, join as op_join
+        from sonata.streaming_driver import query_object as sp_query_object, spark_queries as sp_operators
+        from sonata.sonata_layers import SonataRawFields
+
+        names = {QueryObject: 'dp.QueryObject',
+                 op_map.Map: 'op.Map', op_filter.Filter: 'op.Filter', op_reduce.Reduce: 'op.Reduce',
+                 op_distinct.Distinct: 'op.Distinct', op_join.Join: 'op.Join',
+                 sp_query_object.PacketStream: 'sp.PacketStream',
+                 sp_operators.Map: 'sp.Map', sp_operators.Reduce: 'sp.Reduce',
+                 sp_operators.Distinct: 'sp.Distinct', sp_operators.Filter: 'sp.Filter',
+                 sp_operators.FilterInit: 'sp.FilterInit', sp_operators.Join: 'sp.Join',
+                 sp_operators.JoinSameWindow: 'sp.JoinSameWindow',
+                 SonataRawFields: 'SonataRawFields'}
+        registry = (names, dict((name, cls) for cls, name in names.iteritems()))
+    return registry
+
+
+def encode_value(value):
+    if value is None or isinstance(value, (bool, int, long, float, str, unicode)):
+        return value
+    elif isinstance(value, list):
+        return [encode_value(elem) for elem in value]
+    elif isinstance(value, tuple):
+        return {'t': [encode_value(elem) for elem in value]}
+    elif isinstance(value, (set, frozenset)):
+        return {'s': [encode_value(elem) for elem in value]}
+    elif isinstance(value, dict):
+        if all(isinstance(key, (str, unicode)) for key in value):
+            return {'d': dict((key, encode_value(elem)) for key, elem in value.iteritems())}
+        return {'m': [[encode_value(key), encode_value(elem)] for key, elem in value.iteritems()]}
+
+    names, _ = get_registry()
+    name = names.get(type(value))
+    if name is None:
+        raise TypeError('cannot encode %s' % type(value).__name__)
+    if name == 'SonataRawFields':
+        root_layer = value.root_layer
+        return {'o': name, 'a': encode_value({'data': root_layer.conf, 'layer_2_target': root_layer.layer_2_target,
+                                              'initial_layer': root_layer.name})}
+    return {'o': name, 'a': encode_value(value.__dict__)}
+
+
+def decode_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [decode_value(elem) for elem in value]
+    elif not isinstance(value, dict):
+        return value
+    elif 't' in value:
+        return tuple([decode_value(elem) for elem in value['t']])
+    elif 's' in value:
+        return set([decode_value(elem) for elem in value['s']])
+    elif 'd' in value:
+        return dict((decode_value(key), decode_value(elem)) for key, elem in value['d'].iteritems())
+    elif 'm' in value:
+        return dict((decode_value(key), decode_value(elem)) for key, elem in value['m'])
+
+    _, classes = get_registry()
+    name = decode_value(value['o'])
+    if name not in classes:
+        raise ValueError('unknown type %s' % name)
+    attributes = decode_value(value['a'])
+    if name == 'SonataRawFields':
+        from sonata.sonata_layers import get_sonata_raw_fields
+        return get_sonata_raw_fields(attributes['data'], attributes['layer_2_target'], attributes['initial_layer'])
+    obj = classes[name].__new__(classes[name])
+    obj.__dict__.update(attributes)
+    return obj
+
+
+def encode_message(message):
+    payload = json.dumps(encode_value(message), separators=(',', ':'))
+    flags = 0
+    if len(payload) >= COMPRESS_MIN_SIZE:
+        payload = zlib.compress(payload)
+        flags |= FLAG_COMPRESSED
+    return WIRE_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, flags) + payload
+
+
+def is_encoded_message(data):
+    return isinstance(data, str) and data[:len(WIRE_MAGIC)] == WIRE_MAGIC
+
+
+def decode_message(data):
+    magic, version, flags = WIRE_HEADER.unpack_from(data, 0)
+    if magic != WIRE_MAGIC:
+        raise ValueError('not a sonata message')
+    if version != WIRE_VERSION:
+        raise ValueError('unsupported message version %i' % version)
+    payload = data[WIRE_HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    return decode_value(json.loads(payload))